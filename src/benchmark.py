@@ -0,0 +1,664 @@
+'''
+Offline benchmarks for the FarmBot pipeline.
+Everything runs against local stand-ins (see local_broker.py), so no FarmBot,
+broker or camera is needed. Pick a suite with the positional argument, e.g.
+    python benchmark.py rpc --repeat 50
+'''
+import os
+from argparse import ArgumentParser, Namespace
+from ctypes import POINTER, c_float, cast, sizeof
+from concurrent.futures import TimeoutError as FutureTimeout
+from statistics import mean, median
+from time import perf_counter, sleep
+from typing import Callable, Dict, List
+
+from client import FarmbotClient
+from local_broker import LocalBroker
+
+
+def report(name: str, samples: List[float]) -> None:
+    '''Print mean/median/max of timings given in seconds'''
+    print('{:<40} n={:<5} mean={:8.3f} ms  median={:8.3f} ms  max={:8.3f} ms'.format(
+        name, len(samples), 1000*mean(samples), 1000*median(samples), 1000*max(samples)))
+
+
+class _PollingFarmbotClient(FarmbotClient):
+    '''
+    Waits for replies the way the client did before replies were signalled
+    per request: checking every 100 ms until the status shows up
+    '''
+    def _wait_for_status(self, pending, timeout):
+        timeout_counter = int(timeout / 0.1)
+        while not pending.done():
+            sleep(0.1)
+            timeout_counter -= 1
+            if timeout_counter == 0:
+                raise FutureTimeout()
+        return pending.result()
+
+
+def bench_rpc(args: Namespace) -> None:
+    '''
+    Per-RPC overhead: wall time of client.move() minus the simulated move time
+    '''
+    clients = {'polling (before)': _PollingFarmbotClient,
+               'event-driven': FarmbotClient}
+    for name, client_class in clients.items():
+        client = client_class('device_0', 'token',
+                              mqtt_client=LocalBroker(latency=args.latency,
+                                                      round_trip=args.round_trip))
+        client.move(0, 0, 0)  # connect and warm up
+        samples = []
+        for i in range(args.repeat):
+            start = perf_counter()
+            client.move(i % 100, 0, 0)
+            samples.append(perf_counter() - start - args.latency - args.round_trip)
+        client.shutdown()
+        report('rpc overhead, ' + name, samples)
+
+
+def bench_batch(args: Namespace) -> None:
+    '''
+    A sweep of moves sent one by one versus queued with move_batch
+    '''
+    points = [(10*i, 0, 0) for i in range(args.repeat)]
+    client = FarmbotClient('device_0', 'token',
+                           mqtt_client=LocalBroker(latency=args.latency, round_trip=args.round_trip))
+    client.move(0, 0, 0)  # connect and warm up
+
+    start = perf_counter()
+    for x, y, z in points:
+        client.move(x, y, z)
+    report('{} moves, sequential'.format(len(points)), [perf_counter() - start])
+
+    start = perf_counter()
+    client.move_batch(points)
+    report('{} moves, move_batch'.format(len(points)), [perf_counter() - start])
+    client.shutdown()
+
+
+def bench_frame(args: Namespace) -> None:
+    '''
+    Per-frame preprocessing: a darknet IMAGE made, filled from a tobytes() copy and freed
+    for every frame, versus detect.Detector reusing one IMAGE and its resize buffers.
+    Needs libdarknet and the network given by --config_file/--data_file/--weights
+    '''
+    import tracemalloc
+    import cv2
+    import numpy as np
+    import darknet
+    from detect import Detector
+
+    network, class_names, class_colors = darknet.load_network(
+        args.config_file, args.data_file, args.weights, batch_size=1)
+    frame = np.random.randint(0, 256, (args.frame_height, args.frame_width, 3), dtype=np.uint8)
+    width, height = darknet.network_width(network), darknet.network_height(network)
+
+    def allocate_per_frame():
+        darknet_image = darknet.make_image(width, height, 3)
+        image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        image_resized = cv2.resize(image_rgb, (width, height), interpolation=cv2.INTER_LINEAR)
+        darknet.copy_image_from_bytes(darknet_image, image_resized.tobytes())
+        darknet.free_image(darknet_image)
+
+    detector = Detector(network, class_names, class_colors)
+    for name, prepare in (('make_image per frame (before)', allocate_per_frame),
+                          ('reused Detector buffers', lambda: detector.prepare(frame))):
+        prepare()  # warm up
+        samples = []
+        tracemalloc.start()
+        for _ in range(args.repeat):
+            start = perf_counter()
+            prepare()
+            samples.append(perf_counter() - start)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report('frame prep, ' + name, samples)
+        print('{:<40} python heap peak {:.1f} KiB'.format('', peak / 1024))
+
+    samples = []
+    for _ in range(args.repeat):
+        start = perf_counter()
+        detector.detect(frame, 0.25)
+        samples.append(perf_counter() - start)
+    report('frame detect, Detector', samples)
+    detector.close()
+
+
+def bench_throughput(args: Namespace) -> None:
+    '''
+    Frames per second of detect.BatchDetector for batch sizes 1..--max_batch_size,
+    the network is loaded again for every batch size
+    '''
+    import numpy as np
+    import darknet
+    from detect import BatchDetector
+
+    frames = [np.random.randint(0, 256, (args.frame_height, args.frame_width, 3), dtype=np.uint8)
+              for _ in range(args.max_batch_size)]
+    for batch_size in range(1, args.max_batch_size + 1):
+        network, class_names, _ = darknet.load_network(
+            args.config_file, args.data_file, args.weights, batch_size=batch_size)
+        detector = BatchDetector(network, class_names, batch_size)
+        detector.detect(frames[:batch_size], 0.25)  # warm up
+        start = perf_counter()
+        for _ in range(args.repeat):
+            detector.detect(frames[:batch_size], 0.25)
+        elapsed = perf_counter() - start
+        print('batch size {:<3} {:8.2f} frames/s  {:8.1f} ms/batch'.format(
+            batch_size, batch_size * args.repeat / elapsed, 1000 * elapsed / args.repeat))
+        darknet.free_network_ptr(network)
+
+
+def bench_workers(args: Namespace) -> None:
+    '''
+    Images per second of detect.detect_parallel for 1..--max_workers worker processes,
+    on --num_images random photos. The time includes starting the workers and loading
+    the network in each of them, like a real run
+    '''
+    import tempfile
+    import cv2
+    import numpy as np
+    from detect import detect_parallel
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, 'annotations'))
+        names = []
+        for index in range(args.num_images):
+            names.append(os.path.join(directory, '{:04d}.jpg'.format(index)))
+            cv2.imwrite(names[-1], np.random.randint(0, 256, (args.frame_height, args.frame_width, 3),
+                                                     dtype=np.uint8))
+        detect_args = Namespace(input=directory, weights=args.weights, config_file=args.config_file,
+                                data_file=args.data_file, thresh=0.25, batch_size=1,
+                                save_labels=False, ext_output=False)
+        for workers in range(1, args.max_workers + 1):
+            detect_args.workers = workers
+            start = perf_counter()
+            detect_parallel(names, detect_args)
+            elapsed = perf_counter() - start
+            print('{:<3} workers {:8.2f} images/s  {:8.2f} s'.format(workers, len(names) / elapsed, elapsed))
+
+
+def bench_server(args: Namespace) -> None:
+    '''
+    What a detection costs cold (load the network, then detect, like every run of
+    detect.py) against a request to a warm detect_server over its Unix socket
+    '''
+    import tempfile
+    import threading
+    import cv2
+    import numpy as np
+    from detect_server import DetectionClient, DetectionServer
+
+    frame = np.random.randint(0, 256, (args.frame_height, args.frame_width, 3), dtype=np.uint8)
+    data = cv2.imencode('.jpg', frame)[1].tobytes()
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, 'detect.sock')
+        start = perf_counter()
+        server = DetectionServer(socket_path, args.config_file, args.data_file, args.weights)
+        server.detect(data, None, 0.25)
+        report('cold: load network + first detection', [perf_counter() - start])
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with DetectionClient(socket_path) as client:
+                samples = []
+                for _ in range(args.repeat):
+                    start = perf_counter()
+                    client.detect(data, 0.25)
+                    samples.append(perf_counter() - start)
+                report('warm: request to the server', samples)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def synthetic_detections(num: int, classes: int, seed: int = 0, scattered: bool = False):
+    '''
+    A ctypes DETECTION array like get_network_boxes returns, with random boxes and sparse
+    class probabilities; also returns the prob buffers, which must be kept alive with it.
+    The prob arrays are laid out like darknet's consecutive callocs, a fixed distance
+    apart, unless scattered
+    '''
+    import random
+    import darknet
+
+    rng = random.Random(seed)
+    detections = (darknet.DETECTION * num)()
+    stride = classes + 4  # room for a malloc chunk header between the arrays
+    block = (c_float * (stride * num))()
+    probs = [block]
+    for row, detection in enumerate(detections):
+        if scattered:
+            prob = (c_float * classes)()
+            probs.append(prob)
+        else:
+            prob = (c_float * classes).from_buffer(block, row * stride * sizeof(c_float))
+        for idx in range(classes):
+            prob[idx] = rng.random() if rng.random() < 0.3 else 0.0
+        detection.bbox = darknet.BOX(rng.uniform(0, 416), rng.uniform(0, 416),
+                                     rng.uniform(5, 80), rng.uniform(5, 80))
+        detection.classes = classes
+        detection.prob = cast(prob, POINTER(c_float))
+        best = max(range(classes), key=lambda idx: prob[idx])
+        detection.best_class_idx = best if prob[best] > 0 else -1
+        detection.objectness = prob[best]
+    return cast(detections, POINTER(darknet.DETECTION)), (detections, probs)
+
+
+def bench_negatives(args: Namespace) -> None:
+    '''
+    darknet.remove_negatives and remove_negatives_faster against their NumPy versions,
+    on --num_boxes synthetic detections with --classes classes; also checks they agree
+    '''
+    import darknet
+
+    class_names = ['class_{}'.format(idx) for idx in range(args.classes)]
+    detections, _buffers = synthetic_detections(args.num_boxes, args.classes)
+    scattered, _scattered_buffers = synthetic_detections(args.num_boxes, args.classes, scattered=True)
+    assert darknet.remove_negatives(scattered, class_names, args.num_boxes) == \
+        darknet.remove_negatives_vectorized(scattered, class_names, args.num_boxes), \
+        'results differ for scattered prob arrays'
+    pairs = (('remove_negatives', darknet.remove_negatives, darknet.remove_negatives_vectorized),
+             ('remove_negatives_faster', darknet.remove_negatives_faster,
+              darknet.remove_negatives_faster_vectorized))
+    for name, loop, vectorized in pairs:
+        assert loop(detections, class_names, args.num_boxes) == \
+            vectorized(detections, class_names, args.num_boxes), name + ' results differ'
+        for label, function in (('loop', loop), ('vectorized', vectorized)):
+            samples = []
+            for _ in range(args.repeat):
+                start = perf_counter()
+                function(detections, class_names, args.num_boxes)
+                samples.append(perf_counter() - start)
+            report('{}, {}'.format(name, label), samples)
+
+
+def bench_nms(args: Namespace) -> None:
+    '''
+    darknet's do_nms_sort against darknet.non_max_suppression_fast on the same --num_boxes
+    synthetic detections with --classes classes, and non_max_suppression_batch over
+    --max_batch_size such images; also checks they keep the same boxes
+    '''
+    import darknet
+
+    def records(detections):
+        return sorted(darknet.make_detections(detections, args.classes, args.num_boxes),
+                      key=lambda detection: (detection.class_id, -detection.confidence))
+
+    samples, vectorized_samples = [], []
+    for seed in range(args.repeat):
+        detections, _buffers = synthetic_detections(args.num_boxes, args.classes, seed=seed)
+        before = darknet.make_detections(detections, args.classes, args.num_boxes)
+        start = perf_counter()
+        kept = darknet.non_max_suppression_fast(before, 0.45)
+        vectorized_samples.append(perf_counter() - start)
+        start = perf_counter()
+        darknet.do_nms_sort(detections, args.num_boxes, args.classes, 0.45)
+        samples.append(perf_counter() - start)
+        assert records(detections) == sorted(kept, key=lambda detection: (detection.class_id, -detection.confidence)), \
+            'non_max_suppression_fast keeps other boxes than do_nms_sort'
+    report('do_nms_sort', samples)
+    report('non_max_suppression_fast', vectorized_samples)
+    print('{} of {} boxes kept'.format(len(kept), len(before)))
+
+    batch = [darknet.make_detections(synthetic_detections(args.num_boxes, args.classes, seed=seed)[0],
+                                     args.classes, args.num_boxes) for seed in range(args.max_batch_size)]
+    samples = []
+    for _ in range(args.repeat):
+        start = perf_counter()
+        darknet.non_max_suppression_batch(batch, 0.45)
+        samples.append(perf_counter() - start)
+    report('non_max_suppression_batch of {}'.format(len(batch)), samples)
+
+
+def bench_route(args: Namespace) -> None:
+    '''
+    Gantry travel of planner.plan_route against detection order, for 10, 30 and 100
+    random targets on a 2400 x 1200 mm bed, starting from the origin
+    '''
+    import numpy as np
+    from planner import plan_route, route_report
+
+    rng = np.random.default_rng(0)
+    for num in (10, 30, 100):
+        targets = rng.uniform((0, 0), (2400, 1200), size=(num, 2))
+        samples = []
+        for _ in range(args.repeat):
+            start = perf_counter()
+            order = plan_route(targets, start=(0, 0))
+            samples.append(perf_counter() - start)
+        planned, naive = route_report(targets, order, start=(0, 0))
+        report('plan {} targets'.format(num), samples)
+        print('    travel {:7.1f} s planned, {:7.1f} s in detection order'.format(planned, naive))
+
+
+def bench_scan(args: Namespace) -> None:
+    '''
+    Photos, bed coverage and travel of the fixed move.scan grid against
+    planner.scan_waypoints at several overlaps, for a 1280 x 720 camera over the whole bed
+    '''
+    import numpy as np
+    from planner import BED_X, BED_Y, camera_footprint, route_time, scan_waypoints
+
+    cam_matrix = np.array([[1400.0, 0.0, 0.0], [0.0, 1400.0, 0.0], [640.0, 360.0, 1.0]])
+    footprint = camera_footprint(cam_matrix)
+    cells = np.stack(np.meshgrid(np.arange(5, BED_X, 10), np.arange(5, BED_Y, 10)), axis=-1).reshape((-1, 2))
+
+    def coverage(waypoints):
+        points = np.asarray(waypoints, dtype=float)
+        covered = np.zeros(len(cells), dtype=bool)
+        for x, y in points:
+            covered |= (cells[:, 0] >= x + footprint[0]) & (cells[:, 0] <= x + footprint[1]) \
+                & (cells[:, 1] >= y + footprint[2]) & (cells[:, 1] <= y + footprint[3])
+        return covered.mean(), route_time(points, range(len(points)), start=(0, 0))
+
+    print('footprint {:.0f} x {:.0f} mm'.format(footprint[1] - footprint[0], footprint[3] - footprint[2]))
+    grid = [(x, y) for x in range(0, 1300, 1000) for y in range(0, 1000, 1000)]
+    print('{:<24} {:3d} photos, {:6.1%} of the bed, travel {:6.1f} s'.format(
+        'fixed grid', len(grid), *coverage(grid)))
+    for overlap in (0.0, 0.1, 0.2, 0.3):
+        samples = []
+        for _ in range(args.repeat):
+            start = perf_counter()
+            waypoints = scan_waypoints(footprint, overlap)
+            samples.append(perf_counter() - start)
+        print('{:<24} {:3d} photos, {:6.1%} of the bed, travel {:6.1f} s'.format(
+            'overlap {:.0%}'.format(overlap), len(waypoints), *coverage(waypoints)))
+        report('plan overlap {:.0%}'.format(overlap), samples)
+
+
+def bench_calibration(args: Namespace) -> None:
+    '''
+    Reading the camera calibration: scipy loadmat of ../static/camera_no_distortion.mat
+    against the calibration cache, in process and as the start-up of a fresh interpreter
+    '''
+    import shutil
+    import subprocess
+    import sys
+    import tempfile
+    from pathlib import Path
+    from calibration import load_calibration, read_mat
+
+    source = Path(__file__).resolve().parent.parent / 'static'
+    with tempfile.TemporaryDirectory() as directory:
+        cam_path = Path(shutil.copy(str(source / 'camera_no_distortion.mat'), directory))
+        offset_path = Path(shutil.copy(str(source / 'distance.txt'), directory))
+        load_calibration(cam_path, offset_path)
+        for name, function in (('loadmat', lambda: read_mat(cam_path)),
+                               ('cache', lambda: load_calibration(cam_path, offset_path))):
+            samples = []
+            for _ in range(args.repeat):
+                start = perf_counter()
+                function()
+                samples.append(perf_counter() - start)
+            report(name, samples)
+        code = 'import sys; sys.path.insert(0, {!r}); from pathlib import Path; import calibration; '.format(
+            str(Path(__file__).resolve().parent))
+        for name, call in (('fresh process, loadmat', 'calibration.read_mat(Path({!r}))'.format(str(cam_path))),
+                           ('fresh process, cache', 'calibration.load_calibration(Path({!r}), Path({!r}))'.format(
+                               str(cam_path), str(offset_path)))):
+            samples = []
+            for _ in range(max(1, args.repeat // 4)):
+                start = perf_counter()
+                subprocess.run([sys.executable, '-c', code + call], check=True)
+                samples.append(perf_counter() - start)
+            report(name, samples)
+
+
+def bench_session(args: Namespace) -> None:
+    '''
+    The location stage of a scan of --num_images photos and --num_boxes detections:
+    location.cal_location over location.txt and one annotation file per photo, against
+    cal_location over a session.ScanSession that detect.detect wrote the same detections
+    in, and session.locate alone; then a region and class query of the located scan
+    '''
+    import tempfile
+    from pathlib import Path
+    import numpy as np
+    from calibration import load_calibration
+    from location import cal_location
+    from records import Detection
+    from session import ScanSession
+
+    rng = np.random.default_rng(0)
+    source = Path(__file__).resolve().parent.parent / 'static'
+    photos = rng.integers(0, args.num_images, size=args.num_boxes)
+    with tempfile.TemporaryDirectory() as directory:
+        files = Namespace(camera_matrix=source / 'camera_no_distortion.mat', offset=source / 'distance.txt',
+                          annotations=Path(directory, 'annotations'), locations=Path(directory, 'locations'))
+        files.annotations.mkdir()
+        files.locations.mkdir()
+        with ScanSession(os.path.join(directory, 'scans.sqlite')) as session:
+            detected = []
+            with open(files.locations / 'location.txt', 'w') as locations:
+                for photo in range(args.num_images):
+                    position = (int(rng.integers(0, 2400)), int(rng.integers(0, 1200)), 0)
+                    image = '{:04d}.jpg'.format(photo)
+                    session.add_waypoint(photo, position, image)
+                    locations.write('{} {} {}\n'.format(*position))
+                    detections = [Detection(int(rng.integers(0, 2)), *rng.uniform(0, 720, 4), 90.0)
+                                  for _ in range(int(np.sum(photos == photo)))]
+                    detected.append((image, detections))
+                    with open(files.annotations / '{:04d}.txt'.format(photo), 'w') as annotations:
+                        for detection in detections:
+                            annotations.write('{} {:.4f} {:.4f} {:.4f} {:.4f} {:.4f}\n'.format(*detection))
+            session.add_image_detections(detected)
+            calibration = load_calibration(files.camera_matrix, files.offset)
+            for name, function in (('files', lambda: cal_location(files, with_photo=True)),
+                                   ('session via cal_location', lambda: cal_location(files, True, session)),
+                                   ('session', lambda: session.locate(calibration.cam_matrix, (0, 0), (0, 0))),
+                                   ('query', lambda: session.query((0, 1200, 0, 600), 1))):
+                samples = []
+                for _ in range(args.repeat):
+                    start = perf_counter()
+                    function()
+                    samples.append(perf_counter() - start)
+                report('{} photos, {}'.format(args.num_images, name), samples)
+
+
+def bench_transform(args: Namespace) -> None:
+    '''
+    Pixel to global coordinates for --num_boxes boxes spread over 100 photos:
+    cam_coordinate/global_coordinate per box versus location.pixels_to_global
+    '''
+    import numpy as np
+    from location import cam_coordinate, global_coordinate, pixels_to_global
+
+    rng = np.random.default_rng(0)
+    cam_matrix = np.array([[1400.0, 0.0, 0.0], [0.0, 1400.0, 0.0], [640.0, 360.0, 1.0]])
+    pixels = rng.uniform((0, 0), (1280, 720), size=(args.num_boxes, 2))
+    cam_locations = rng.integers(0, 1200, size=(100, 3))[rng.integers(0, 100, size=args.num_boxes)]
+    offsets = ((10, 20), (30, 40))
+
+    def per_box():
+        return [global_coordinate(cam_coordinate(x, y, cam_matrix), location, *offsets)
+                for (x, y), location in zip(pixels, cam_locations)]
+
+    assert np.allclose(per_box(), pixels_to_global(pixels, cam_locations, cam_matrix, *offsets))
+    for name, function in (('per box', per_box),
+                           ('vectorized', lambda: pixels_to_global(pixels, cam_locations, cam_matrix, *offsets))):
+        samples = []
+        for _ in range(args.repeat):
+            start = perf_counter()
+            function()
+            samples.append(perf_counter() - start)
+        report('{} boxes, {}'.format(args.num_boxes, name), samples)
+
+
+def bench_dedup(args: Namespace) -> None:
+    '''
+    cluster.merge_duplicates on --num_detections synthetic detections (targets seen by
+    1-4 photos with some position noise), and the old pairwise loop on a small subset
+    '''
+    import numpy as np
+    from pandas import DataFrame
+    from cluster import merge_duplicates
+
+    rng = np.random.default_rng(0)
+    targets = rng.uniform((0, 0), (2400 * 10, 1200 * 10), size=(args.num_detections // 2, 2))
+    seen = targets[rng.integers(0, len(targets), size=args.num_detections)]
+    table = DataFrame({'class': rng.integers(0, 7, size=args.num_detections),
+                       'x': seen[:, 0] + rng.normal(0, 10, size=args.num_detections),
+                       'y': seen[:, 1] + rng.normal(0, 10, size=args.num_detections),
+                       'confidence': rng.uniform(25, 100, size=args.num_detections)})
+
+    def pairwise(table_coordinate, tolerance=50.0):
+        # main.remove_overlap before the KD-tree, minus its drop() that never took effect
+        num_coordinates = len(table_coordinate)
+        for i in range(num_coordinates - 1):
+            x, y, confidence = table_coordinate.loc[i, ['x', 'y', 'confidence']]
+            for j in range(i + 1, num_coordinates):
+                x_j, y_j, confidence_j = table_coordinate.loc[j, ['x', 'y', 'confidence']]
+                np.sqrt((x - x_j) * (x - x_j) + (y - y_j) * (y - y_j))
+
+    subset = table.iloc[:args.pairwise_detections].reset_index(drop=True)
+    start = perf_counter()
+    pairwise(subset)
+    report('{} detections, pairwise loop'.format(len(subset)), [perf_counter() - start])
+    for size in (len(subset), len(table)):
+        for fuse in (False, True):
+            samples = []
+            for _ in range(args.repeat):
+                start = perf_counter()
+                merged = merge_duplicates(table.iloc[:size], fuse=fuse)
+                samples.append(perf_counter() - start)
+            report('{} detections, KD-tree{}'.format(size, ', fused' if fuse else ''), samples)
+    print('{} detections merged into {} targets'.format(len(table), len(merged)))
+
+
+def bench_fusion(args: Namespace) -> None:
+    '''
+    A synthetic scan: fruits in pairs a few cm apart, photos on a grid that overlap by half,
+    every photo sees the fruits under it with some position noise. Counts the targets
+    cluster.merge_duplicates and cluster.fuse_views find against the real number
+    '''
+    import numpy as np
+    from pandas import DataFrame
+    from cluster import fuse_views, merge_duplicates
+
+    rng = np.random.default_rng(0)
+    num_fruits = args.num_detections // 100
+    first = rng.uniform((0, 0), (2400, 1200), size=(num_fruits // 2, 2))
+    fruits = np.concatenate((first, first + rng.normal(0, 40, size=first.shape)))
+    footprint, step = 400.0, 200.0
+    rows = []
+    for photo, (cx, cy) in enumerate((x, y) for x in np.arange(0, 2400, step) for y in np.arange(0, 1200, step)):
+        seen = np.flatnonzero((np.abs(fruits[:, 0] - cx) < footprint / 2) & (np.abs(fruits[:, 1] - cy) < footprint / 2))
+        xy = fruits[seen] + rng.normal(0, 8, size=(len(seen), 2))
+        for (x, y) in xy:
+            rows.append((0, x, y, rng.uniform(25, 100), photo))
+    table = DataFrame(rows, columns=['class', 'x', 'y', 'confidence', 'photo'])
+    print('{} fruits, {} detections in {} photos'.format(len(fruits), len(table), table['photo'].nunique()))
+    for name, fusion in (('merge_duplicates', lambda: merge_duplicates(table, args.tolerance)),
+                         ('fuse_views', lambda: fuse_views(table, args.tolerance))):
+        samples = []
+        for _ in range(args.repeat):
+            start = perf_counter()
+            targets = fusion()
+            samples.append(perf_counter() - start)
+        report('{} -> {} targets'.format(name, len(targets)), samples)
+
+
+def bench_cache(args: Namespace) -> None:
+    '''
+    What a cached photo costs instead of an inference: hashing a --frame_width x
+    --frame_height JPEG and looking it up in a cache of --num_detections photos
+    '''
+    import tempfile
+    import cv2
+    import numpy as np
+    from cache import DetectionCache, content_digest
+    from records import Detection
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(args.frame_height, args.frame_width, 3), dtype=np.uint8)
+    data = cv2.imencode('.jpg', frame)[1].tobytes()
+    detections = [Detection(0, 10.0, 20.0, 30.0, 40.0, 90.0)] * args.num_boxes
+    with tempfile.TemporaryDirectory() as directory:
+        with DetectionCache(os.path.join(directory, 'cache.sqlite'), 'benchmark', args.num_detections) as cache:
+            samples = []
+            for index in range(args.num_detections):
+                start = perf_counter()
+                cache.put('{:040x}'.format(index), detections)
+                samples.append(perf_counter() - start)
+            report('put, {} boxes'.format(args.num_boxes), samples[-args.repeat:])
+            samples = []
+            for index in rng.integers(0, args.num_detections, size=args.repeat):
+                start = perf_counter()
+                cache.get('{:040x}'.format(index))
+                samples.append(perf_counter() - start)
+            report('get of {} entries'.format(args.num_detections), samples)
+    samples = []
+    for _ in range(args.repeat):
+        start = perf_counter()
+        content_digest(data)
+        samples.append(perf_counter() - start)
+    report('hash a {} kB photo'.format(len(data) // 1024), samples)
+
+
+SUITES: Dict[str, Callable[[Namespace], None]] = {
+    'rpc': bench_rpc,
+    'batch': bench_batch,
+    'frame': bench_frame,
+    'throughput': bench_throughput,
+    'negatives': bench_negatives,
+    'transform': bench_transform,
+    'dedup': bench_dedup,
+    'fusion': bench_fusion,
+    'nms': bench_nms,
+    'route': bench_route,
+    'scan': bench_scan,
+    'session': bench_session,
+    'cache': bench_cache,
+    'calibration': bench_calibration,
+    'workers': bench_workers,
+    'server': bench_server,
+}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Offline benchmarks against local stand-ins')
+    parser.add_argument('suite', choices=sorted(SUITES), help='which benchmark to run')
+    parser.add_argument('--repeat', type=int, default=20, help='number of timed iterations')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='simulated time the bot spends on each request in seconds')
+    parser.add_argument('--round_trip', type=float, default=0.01,
+                        help='simulated network round trip between client and bot in seconds')
+    parser.add_argument('--frame_width', type=int, default=1280, help='width of the synthetic camera frame')
+    parser.add_argument('--frame_height', type=int, default=720, help='height of the synthetic camera frame')
+    parser.add_argument('--num_boxes', type=int, default=500, help='synthetic detections per image')
+    parser.add_argument('--classes', type=int, default=10, help='classes of the synthetic detections')
+    parser.add_argument('--num_detections', type=int, default=20000, help='synthetic detections to merge')
+    parser.add_argument('--tolerance', type=float, default=50.0, help='merge distance (mm)')
+    parser.add_argument('--pairwise_detections', type=int, default=200,
+                        help='detections for the quadratic pairwise loop')
+    parser.add_argument('--num_images', type=int, default=64, help='photos for the worker pool')
+    parser.add_argument('--max_workers', type=int, default=os.cpu_count() or 1,
+                        help='largest worker pool to try')
+    parser.add_argument('--max_batch_size', type=int, default=8, help='largest batch size to try')
+    parser.add_argument("--weights", default="../weights/yolov3-vattenhallen_best.weights",
+                        help="yolo weights path")
+    parser.add_argument("--config_file", default="../cfg/yolov3-vattenhallen-test.cfg",
+                        help="path to config file")
+    parser.add_argument("--data_file", default="../data/vattenhallen.data",
+                        help="path to data file")
+    parser.add_argument('--fake', action='store_true',
+                        help='run the network suites on fake_darknet instead of libdarknet'
+                        ' (not in the worker processes of the workers suite)')
+    arguments = parser.parse_args()
+
+    if arguments.fake:
+        import darknet
+        from fake_darknet import FakeDarknet
+        darknet.configure(backend=FakeDarknet(
+            class_names=['class{}'.format(idx) for idx in range(arguments.classes)],
+            detections=lambda frame: [(0, 208.0, 208.0, 40.0, 40.0, 0.9)] * arguments.num_boxes))
+        if not os.path.exists(arguments.weights):
+            # the fake never reads them, but a detect_server fingerprints the files it serves
+            import atexit
+            import tempfile
+            handle, arguments.weights = tempfile.mkstemp(suffix='.weights')
+            os.close(handle)
+            atexit.register(os.remove, arguments.weights)
+    SUITES[arguments.suite](arguments)
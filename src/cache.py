@@ -0,0 +1,158 @@
+'''
+Persistent cache of detection results, so re-running the detector over a folder only
+infers the photos that are new or changed.
+An entry is keyed by the SHA-1 of the encoded photo and by a fingerprint of everything
+else that decides the result: the weights, the config and data files and the threshold.
+Entries are Detection records in pixels of the original photo, the numbers that go into
+the annotation files. The cache holds at most max_entries photos, the least recently
+used ones are evicted first.
+'''
+import hashlib
+import os
+import sqlite3
+import time
+from logging import getLogger
+from typing import List, Optional
+
+import numpy as np
+
+from records import Detection
+
+
+_LOG = getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS detections (
+    fingerprint TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    records BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (fingerprint, digest)
+);
+CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used);
+'''
+
+"""Hits whose last_used is kept in memory before it is written"""
+_TOUCH_BATCH = 64
+
+
+def content_digest(data: bytes) -> str:
+    '''SHA-1 of the encoded photo'''
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    '''content_digest of a file, read in chunks'''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def network_fingerprint(weights: str, config_file: str, data_file: str) -> str:
+    '''
+    Identifies a network by its files, wherever they are and however they are named.
+    The config and data files are hashed; the weights, hundreds of MB, by size and
+    modification time, which change whenever they are retrained or replaced
+    '''
+    stat = os.stat(weights)
+    parts = [str(stat.st_size), str(stat.st_mtime_ns), file_digest(config_file), file_digest(data_file)]
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+
+def fingerprint(network: str, thresh: float) -> str:
+    '''
+    Identifies the network (see network_fingerprint) and settings the detections were made with
+    '''
+    return hashlib.sha1('{}\n{!r}'.format(network, float(thresh)).encode()).hexdigest()
+
+
+def _pack(detections: List[Detection]) -> bytes:
+    return np.array([tuple(detection) for detection in detections], dtype=np.float64).tobytes()
+
+
+def _unpack(blob: bytes) -> List[Detection]:
+    rows = np.frombuffer(blob, dtype=np.float64).reshape((-1, 6))
+    return [Detection(int(row[0]), *row[1:]) for row in rows.tolist()]
+
+
+class DetectionCache:
+    def __init__(self, path: str, fingerprint: str, max_entries: int = 10000):
+        '''
+        path: SQLite file, created if it does not exist
+        fingerprint: see fingerprint(), entries made with other settings are never returned
+        max_entries: photos kept over all fingerprints
+        '''
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+        self._entries = self._db.execute('SELECT COUNT(*) FROM detections').fetchone()[0]
+        # last_used of the hits, written in batches so a lookup never holds a write lock
+        self._touched = {}
+
+    def get(self, digest: str) -> Optional[List[Detection]]:
+        '''The cached detections of a photo, None if it has not been seen with these settings'''
+        row = self._db.execute('SELECT records FROM detections WHERE fingerprint = ? AND digest = ?',
+                               (self.fingerprint, digest)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched[digest] = time.time()
+        if len(self._touched) >= _TOUCH_BATCH:
+            self._flush_touches()
+        return _unpack(row[0])
+
+    def _flush_touches(self) -> None:
+        '''Write the last_used times of the hits since the last flush in one transaction'''
+        if not self._touched:
+            return
+        with self._db:
+            self._db.executemany('UPDATE detections SET last_used = ? WHERE fingerprint = ? AND digest = ?',
+                                 [(used, self.fingerprint, digest) for digest, used in self._touched.items()])
+        self._touched = {}
+
+    def put(self, digest: str, detections: List[Detection]) -> None:
+        self._flush_touches()
+        row = (_pack(detections), time.time(), self.fingerprint, digest)
+        with self._db:
+            # counted here instead of a COUNT(*), which scans the whole table
+            if self._db.execute('UPDATE detections SET records = ?, last_used = ? '
+                                'WHERE fingerprint = ? AND digest = ?', row).rowcount == 0:
+                self._db.execute('INSERT INTO detections (records, last_used, fingerprint, digest) '
+                                 'VALUES (?, ?, ?, ?)', row)
+                self._entries += 1
+            if self._entries > self.max_entries:
+                self._evict(self._entries - self.max_entries)
+
+    def _evict(self, count: int) -> None:
+        evicted = self._db.execute('DELETE FROM detections WHERE rowid IN '
+                                   '(SELECT rowid FROM detections ORDER BY last_used LIMIT ?)', (count,)).rowcount
+        self._entries -= evicted
+        self.evictions += evicted
+        _LOG.debug('Evicted {} cached detections'.format(evicted))
+
+    def report(self) -> str:
+        lookups = self.hits + self.misses
+        return 'Detection cache: {} hits, {} misses ({:.0%} hit rate), {} evicted, {} entries'.format(
+            self.hits, self.misses, self.hits / lookups if lookups else 0, self.evictions, self._entries)
+
+    def close(self) -> None:
+        if self._db is not None:
+            _LOG.info(self.report())
+            self._flush_touches()
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
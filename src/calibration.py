@@ -0,0 +1,193 @@
+'''
+Camera calibration and offsets, read once from the MATLAB .mat file and distance.txt
+and kept in an .npz next to the .mat, so a run does not import scipy.io to parse the
+MATLAB struct every time.
+The cache records the size, modification time and SHA-1 of its sources. It is used
+as long as they have not changed: an unchanged stamp is trusted, a changed stamp with
+the same content is refreshed, anything else rebuilds it from the sources.
+'''
+import hashlib
+import os
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+_LOG = getLogger(__name__)
+
+"""Bump when the cached arrays change meaning"""
+_VERSION = 1
+_SUFFIX = '.calibration.npz'
+
+
+class Calibration:
+    def __init__(self, cam_matrix: np.ndarray, radial: np.ndarray, tangential: np.ndarray,
+                 image_size: Tuple[int, int], cam_offset: Optional[Tuple[int, int]] = None,
+                 gripper_offset: Optional[Tuple[int, int]] = None):
+        '''
+        cam_matrix: K as MATLAB stores it, transposed, like location.load_cam_matrix
+        radial, tangential: MATLAB RadialDistortion and TangentialDistortion
+        image_size: (width, height) in pixels the camera was calibrated at
+        cam_offset, gripper_offset: see location.read_offsets, None without distance.txt
+        '''
+        self.cam_matrix = cam_matrix
+        self.radial = radial
+        self.tangential = tangential
+        self.image_size = image_size
+        self.cam_offset = cam_offset
+        self.gripper_offset = gripper_offset
+
+    @property
+    def K(self) -> np.ndarray:
+        '''K in the usual layout, focal lengths and principal point in the last column'''
+        return self.cam_matrix.transpose()
+
+    @property
+    def K_inv(self) -> np.ndarray:
+        '''inv(K), see location.inverse_cam_matrix'''
+        from location import inverse_cam_matrix
+        return inverse_cam_matrix(self.cam_matrix)
+
+    @property
+    def distortion(self) -> np.ndarray:
+        '''Distortion coefficients in OpenCV order, k1, k2, p1, p2[, k3]'''
+        return np.concatenate((self.radial[:2], self.tangential, self.radial[2:]))
+
+    def validate(self) -> None:
+        '''Raise ValueError unless this looks like a pinhole camera'''
+        if self.cam_matrix.shape != (3, 3) or not np.all(np.isfinite(self.cam_matrix)):
+            raise ValueError('Intrinsic matrix must be a finite 3 x 3 matrix, not\n{}'.format(self.cam_matrix))
+        if self.cam_matrix[2, 2] != 1 or np.any(self.cam_matrix[:2, 2] != 0):
+            raise ValueError('Intrinsic matrix is not stored transposed like MATLAB does\n{}'.format(
+                self.cam_matrix))
+        if self.cam_matrix[0, 0] <= 0 or self.cam_matrix[1, 1] <= 0:
+            raise ValueError('Focal lengths must be positive\n{}'.format(self.cam_matrix))
+        if len(self.radial) not in (2, 3) or len(self.tangential) != 2:
+            raise ValueError('Expected 2 or 3 radial and 2 tangential distortion coefficients')
+
+
+def _stamp(path: Path) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _digest(path: Path) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def read_mat(cam_path: Path) -> Calibration:
+    '''
+    The calibration in a .mat saved from MATLAB's cameraParameters with toStruct,
+    by field name. This is the only place scipy is used
+    '''
+    from scipy.io import loadmat
+
+    data = loadmat(str(cam_path))
+    names = [name for name in data if not name.startswith('__')]
+    if len(names) != 1:
+        raise ValueError('{} should hold one struct, found {}'.format(cam_path, names))
+    struct = data[names[0]][0, 0]
+    height, width = np.asarray(struct['ImageSize'], dtype=int).ravel()
+    return Calibration(np.asarray(struct['IntrinsicMatrix'], dtype=float),
+                       np.asarray(struct['RadialDistortion'], dtype=float).ravel(),
+                       np.asarray(struct['TangentialDistortion'], dtype=float).ravel(),
+                       (int(width), int(height)))
+
+
+def read_distances(offset_path: Path) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    '''cam_offset and gripper_offset in distance.txt, see location.read_offsets'''
+    with open(offset_path, 'r') as f:
+        lines = f.readlines()
+    return (int(lines[1]), int(lines[2])), (int(lines[4]), int(lines[5]))
+
+
+def _sources(cam_path: Path, offset_path: Optional[Path]) -> Dict[str, Path]:
+    sources = {'mat': Path(cam_path)}
+    if offset_path is not None:
+        sources['offsets'] = Path(offset_path)
+    return sources
+
+
+def _build(sources: Dict[str, Path]) -> Calibration:
+    calibration = read_mat(sources['mat'])
+    if 'offsets' in sources:
+        calibration.cam_offset, calibration.gripper_offset = read_distances(sources['offsets'])
+    calibration.validate()
+    return calibration
+
+
+def _save(cache_path: Path, calibration: Calibration, sources: Dict[str, Path]) -> None:
+    arrays = {'version': np.array(_VERSION),
+              'cam_matrix': calibration.cam_matrix,
+              'radial': calibration.radial,
+              'tangential': calibration.tangential,
+              'image_size': np.array(calibration.image_size)}
+    if calibration.cam_offset is not None:
+        arrays['offsets'] = np.array([calibration.cam_offset, calibration.gripper_offset])
+    for key, path in sources.items():
+        arrays['source_' + key] = np.array(os.path.abspath(path))
+        arrays['stamp_' + key] = np.array(_stamp(path))
+        arrays['digest_' + key] = np.array(_digest(path))
+    # written aside and renamed, a concurrent run never reads half a file
+    temporary = cache_path.with_name(cache_path.name + '.{}.tmp'.format(os.getpid()))
+    with open(temporary, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temporary, cache_path)
+
+
+def _load(cache_path: Path, sources: Dict[str, Path]) -> Optional[Calibration]:
+    '''The cached calibration if it is still that of sources, otherwise None'''
+    try:
+        with np.load(cache_path, allow_pickle=False) as cached:
+            arrays = {key: cached[key] for key in cached.files}
+    except (OSError, ValueError):
+        return None
+    keys = {key[len('source_'):] for key in arrays if key.startswith('source_')}
+    # a cache with the offsets serves a request for the matrix alone
+    if int(arrays.get('version', -1)) != _VERSION or not set(sources) <= keys:
+        return None
+    refresh = False
+    for key, path in sources.items():
+        if str(arrays['source_' + key]) != os.path.abspath(path):
+            return None
+        if tuple(arrays['stamp_' + key].tolist()) != _stamp(path):
+            # touched, copied or checked out again: only a new content counts
+            if str(arrays['digest_' + key]) != _digest(path):
+                return None
+            refresh = True
+    offsets = arrays['offsets'].tolist() if 'offsets' in sources else (None, None)
+    calibration = Calibration(arrays['cam_matrix'], arrays['radial'], arrays['tangential'],
+                              tuple(arrays['image_size'].tolist()), *[
+                                  tuple(offset) if offset is not None else None for offset in offsets])
+    if refresh and keys == set(sources):
+        try:
+            _save(cache_path, calibration, sources)
+        except OSError as e:
+            _LOG.warning('Unable to refresh the calibration cache {}: {}'.format(cache_path, e))
+    return calibration
+
+
+def load_calibration(cam_path: Path, offset_path: Optional[Path] = None,
+                     cache_path: Optional[Path] = None) -> Calibration:
+    '''
+    The calibration in cam_path, and the offsets in offset_path if it is given,
+    from the cache when it is up to date, otherwise from the sources, then cached.
+    cache_path: by default <mat file>.calibration.npz; a cache that cannot be written
+                is skipped
+    '''
+    sources = _sources(cam_path, offset_path)
+    cache_path = Path(cache_path) if cache_path is not None else Path(cam_path).with_suffix(_SUFFIX)
+    calibration = _load(cache_path, sources)
+    if calibration is not None:
+        _LOG.debug('Calibration from {}'.format(cache_path))
+        return calibration
+    calibration = _build(sources)
+    try:
+        _save(cache_path, calibration, sources)
+        _LOG.info('Cached the calibration of {} in {}'.format(cam_path, cache_path))
+    except OSError as e:
+        _LOG.warning('Unable to cache the calibration in {}: {}'.format(cache_path, e))
+    return calibration
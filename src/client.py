@@ -5,6 +5,12 @@ Not useful for the local drive script
 import paho.mqtt.client as mqtt
 import json
 import time
+import threading
+import asyncio
+import random
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from uuid import uuid4 # 通用唯一标识符 ( Universally Unique Identifier )
 import logging #日志模块
 
@@ -13,6 +19,12 @@ MAX_X = 2400
 MAX_Y = 1200
 MAX_Z = 469  # TODO test this one!
 
+MQTT_HOST = "clever-octopus.rmq.cloudamqp.com"  # from request_token.py, see README.md
+MQTT_PORT = 1883
+
+RPC_TIMEOUT = 60  # default seconds to wait for rpc_ok / rpc_error, see RetryPolicy
+CONNECT_TIMEOUT = 60
+
 def coord(x, y, z):
   return {"kind": "coordinate", "args": {"x": x, "y": y, "z": z}} # 返回json 嵌套对象
 
@@ -29,20 +41,195 @@ def take_photo_request():
           "args": {"label": ""}, #label空着是为了在blocking_request中填上uuid，唯一识别码
           "body": [{"kind": "take_photo", "args": {}}]}
 
+# commands that leave the bot in the same state when they run twice, see batch_request
+IDEMPOTENT_KINDS = ("move_absolute",)
+
+def request_kind(request):
+  # the CeleryScript command inside an rpc_request, e.g. move_absolute
+  return request['body'][0]['kind'] if request.get('body') else request['kind']
+
 def clip(v, min_v, max_v):
   if v < min_v: return min_v
   if v > max_v: return max_v
   return v
 
-class FarmbotClient(object):
+class ConnectionMetrics(object):
+  '''
+  Connection bookkeeping of one FarmbotClient
+  setup_seconds: per (re)connection, time from connect() or the drop until subscribed again
+  '''
+  def __init__(self):
+    self.connects = 0
+    self.reconnects = 0
+    self.disconnects = 0
+    self.setup_seconds = []
+
+  def __repr__(self):
+    return "connects=%d reconnects=%d disconnects=%d setup_seconds=%s" % (
+      self.connects, self.reconnects, self.disconnects,
+      ["%.3f" % seconds for seconds in self.setup_seconds])
+
+class RetryPolicy(object):
+  '''
+  How long to wait for replies and how often to retry a request
+  attempts: attempts per request, including the first one
+  timeouts: seconds to wait for the reply per command kind, e.g. {"take_photo": 10};
+            kinds not listed wait default_timeout
+  backoff, factor, max_backoff: pause after an rpc_error, backoff * factor**n for the
+            n-th error of the request, capped at max_backoff
+  jitter: the pause is scaled by a random factor in [1-jitter, 1+jitter]
+  deadline: seconds for the whole request including retries, None for no limit
+  After a timeout the request is re-sent right away, the wait has already been long
+  '''
+  def __init__(self, attempts=3, timeouts=None, default_timeout=RPC_TIMEOUT,
+               backoff=1.0, factor=2.0, max_backoff=10.0, jitter=0.2, deadline=None):
+    self.attempts = attempts
+    self.timeouts = dict(timeouts or {})
+    self.default_timeout = default_timeout
+    self.backoff = backoff
+    self.factor = factor
+    self.max_backoff = max_backoff
+    self.jitter = jitter
+    self.deadline = deadline
+
+  def expires(self, started):
+    # monotonic time at which the whole request gives up, None for never
+    return None if self.deadline is None else started + self.deadline
+
+  def timeout(self, kind, expires=None):
+    timeout = self.timeouts.get(kind, self.default_timeout)
+    if expires is not None:
+      timeout = min(timeout, expires - time.monotonic())
+    return timeout
+
+  def delay(self, errors, expires=None):
+    # pause before retrying after the errors-th rpc_error (1 based)
+    delay = min(self.max_backoff, self.backoff * self.factor ** (errors - 1))
+    delay *= 1 + random.uniform(-self.jitter, self.jitter)
+    if expires is not None:
+      delay = min(delay, max(0.0, expires - time.monotonic()))
+    return delay
+
+class RetryRun(object):
+  '''
+  The attempts at one request under a RetryPolicy and their bookkeeping: the deadline,
+  the timeout of each attempt, the pause after a failure and the RpcStats. Callers only
+  send and wait for the reply:
+    run = RetryRun(policy, stats, what=request)
+    for attempt in run:
+      rpc_status = <send, wait up to run.timeout(kind); None if no reply>
+      if rpc_status == 'rpc_ok':
+        run.succeeded()
+        return True
+      time.sleep(run.failed(rpc_status))
+    run.give_up()
+  stats: RpcStats of the request being tried, batch_request moves it along the batch.
+  Counting the request in stats.requests is up to the caller
+  '''
+  def __init__(self, policy, stats, attempts=None, name="request", what=None):
+    self.policy = policy
+    self.stats = stats
+    self.attempts = policy.attempts if attempts is None else attempts
+    self.name = name
+    self.what = what
+    self.started = time.monotonic()
+    self.expires = policy.expires(self.started)
+    self.errors = 0
+    self.expired = False
+
+  def __iter__(self):
+    # attempt numbers from 0, while there are attempts and time left
+    for attempt in range(self.attempts):
+      if self.expires is not None and time.monotonic() >= self.expires:
+        self.expired = True
+        return
+      if attempt > 0:
+        self.stats.retries += 1
+      yield attempt
+
+  def timeout(self, kind):
+    # seconds to wait for the reply of the current attempt
+    return self.policy.timeout(kind, self.expires)
+
+  def succeeded(self, stats=None, since=None):
+    # rpc_ok for stats (by default those of the run), latency from since or the first send
+    (self.stats if stats is None else stats).observe(time.monotonic() - (self.started if since is None else since))
+
+  def failed(self, rpc_status):
+    '''
+    Book a failed attempt, rpc_status None for a timeout. Returns the seconds to pause
+    before the next attempt, none after a timeout
+    '''
+    if rpc_status is None:
+      self.stats.timeouts += 1
+      logging.warning("< %s TIMEOUT [%s]", self.name, self.what)
+      return 0.0
+    if rpc_status == 'rpc_error':
+      self.stats.errors += 1
+      self.errors += 1
+      logging.warning("< %s ERROR [%s]", self.name, self.what)
+      return self.policy.delay(self.errors, self.expires)
+    msg = "unexpected rpc_status [%s]" % rpc_status
+    logging.error(msg)
+    raise Exception(msg)
+
+  def give_up(self, *others):
+    # the request failed for good, and so did others (RpcStats) that were waiting on it
+    for stats in (self.stats,) + others:
+      stats.failed += 1
+    logging.error("< %s [%s] %s", self.name, self.what, "DEADLINE EXCEEDED" if self.expired else "OUT OF RETRIES")
+
+class RpcStats(object):
+  '''
+  Counters for one command kind. latency_histogram counts requests by their total time
+  (first send until rpc_ok, retries included) in the buckets of LATENCY_BUCKETS seconds,
+  the last slot is everything slower than the last bucket
+  '''
+  LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
 
-  def __init__(self, device_id, token):
+  def __init__(self):
+    self.requests = 0
+    self.ok = 0
+    self.failed = 0
+    self.timeouts = 0
+    self.errors = 0
+    self.retries = 0
+    self.total_seconds = 0.0
+    self.latency_histogram = [0] * (len(self.LATENCY_BUCKETS) + 1)
+
+  def observe(self, seconds):
+    self.ok += 1
+    self.total_seconds += seconds
+    self.latency_histogram[bisect_left(self.LATENCY_BUCKETS, seconds)] += 1
+
+  def __repr__(self):
+    buckets = ["<=%s:%d" % (bound, n) for bound, n in zip(self.LATENCY_BUCKETS, self.latency_histogram) if n]
+    if self.latency_histogram[-1]:
+      buckets.append(">%s:%d" % (self.LATENCY_BUCKETS[-1], self.latency_histogram[-1]))
+    mean = self.total_seconds / self.ok if self.ok else 0.0
+    return "requests=%d ok=%d failed=%d timeouts=%d errors=%d retries=%d mean=%.3fs histogram=[%s]" % (
+      self.requests, self.ok, self.failed, self.timeouts, self.errors, self.retries, mean, " ".join(buckets))
+
+class FarmbotClient(object):
 
+  def __init__(self, device_id, token, host=MQTT_HOST, port=MQTT_PORT, mqtt_client=None,
+               retry_policy=None):
+    '''
+    mqtt_client: anything with the paho Client interface, e.g. local_broker.LocalBroker
+    for running offline; a real paho client is created when None
+    retry_policy: RetryPolicy for every request, the defaults when None
+    '''
     self.device_id = device_id
-    self.client = mqtt.Client() # 类元素继承了另一个对象
+    self.retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+    # command kind -> RpcStats
+    self.rpc_stats = defaultdict(RpcStats)
+    self.client = mqtt.Client() if mqtt_client is None else mqtt_client # 类元素继承了另一个对象
     self.client.username_pw_set(self.device_id, token) #传入 用户名和密码
     self.client.on_connect = self._on_connect  #？？？
     self.client.on_message = self._on_message
+    self.client.on_disconnect = self._on_disconnect
+    # paho reconnects by itself inside loop_start(), back off up to 30s between attempts
+    self.client.reconnect_delay_set(min_delay=1, max_delay=30)
 
     logging.basicConfig(level=logging.DEBUG,
                         format="%(asctime)s\t%(name)s\t%(levelname)s\t%(message)s",
@@ -53,15 +240,28 @@ class FarmbotClient(object):
     console.setFormatter(logging.Formatter("%(asctime)s\t%(message)s"))
     logging.getLogger('').addHandler(console)
 
-    self.connected = False
-    self.client.connect("clever-octopus.rmq.cloudamqp.com", 1883, 60)  #前面的url要运行按README.md中request_token.py 后面俩是TCP Port, Websocket Port
+    # requests in flight, label (uuid) -> Future resolved with the reply kind by _on_message
+    self._pending = {}
+    self._closing = False
+    self._connected = threading.Event()
+    self.metrics = ConnectionMetrics()
+    self._connect_started = time.monotonic()
+    self.client.connect(host, port, 60)  #前面的url要运行按README.md中request_token.py 后面俩是TCP Port, Websocket Port
     self.client.loop_start()
     # 初始化函数里就会连接到服务器上，所以每次实例化一个新的client时，就已经连上了
 
 
+  @property
+  def connected(self):
+    return self._connected.is_set()
+
   def shutdown(self):
+    self._closing = True
     self.client.disconnect()
     self.client.loop_stop()
+    logging.info("MQTT session closed [%s]", self.metrics)
+    for kind, stats in sorted(self.rpc_stats.items()):
+      logging.info("RPC %s [%s]", kind, stats)
 
   def move(self, x, y, z):
     x = clip(x, 0, MAX_X)
@@ -70,72 +270,263 @@ class FarmbotClient(object):
     status_ok = self._blocking_request(move_request(x, y, z)) # 发请求
     logging.info("MOVE (%s,%s,%s) [%s]", x, y, z, status_ok) #存日志，包括执行了什么“move x y z +返回值 ”
 
+  def move_batch(self, points):
+    '''
+    Queue several moves at once, see batch_request. Returns one status per point
+    '''
+    points = [(clip(x, 0, MAX_X), clip(y, 0, MAX_Y), clip(z, 0, MAX_Z)) for x, y, z in points]
+    statuses = self.batch_request([move_request(x, y, z) for x, y, z in points])
+    for (x, y, z), status_ok in zip(points, statuses):
+      logging.info("MOVE (%s,%s,%s) [%s]", x, y, z, status_ok)
+    return statuses
+
   def take_photo(self):
     # TODO: is this enough? it's issue a request for the photo, but is the actual capture async?
     status_ok = self._blocking_request(take_photo_request())
     logging.info("TAKE_PHOTO [%s]", status_ok)
 
-  def _blocking_request(self, request, retries_remaining=3):
-    if retries_remaining==0:
-      logging.error("< blocking request [%s] OUT OF RETRIES", request) #尝试3次，然后在日志中记录错误
-      return False
+  def submit(self, request, wait=True):
+    '''
+    Send a request without waiting for it. The returned Future resolves with the reply
+    kind ('rpc_ok' / 'rpc_error'); the label is written into request['args']['label'].
+    There is no timeout or retry here, cancel() the future to stop tracking it.
+    wait: block until connected first; without it a request sent while the connection
+          is down is lost and the future only ends by its caller's timeout
+    '''
+    if wait:
+      self.wait_for_connection()
+    label, pending = self._send(request)
+    pending.add_done_callback(lambda _: self._pending.pop(label, None))
+    return pending
 
-    self._wait_for_connection() #在哪定义的？
+  def batch_request(self, requests, retries_remaining=None):
+    '''
+    Pipelined _blocking_request: every request is published straight away and tracked by
+    its own label, so the bot can start on the next one while the previous reply is still
+    on its way back. The bot runs them in order, so when one fails it is sent again
+    together with everything that was queued after it. The bot may still be running the
+    first copies of those, so every request has to be harmless to run twice: only the
+    IDEMPOTENT_KINDS are accepted, send anything else with _blocking_request.
+    retries_remaining overrides the attempts of the retry policy.
+    Returns a list with one bool per request
+    '''
+    for request in requests:
+      if request_kind(request) not in IDEMPOTENT_KINDS:
+        raise ValueError("%s may run twice in a batch, send it on its own" % request_kind(request))
+    if not requests:
+      return []
+    for request in requests:
+      self.rpc_stats[request_kind(request)].requests += 1
+    run = RetryRun(self.retry_policy, self.rpc_stats[request_kind(requests[0])], retries_remaining,
+                   "batch request", requests)
+    statuses = [False] * len(requests)
+    # latency of a request runs from when it is the oldest unanswered one: sent, or its
+    # predecessor acknowledged, whichever is later; retries count like in _blocking_request
+    since = run.started
 
-    # assign a new uuid for this attempt
-    self.pending_uuid = str(uuid4())
-    request['args']['label'] = self.pending_uuid #接收move_request函数的json对象
-    logging.debug("> blocking request [%s] retries=%d", request, retries_remaining)
+    start = 0
+    for attempt in run:
+      self.wait_for_connection()
+      in_flight = [(index, self._send(requests[index])) for index in range(start, len(requests))]
+      logging.debug("> batch request %d requests attempt=%d", len(in_flight), attempt + 1)
 
-    # send request off 发送请求
-    self.rpc_status = None
-    self.client.publish("bot/" + self.device_id + "/from_clients", json.dumps(request))
+      rpc_status = 'rpc_ok'
+      for index, (label, pending) in in_flight:
+        kind = request_kind(requests[index])
+        timeout = run.timeout(kind)
+        try:
+          rpc_status = self._wait_for_status(pending, timeout) if timeout > 0 else None
+        except FutureTimeout:
+          rpc_status = None
+        if rpc_status != 'rpc_ok':
+          break
+        statuses[index] = True
+        acknowledged = time.monotonic()
+        run.succeeded(self.rpc_stats[kind], since)
+        since = acknowledged
+        start = index + 1
+      for _, (label, _) in in_flight:
+        self._pending.pop(label, None)
 
-    # wait for response
-    timeout_counter = 600  # ~1min 等待1s
-    while self.rpc_status is None:          #这个self.rpc_status 是应答的flag
-      time.sleep(0.1)
-      timeout_counter -= 1
-      if timeout_counter == 0:
-        logging.warn("< blocking request TIMEOUT [%s]", request) #时间到了，无应答
-        return self._blocking_request(request, retries_remaining-1)
-    self.pending_uuid = None
-
-    # if it's ok, we're done!
-    if self.rpc_status == 'rpc_ok':
-      logging.debug("< blocking request OK [%s]", request)
-      return True
-
-    # if it's not ok, wait a bit and retry
-    if self.rpc_status == 'rpc_error':
-      logging.warn("< blocking request ERROR [%s]", request)
-      time.sleep(1)
-      return self._blocking_request(request, retries_remaining-1)
-
-    # unexpected state (???)
-    msg = "unexpected rpc_status [%s]" % self.rpc_status
-    logging.error(msg)
-    raise Exception(msg)
+      if rpc_status == 'rpc_ok':
+        logging.debug("< batch request OK")
+        return statuses
+      # the failed request and everything after it go again
+      run.stats, run.what = self.rpc_stats[request_kind(requests[start])], requests[start:]
+      time.sleep(run.failed(rpc_status))
+    run.give_up(*[self.rpc_stats[request_kind(request)] for request in requests[start + 1:]])
+    return statuses
+
+  def _blocking_request(self, request, retries_remaining=None):
+    '''
+    Send a request and wait for its reply, retrying as the retry policy says;
+    retries_remaining overrides its number of attempts. Returns whether it succeeded
+    '''
+    kind = request_kind(request)
+    self.rpc_stats[kind].requests += 1
+    run = RetryRun(self.retry_policy, self.rpc_stats[kind], retries_remaining, "blocking request", request)
 
+    for attempt in run:
+      timeout = run.timeout(kind)
+      self.wait_for_connection()
 
-  def _wait_for_connection(self):
-    # TODO: better way to do all this async event driven rather than with polling :/
-    timeout_counter = 600  # ~1min
-    while not self.connected: #用一个self.connected判断连上了没有，若没连上，等待
-      time.sleep(0.1)
-      timeout_counter -= 1
-      if timeout_counter == 0:
-        raise Exception("unable to connect")
+      label, pending = self._send(request)
+      logging.debug("> blocking request [%s] attempt=%d timeout=%.1f", request, attempt + 1, timeout)
+
+      # wait for response, _on_message resolves the future as soon as it arrives
+      try:
+        rpc_status = self._wait_for_status(pending, timeout)
+      except FutureTimeout:
+        rpc_status = None #时间到了，无应答
+      finally:
+        self._pending.pop(label, None)
+
+      # if it's ok, we're done!
+      if rpc_status == 'rpc_ok':
+        run.succeeded()
+        logging.debug("< blocking request OK [%s]", request)
+        return True
+
+      # if it's not ok, wait a bit and retry
+      time.sleep(run.failed(rpc_status))
+
+    run.give_up() #尝试3次，然后在日志中记录错误
+    return False
+
+  def _send(self, request):
+    # assign a new uuid for this attempt
+    label = str(uuid4())
+    request['args']['label'] = label #接收move_request函数的json对象
+    # register before sending so a fast reply can't slip past us
+    pending = self._pending[label] = Future()
+    self.client.publish("bot/" + self.device_id + "/from_clients", json.dumps(request))
+    return label, pending
+
+  def _wait_for_status(self, pending, timeout):
+    # blocks until the reply for this request arrives, raises FutureTimeout otherwise
+    return pending.result(timeout=timeout)
+
+  def wait_for_connection(self):
+    # blocks until the MQTT session is up, raises after CONNECT_TIMEOUT seconds
+    if not self._connected.wait(CONNECT_TIMEOUT): #用一个Event判断连上了没有，若没连上，等待
+      raise Exception("unable to connect")
 
   def _on_connect(self, client, userdata, flags, rc):
     logging.debug("> _on_connect")
     self.client.subscribe("bot/" + self.device_id + "/from_device")
-    self.connected = True
+    self._connected.set()
+    if self.metrics.connects > 0:
+      self.metrics.reconnects += 1
+      logging.info("MQTT reconnected after %.3fs", time.monotonic() - self._connect_started)
+    self.metrics.connects += 1
+    self.metrics.setup_seconds.append(time.monotonic() - self._connect_started)
     logging.debug("< _on_connect")
 
+  def _on_disconnect(self, client, userdata, rc):
+    self._connected.clear()
+    if self._closing:
+      return
+    # unexpected drop, paho's network loop is already trying to reconnect
+    self.metrics.disconnects += 1
+    self._connect_started = time.monotonic()
+    logging.warning("MQTT connection lost rc=%s, reconnecting", rc)
+
   def _on_message(self, client, userdata, msg):
     resp = json.loads(msg.payload.decode())
     if resp['args']['label'] != 'ping':
       logging.debug("> _on_message [%s] [%s]", msg.topic, resp)
-    if msg.topic.endswith("/from_device") and resp['args']['label'] == self.pending_uuid:
-      self.rpc_status = resp['kind']
+    if not msg.topic.endswith("/from_device"):
+      return
+    pending = self._pending.get(resp['args']['label'])
+    if pending is not None and not pending.done():
+      pending.set_result(resp['kind'])
+
+
+class AsyncFarmbotClient(object):
+  '''
+  asyncio flavour of FarmbotClient with the same requests and retry semantics
+  (RetryPolicy: 3 attempts, retry on rpc_error after a backoff and on timeout), but waiting for a reply
+  suspends the coroutine instead of blocking a thread, e.g.
+    async with AsyncFarmbotClient(creds.device_id, creds.token) as bot:
+      await bot.move(x, y, 0)
+      await bot.take_photo()
+  The MQTT transport is a FarmbotClient, so mqtt_client=LocalBroker() works offline as well
+  '''
+
+  def __init__(self, device_id, token, host=MQTT_HOST, port=MQTT_PORT, mqtt_client=None,
+               retry_policy=None):
+    self._args = (device_id, token, host, port, mqtt_client, retry_policy)
+    self._client = None
+
+  async def __aenter__(self):
+    await self.start()
+    return self
+
+  async def __aexit__(self, exc_type, exc, tb):
+    await self.shutdown()
+
+  @property
+  def metrics(self):
+    return self._client.metrics
+
+  @property
+  def rpc_stats(self):
+    return self._client.rpc_stats
+
+  async def start(self):
+    # the TCP connect in paho blocks, keep it off the event loop
+    if self._client is None:
+      loop = asyncio.get_running_loop()
+      self._client = await loop.run_in_executor(None, lambda: FarmbotClient(*self._args))
+
+  async def shutdown(self):
+    if self._client is not None:
+      await asyncio.get_running_loop().run_in_executor(None, self._client.shutdown)
+      self._client = None
+
+  async def move(self, x, y, z):
+    x = clip(x, 0, MAX_X)
+    y = clip(y, 0, MAX_Y)
+    z = clip(z, 0, MAX_Z)
+    status_ok = await self._request(move_request(x, y, z))
+    logging.info("MOVE (%s,%s,%s) [%s]", x, y, z, status_ok)
+    return status_ok
+
+  async def take_photo(self):
+    status_ok = await self._request(take_photo_request())
+    logging.info("TAKE_PHOTO [%s]", status_ok)
+    return status_ok
+
+  async def _request(self, request):
+    await self.start()
+    client = self._client
+    kind = request_kind(request)
+    client.rpc_stats[kind].requests += 1
+    run = RetryRun(client.retry_policy, client.rpc_stats[kind], name="async request", what=request)
+
+    for attempt in run:
+      timeout = run.timeout(kind)
+      await self.wait_for_connection()
+      # connected a moment ago; if it dropped since, this attempt times out and is retried
+      pending = client.submit(request, wait=False)
+      logging.debug("> async request [%s] attempt=%d timeout=%.1f", request, attempt + 1, timeout)
+      try:
+        # shield: the timeout only gives up waiting, cancel() below stops the tracking
+        rpc_status = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(pending)), timeout)
+      except asyncio.TimeoutError:
+        rpc_status = None
+      finally:
+        pending.cancel()
+
+      if rpc_status == 'rpc_ok':
+        run.succeeded()
+        logging.debug("< async request OK [%s]", request)
+        return True
+      await asyncio.sleep(run.failed(rpc_status))
+
+    run.give_up()
+    return False
+
+  async def wait_for_connection(self):
+    if not self._client.connected:
+      await asyncio.get_running_loop().run_in_executor(None, self._client.wait_for_connection)
@@ -0,0 +1,147 @@
+'''
+Spatial de-duplication of detections in global coordinates.
+Neighbouring photos overlap, so one fruit shows up once per photo it is in. Clusters are
+grown greedily around the most confident detection left: it absorbs every detection
+within a tolerance of it, then the next most confident one that is left does the same.
+Detections are only ever merged with a seed they are close to, so a row of fruits spaced
+just under the tolerance stays a row. Neighbours come from a KD-tree, O(n log n) for
+n detections; scipy is imported on the first clustering, importing this module stays cheap.
+Detections of different classes are kept apart by default.
+fuse_views goes one step further: a fruit takes at most one detection per photo, so
+that two fruits side by side in the same photo stay two targets.
+'''
+from typing import Optional
+
+import numpy as np
+from pandas import DataFrame
+
+
+def _separated(xy: np.ndarray, tolerance: float, groups: Optional[np.ndarray]) -> np.ndarray:
+    '''
+    xy as an N x 2 float array, every group moved far away from the others along x
+    so that points of different groups are never within tolerance
+    '''
+    xy = np.asarray(xy, dtype=float).reshape((-1, 2))
+    if groups is None or len(xy) == 0:
+        return xy
+    _, group_index = np.unique(np.asarray(groups), return_inverse=True)
+    span = np.ptp(xy[:, 0]) + 2 * tolerance + 1
+    return xy + np.column_stack((group_index * span, np.zeros(len(xy))))
+
+
+def _best_of_each(labels: np.ndarray, confidence: np.ndarray) -> np.ndarray:
+    '''
+    Index of the most confident point of each label 0, 1, ..., in label order
+    '''
+    order = np.lexsort((-confidence, labels))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = labels[order][1:] != labels[order][:-1]
+    return order[first]
+
+
+def cluster_labels(xy: np.ndarray, tolerance: float, groups: Optional[np.ndarray] = None,
+                   confidence: Optional[np.ndarray] = None, photos: Optional[np.ndarray] = None) -> np.ndarray:
+    '''
+    Label points greedily: the most confident point not yet labelled starts a cluster
+    and takes every unlabelled point within tolerance of it
+
+    :param xy: N x 2 array of global coordinates
+    :param tolerance: distance to the seed of the cluster
+    :param groups: optional N labels, e.g. classes; points of different groups never merge
+    :param confidence: optional N confidences, the seeding order; by default the input order
+    :param photos: optional N photo numbers; a cluster then takes at most one point per
+                   photo, the one closest to its seed
+    :return: N cluster numbers, 0 .. number of clusters - 1 in the order they were seeded
+    '''
+    xy = _separated(xy, tolerance, groups)
+    num = len(xy)
+    labels = np.full(num, -1)
+    if num == 0:
+        return labels
+    order = np.arange(num) if confidence is None else np.argsort(-np.asarray(confidence, dtype=float),
+                                                                 kind='stable')
+    from scipy.spatial import cKDTree
+
+    neighbours = cKDTree(xy).query_ball_point(xy, r=tolerance)
+    num_clusters = 0
+    for seed in order:
+        if labels[seed] >= 0:
+            continue
+        members = np.asarray(neighbours[seed], dtype=int)
+        members = members[labels[members] < 0]
+        if photos is not None:
+            # closest to the seed first, the seed before anything else of its photo
+            distance = np.hypot(*(xy[members] - xy[seed]).T)
+            members = members[np.lexsort((distance, members != seed))]
+            _, first = np.unique(np.asarray(photos)[members], return_index=True)
+            members = members[first]
+        labels[members] = num_clusters
+        labels[seed] = num_clusters
+        num_clusters += 1
+    return labels
+
+
+def merge_duplicates(table: DataFrame, tolerance: float = 50.0, fuse: bool = False,
+                     by_class: bool = True) -> DataFrame:
+    '''
+    Reduce every cluster of detections to its seed, the one with the highest confidence
+
+    :param table: pandas dataframe that each row corresponds to a target [class, x, y, confidence]
+    :param tolerance: detections closer than this (mm) are the same target
+    :param fuse: replace the kept target's position by the confidence weighted mean
+                 position of its cluster
+    :param by_class: only merge detections of the same class; off, a confident detection
+                     of one class swallows a nearby one of another
+    :return: the kept rows, in their original order, with a new index
+    '''
+    if table.empty:
+        return table.reset_index(drop=True)
+    xy = table[['x', 'y']].to_numpy(dtype=float)
+    confidence = table['confidence'].to_numpy(dtype=float)
+    labels = cluster_labels(xy, tolerance, table['class'].to_numpy() if by_class else None, confidence)
+
+    keep = np.sort(_best_of_each(labels, confidence))
+    merged = table.iloc[keep].copy()
+
+    if fuse:
+        # an all-zero-confidence cluster falls back to the plain mean
+        weights = np.maximum(confidence, 1e-9)
+        total = np.bincount(labels, weights=weights)
+        for column, values in (('x', xy[:, 0]), ('y', xy[:, 1])):
+            mean = np.bincount(labels, weights=weights * values) / total
+            merged[column] = mean[labels[keep]]
+    return merged.reset_index(drop=True)
+
+
+def fuse_views(table: DataFrame, tolerance: float = 50.0, by_class: bool = True) -> DataFrame:
+    '''
+    One target per fruit from the detections of overlapping photos: clusters around the
+    most confident detections that take at most one detection per photo, see cluster_labels
+
+    :param table: pandas dataframe that each row corresponds to a detection
+                  [class, x, y, confidence, photo]
+    :param tolerance: detections of different photos this close (mm) to the most confident
+                      one of a fruit are the same fruit
+    :param by_class: only associate detections of the same class
+    :return: [class, x, y, confidence, views] per fruit: the class of its most confident
+             detection, the confidence weighted mean position, the probability that at
+             least one detection is right (in percent, detections taken as independent)
+             and the number of photos it was seen in
+    '''
+    if table.empty:
+        return DataFrame(columns=['class', 'x', 'y', 'confidence', 'views'])
+    xy = table[['x', 'y']].to_numpy(dtype=float)
+    confidence = table['confidence'].to_numpy(dtype=float)
+    labels = cluster_labels(xy, tolerance, table['class'].to_numpy() if by_class else None, confidence,
+                            table['photo'].to_numpy())
+
+    weights = np.maximum(confidence, 1e-9)
+    total = np.bincount(labels, weights=weights)
+    missed = np.ones(total.size)
+    np.multiply.at(missed, labels, 1 - np.clip(confidence / 100, 0, 1))
+    best = _best_of_each(labels, confidence)
+    return DataFrame({'class': table['class'].to_numpy()[best],
+                      'x': np.bincount(labels, weights=weights * xy[:, 0]) / total,
+                      'y': np.bincount(labels, weights=weights * xy[:, 1]) / total,
+                      'confidence': 100 * (1 - missed),
+                      'views': np.bincount(labels)})
@@ -13,6 +13,8 @@ from ctypes import *
 import math
 import random
 import os
+import numpy as np
+from records import Detection
 
 
 class BOX(Structure):
@@ -37,6 +39,14 @@ class DETECTION(Structure):
                 ("sim", c_float),
                 ("track_id", c_int)]
 
+"""The DETECTION fields detection_arrays reads, laid out as in the C struct"""
+_DETECTION_DTYPE = np.dtype({
+    'names': ['bbox', 'best_class_idx', 'prob'],
+    'formats': [(np.float32, 4), np.int32, np.uintp],
+    'offsets': [DETECTION.bbox.offset, DETECTION.best_class_idx.offset, DETECTION.prob.offset],
+    'itemsize': sizeof(DETECTION)})
+
+
 class DETNUMPAIR(Structure):
     _fields_ = [("num", c_int),
                 ("dets", POINTER(DETECTION))]
@@ -55,11 +65,11 @@ class METADATA(Structure):
 
 
 def network_width(net):
-    return lib.network_width(net)
+    return _network_width(net)
 
 
 def network_height(net):
-    return lib.network_height(net)
+    return _network_height(net)
 
 
 def bbox2points(bbox):
@@ -107,84 +117,113 @@ def load_network(config_file, data_file, weights, batch_size=1):
     return network, class_names, colors
 
 
-def print_detections(detections, coordinates=False):
+def print_detections(detections, class_names, coordinates=False):
     print("\nObjects:")
-    for label, confidence, bbox in detections:
-        x, y, w, h = bbox
+    for detection in detections:
+        label = class_names[detection.class_id]
         if coordinates:
-            print("{}: {}%    (left_x: {:.0f}   top_y:  {:.0f}   width:   {:.0f}   height:  {:.0f})".format(label, confidence, x, y, w, h))
+            print("{}: {:.2f}%    (left_x: {:.0f}   top_y:  {:.0f}   width:   {:.0f}   height:  {:.0f})".format(label, detection.confidence, *detection.bbox))
         else:
-            print("{}: {}%".format(label, confidence))
+            print("{}: {:.2f}%".format(label, detection.confidence))
 
 
-def draw_boxes(detections, image, colors):
+def draw_boxes(detections, image, colors, class_names):
     import cv2
-    for label, confidence, bbox in detections:
-        left, top, right, bottom = bbox2points(bbox)
+    for detection in detections:
+        label = class_names[detection.class_id]
+        left, top, right, bottom = bbox2points(detection.bbox)
         cv2.rectangle(image, (left, top), (right, bottom), colors[label], 1)
-        cv2.putText(image, "{} [{:.2f}]".format(label, float(confidence)),
+        cv2.putText(image, "{} [{:.2f}]".format(label, detection.confidence),
                     (left, top - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
                     colors[label], 2)
     return image
 
 
-def decode_detection(detections):
-    decoded = []
-    for label, confidence, bbox in detections:
-        confidence = str(round(confidence * 100, 2))
-        decoded.append((str(label), confidence, bbox))
-    return decoded
-
 # https://www.pyimagesearch.com/2015/02/16/faster-non-maximum-suppression-python/
 # Malisiewicz et al.
+def nms_indices(boxes, scores, groups=None, iou_thresh=.45):
+    """
+    Greedy non-maximum suppression of many boxes at once, with the same rule as darknet's
+    do_nms_sort: going down by score, a box is dropped if its IoU with a kept box of the
+    same group is above iou_thresh
+    args:
+        boxes: N x 4 array of (x, y, w, h), centre and size
+        scores: N scores
+        groups: N group numbers, boxes of different groups never suppress each other,
+                e.g. class, or image * classes + class for a batch of images
+    returns:
+        indices of the kept boxes, by descending score
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape((-1, 4))
+    num = len(boxes)
+    if num == 0:
+        return np.empty(0, dtype=np.intp)
+    groups = np.zeros(num, dtype=np.intp) if groups is None else np.asarray(groups)
+    order = np.lexsort((-np.asarray(scores), groups))
+    groups = groups[order]
+    # every pair (i, j) of the same group with i before j, i.e. scored higher
+    ends = np.searchsorted(groups, groups, side="right")
+    position = np.arange(num)
+    counts = ends - position - 1
+    first = np.repeat(position, counts)
+    second = np.arange(len(first)) - np.repeat(np.cumsum(counts) - counts, counts) + first + 1
+    # IoU of the pairs, like darknet's box_iou
+    x, y, w, h = boxes[order].T
+    left, right, top, bottom = x - w/2, x + w/2, y - h/2, y + h/2
+    overlap_w = np.minimum(right[first], right[second]) - np.maximum(left[first], left[second])
+    overlap_h = np.minimum(bottom[first], bottom[second]) - np.maximum(top[first], top[second])
+    intersection = np.where((overlap_w > 0) & (overlap_h > 0), overlap_w * overlap_h, 0)
+    union = w[first]*h[first] + w[second]*h[second] - intersection
+    suppressing = intersection > iou_thresh * union
+    first, second = first[suppressing], second[suppressing]
+    # a box is kept if no kept box suppresses it. Each pass settles at least one more box
+    # of every chain of suppressions, chains are short so this takes a few passes
+    keep = np.ones(num, dtype=bool)
+    while True:
+        suppressed = np.zeros(num, dtype=bool)
+        suppressed[second[keep[first]]] = True
+        if np.array_equal(keep, ~suppressed):
+            break
+        keep = ~suppressed
+    return order[keep]
+
+
 def non_max_suppression_fast(detections, overlap_thresh):
-    boxes = []
-    for detection in detections:
-        _, _, _, (x, y, w, h) = detection
-        x1 = x - w / 2
-        y1 = y - h / 2
-        x2 = x + w / 2
-        y2 = y + h / 2
-        boxes.append(np.array([x1, y1, x2, y2]))
-    boxes_array = np.array(boxes)
-
-    # initialize the list of picked indexes
-    pick = []
-    # grab the coordinates of the bounding boxes
-    x1 = boxes_array[:, 0]
-    y1 = boxes_array[:, 1]
-    x2 = boxes_array[:, 2]
-    y2 = boxes_array[:, 3]
-    # compute the area of the bounding boxes and sort the bounding
-    # boxes by the bottom-right y-coordinate of the bounding box
-    area = (x2 - x1 + 1) * (y2 - y1 + 1)
-    idxs = np.argsort(y2)
-    # keep looping while some indexes still remain in the indexes
-    # list
-    while len(idxs) > 0:
-        # grab the last index in the indexes list and add the
-        # index value to the list of picked indexes
-        last = len(idxs) - 1
-        i = idxs[last]
-        pick.append(i)
-        # find the largest (x, y) coordinates for the start of
-        # the bounding box and the smallest (x, y) coordinates
-        # for the end of the bounding box
-        xx1 = np.maximum(x1[i], x1[idxs[:last]])
-        yy1 = np.maximum(y1[i], y1[idxs[:last]])
-        xx2 = np.minimum(x2[i], x2[idxs[:last]])
-        yy2 = np.minimum(y2[i], y2[idxs[:last]])
-        # compute the width and height of the bounding box
-        w = np.maximum(0, xx2 - xx1 + 1)
-        h = np.maximum(0, yy2 - yy1 + 1)
-        # compute the ratio of overlap
-        overlap = (w * h) / area[idxs[:last]]
-        # delete all indexes from the index list that have
-        idxs = np.delete(idxs, np.concatenate(([last],
-                                               np.where(overlap > overlap_thresh)[0])))
-        # return only the bounding boxes that were picked using the
-        # integer data type
-    return [detections[i] for i in pick]
+    """
+    NMS on detections that didn't go through do_nms_sort, e.g. from a cache or a remote
+    detector, see nms_indices. Detection records or (label, confidence, bbox) tuples,
+    only those of the same class suppress each other; returns the kept ones by
+    descending confidence
+    """
+    if not detections:
+        return []
+    if isinstance(detections[0], Detection):
+        boxes = [detection.bbox for detection in detections]
+        scores = [detection.confidence for detection in detections]
+        labels = [detection.class_id for detection in detections]
+    else:
+        labels, scores, boxes = zip(*detections)
+    _, groups = np.unique(labels, return_inverse=True)
+    return [detections[i] for i in nms_indices(boxes, scores, groups, overlap_thresh)]
+
+
+def non_max_suppression_batch(batch_detections, overlap_thresh):
+    """
+    non_max_suppression_fast of the Detection records of many images in one pass,
+    returns one list per image
+    """
+    detections = [detection for image_detections in batch_detections for detection in image_detections]
+    if not detections:
+        return [[] for _ in batch_detections]
+    images = np.repeat(np.arange(len(batch_detections)), [len(image_detections) for image_detections in batch_detections])
+    classes = np.array([detection.class_id for detection in detections])
+    kept = nms_indices([detection.bbox for detection in detections],
+                       [detection.confidence for detection in detections],
+                       images * (classes.max() + 1) + classes, overlap_thresh)
+    batch_kept = [[] for _ in batch_detections]
+    for i in kept.tolist():
+        batch_kept[images[i]].append(detections[i])
+    return batch_kept
 
 def remove_negatives(detections, class_names, num):
     """
@@ -215,9 +254,77 @@ def remove_negatives_faster(detections, class_names, num):
     return predictions
 
 
-def detect_image(network,  class_names, image, thresh=.5, hier_thresh=.5, nms=.45): #
+def detection_arrays(detections, num, classes):
+    """
+    NumPy arrays over num DETECTIONs straight from the ctypes pointer:
+    records is a zero-copy structured view with the fields bbox (x, y, w, h),
+    best_class_idx and prob (the address of each prob array); probs is the
+    (num, classes) matrix of class probabilities.
+    darknet callocs the prob arrays one after another, they normally sit at a fixed
+    distance from each other and probs is a zero-copy strided view over them;
+    otherwise they are gathered into a new array
+    """
+    if num == 0:
+        return np.empty(0, dtype=_DETECTION_DTYPE), np.empty((0, classes), dtype=np.float32)
+    buffer = (c_char * (num * sizeof(DETECTION))).from_address(addressof(detections.contents))
+    records = np.frombuffer(buffer, dtype=_DETECTION_DTYPE)
+    row_bytes = classes * sizeof(c_float)
+    addresses = records['prob'].astype(np.int64)
+    gaps = np.diff(addresses)
+    if num == 1 or (gaps[0] >= row_bytes and np.all(gaps == gaps[0])):
+        stride = int(gaps[0]) if num > 1 else row_bytes
+        span = (c_char * (stride * (num - 1) + row_bytes)).from_address(int(addresses[0]))
+        probs = np.ndarray((num, classes), dtype=np.float32, buffer=span,
+                           strides=(stride, sizeof(c_float)))
+    else:
+        probs = np.empty((num, classes), dtype=np.float32)
+        for row, address in enumerate(addresses.tolist()):
+            memmove(probs.ctypes.data + row * row_bytes, address, row_bytes)
+    return records, probs
+
+
+def remove_negatives_vectorized(detections, class_names, num):
     """
-        Returns a list with highest confidence class and their bbox
+    remove_negatives on NumPy arrays, same predictions in the same order
+    """
+    records, probs = detection_arrays(detections, num, len(class_names))
+    rows, idxs = np.nonzero(probs > 0)
+    bboxes = records['bbox'][rows].tolist()
+    confidences = probs[rows, idxs].tolist()
+    return [(class_names[idx], confidence, tuple(bbox))
+            for idx, confidence, bbox in zip(idxs.tolist(), confidences, bboxes)]
+
+
+def remove_negatives_faster_vectorized(detections, class_names, num):
+    """
+    remove_negatives_faster on NumPy arrays, same predictions in the same order
+    """
+    records, probs = detection_arrays(detections, num, len(class_names))
+    rows = np.nonzero(records['best_class_idx'] != -1)[0]
+    idxs = records['best_class_idx'][rows]
+    bboxes = records['bbox'][rows].tolist()
+    confidences = probs[rows, idxs].tolist()
+    return [(class_names[idx], confidence, tuple(bbox))
+            for idx, confidence, bbox in zip(idxs.tolist(), confidences, bboxes)]
+
+
+def make_detections(detections, classes, num):
+    """
+    Detection records for every class with a positive probability in num DETECTIONs,
+    same selection and order as remove_negatives, confidence in percent
+    """
+    records, probs = detection_arrays(detections, num, classes)
+    rows, idxs = np.nonzero(probs > 0)
+    bboxes = records['bbox'][rows].tolist()
+    confidences = (probs[rows, idxs] * 100).tolist()
+    return [Detection(idx, x, y, w, h, confidence)
+            for idx, confidence, (x, y, w, h) in zip(idxs.tolist(), confidences, bboxes)]
+
+
+def detect_image(network,  class_names, image, thresh=.5, hier_thresh=.5, nms=.45, vectorized_nms=False): #
+    """
+        Returns a list of Detection records, in network pixels, by ascending confidence
+        vectorized_nms: suppress with non_max_suppression_fast instead of do_nms_sort
     """
     pnum = pointer(c_int(0))
     predict_image(network, image)  # image 需要什么类型
@@ -225,115 +332,186 @@ def detect_image(network,  class_names, image, thresh=.5, hier_thresh=.5, nms=.4
                                    thresh, hier_thresh, None, 0, pnum, 0)
     #print_detections(detections, coordinates=True)                 
     num = pnum[0]
-    if nms:
+    if nms and not vectorized_nms:
         do_nms_sort(detections, num, len(class_names), nms)
-    predictions = remove_negatives(detections, class_names, num)
-    predictions = decode_detection(predictions)
+    predictions = make_detections(detections, len(class_names), num)
     free_detections(detections, num)
-    return sorted(predictions, key=lambda x: x[1])
+    if nms and vectorized_nms:
+        predictions = non_max_suppression_fast(predictions, nms)
+    return sorted(predictions, key=lambda detection: detection.confidence)
+
+
+def detect_batch(network, class_names, batch_image, batch_size, width, height,
+                 thresh=.5, hier_thresh=.5, nms=.45, vectorized_nms=False):
+    """
+        Runs batch_size images packed into batch_image through the network in one call,
+        returns one list of Detection records per image, like detect_image
+        width, height: size the bboxes are scaled to
+        vectorized_nms: suppress all images in one non_max_suppression_batch instead of
+        a do_nms_sort per image
+    """
+    batch_detections = network_predict_batch(network, batch_image, batch_size, width, height,
+                                             thresh, hier_thresh, None, 0, 0)
+    batch_predictions = []
+    for idx in range(batch_size):
+        num = batch_detections[idx].num
+        detections = batch_detections[idx].dets
+        if nms and not vectorized_nms:
+            do_nms_sort(detections, num, len(class_names), nms)
+        batch_predictions.append(make_detections(detections, len(class_names), num))
+    free_batch_detections(batch_detections, batch_size)
+    if nms and vectorized_nms:
+        batch_predictions = non_max_suppression_batch(batch_predictions, nms)
+    return [sorted(predictions, key=lambda detection: detection.confidence)
+            for predictions in batch_predictions]
+
+
+"""The loaded darknet library or a stand-in for it, see load_library and configure"""
+_LIBRARY = None
+"""Path of the library to load, None for the default next to this repository"""
+_LIBRARY_PATH = None
+"""Every _Function of this module, unbound again by configure"""
+_FUNCTIONS = []
+
+
+def _default_library_path():
+    """
+    libdarknet.so (darknet.dll on Windows) in $DARKNET_PATH, by default in the darknet
+    submodule of this repository, wherever the process was started from
+    """
+    directory = os.environ.get("DARKNET_PATH",
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "darknet"))
+    if os.name == "posix":
+        return os.path.join(directory, "libdarknet.so")
+    if os.name == "nt":
+        os.environ['PATH'] = directory + ';' + os.environ['PATH']
+        return os.path.join(directory, "darknet.dll")
+    raise OSError("Unsupported OS {}".format(os.name))
+
+
+def configure(library_path=None, backend=None):
+    """
+    Choose the darknet library before it is used: the path of libdarknet.so / darknet.dll,
+    or a backend, any object with the library's functions as attributes, e.g. a fake
+    for machines without darknet (see fake_darknet.py). Without either, the default
+    library is loaded again on next use
+    """
+    global _LIBRARY, _LIBRARY_PATH
+    _LIBRARY = backend
+    _LIBRARY_PATH = library_path
+    for function in _FUNCTIONS:
+        function.unbind()
+
+
+def load_library():
+    """
+    The darknet library, loaded on the first call. Importing this module doesn't load it,
+    so the tools that never detect start without it
+    """
+    global _LIBRARY
+    if _LIBRARY is None:
+        _LIBRARY = CDLL(_LIBRARY_PATH or _default_library_path(), RTLD_GLOBAL)
+    return _LIBRARY
+
+
+def __getattr__(name):
+    # darknet.lib, as before
+    if name == "lib":
+        return load_library()
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+
+class _Function:
+    """
+    A function of the darknet library, looked up (and given its C types) on the first call
+    """
+    def __init__(self, symbol, argtypes=None, restype=c_int):
+        self.symbol = symbol
+        self.argtypes = argtypes
+        self.restype = restype
+        self._function = None
+        _FUNCTIONS.append(self)
+
+    def bind(self):
+        if self._function is None:
+            library = load_library()
+            if isinstance(library, CDLL):
+                # a function object of our own, the same symbol can be typed differently
+                function = library[self.symbol]
+                if self.argtypes is not None:
+                    function.argtypes = self.argtypes
+                function.restype = self.restype
+            else:
+                function = getattr(library, self.symbol)
+            self._function = function
+        return self._function
+
+    def unbind(self):
+        self._function = None
+
+    def __call__(self, *args):
+        return self.bind()(*args)
 
+    def __repr__(self):
+        return "<darknet function {}>".format(self.symbol)
 
-if os.name == "posix":
-    cwd = os.path.abspath(os.path.join(os.getcwd(), "..")) # the one in Alexy's repo use current path, changing by our project structure, 
-    lib = CDLL(cwd + "/darknet/libdarknet.so", RTLD_GLOBAL)
-elif os.name == "nt":
-    cwd = os.path.dirname(__file__)
-    os.environ['PATH'] = cwd + ';' + os.environ['PATH']
-    lib = CDLL("darknet.dll", RTLD_GLOBAL)
-else:
-    print("Unsupported OS")
-    exit
 
-lib.network_width.argtypes = [c_void_p]
-lib.network_width.restype = c_int
-lib.network_height.argtypes = [c_void_p]
-lib.network_height.restype = c_int
+_network_width = _Function("network_width", [c_void_p], c_int)
+_network_height = _Function("network_height", [c_void_p], c_int)
 
-copy_image_from_bytes = lib.copy_image_from_bytes
-copy_image_from_bytes.argtypes = [IMAGE,c_char_p]
+copy_image_from_bytes = _Function("copy_image_from_bytes", [IMAGE, c_char_p])
 
-predict = lib.network_predict_ptr
-predict.argtypes = [c_void_p, POINTER(c_float)]
-predict.restype = POINTER(c_float)
+predict = _Function("network_predict_ptr", [c_void_p, POINTER(c_float)], POINTER(c_float))
 
-set_gpu = lib.cuda_set_device
-init_cpu = lib.init_cpu
+set_gpu = _Function("cuda_set_device")
+init_cpu = _Function("init_cpu")
 
-make_image = lib.make_image
-make_image.argtypes = [c_int, c_int, c_int]
-make_image.restype = IMAGE
+make_image = _Function("make_image", [c_int, c_int, c_int], IMAGE)
 
-get_network_boxes = lib.get_network_boxes
-get_network_boxes.argtypes = [c_void_p, c_int, c_int, c_float, c_float, POINTER(c_int), c_int, POINTER(c_int), c_int]
-get_network_boxes.restype = POINTER(DETECTION)
+get_network_boxes = _Function("get_network_boxes",
+                              [c_void_p, c_int, c_int, c_float, c_float, POINTER(c_int), c_int, POINTER(c_int), c_int],
+                              POINTER(DETECTION))
 
-make_network_boxes = lib.make_network_boxes
-make_network_boxes.argtypes = [c_void_p]
-make_network_boxes.restype = POINTER(DETECTION)
+make_network_boxes = _Function("make_network_boxes", [c_void_p], POINTER(DETECTION))
 
-free_detections = lib.free_detections
-free_detections.argtypes = [POINTER(DETECTION), c_int]
+free_detections = _Function("free_detections", [POINTER(DETECTION), c_int])
 
-free_batch_detections = lib.free_batch_detections
-free_batch_detections.argtypes = [POINTER(DETNUMPAIR), c_int]
+free_batch_detections = _Function("free_batch_detections", [POINTER(DETNUMPAIR), c_int])
 
-free_ptrs = lib.free_ptrs
-free_ptrs.argtypes = [POINTER(c_void_p), c_int]
+free_ptrs = _Function("free_ptrs", [POINTER(c_void_p), c_int])
 
-network_predict = lib.network_predict_ptr
-network_predict.argtypes = [c_void_p, POINTER(c_float)]
+network_predict = _Function("network_predict_ptr", [c_void_p, POINTER(c_float)], POINTER(c_float))
 
-reset_rnn = lib.reset_rnn
-reset_rnn.argtypes = [c_void_p]
+reset_rnn = _Function("reset_rnn", [c_void_p])
 
-load_net = lib.load_network
-load_net.argtypes = [c_char_p, c_char_p, c_int]
-load_net.restype = c_void_p
+load_net = _Function("load_network", [c_char_p, c_char_p, c_int], c_void_p)
 
-load_net_custom = lib.load_network_custom
-load_net_custom.argtypes = [c_char_p, c_char_p, c_int, c_int]
-load_net_custom.restype = c_void_p
+load_net_custom = _Function("load_network_custom", [c_char_p, c_char_p, c_int, c_int], c_void_p)
 
-free_network_ptr = lib.free_network_ptr
-free_network_ptr.argtypes = [c_void_p]
-free_network_ptr.restype = c_void_p
+free_network_ptr = _Function("free_network_ptr", [c_void_p], c_void_p)
 
-do_nms_obj = lib.do_nms_obj
-do_nms_obj.argtypes = [POINTER(DETECTION), c_int, c_int, c_float]
+do_nms_obj = _Function("do_nms_obj", [POINTER(DETECTION), c_int, c_int, c_float])
 
-do_nms_sort = lib.do_nms_sort
-do_nms_sort.argtypes = [POINTER(DETECTION), c_int, c_int, c_float]
+do_nms_sort = _Function("do_nms_sort", [POINTER(DETECTION), c_int, c_int, c_float])
 
-free_image = lib.free_image
-free_image.argtypes = [IMAGE]
+free_image = _Function("free_image", [IMAGE])
 
-letterbox_image = lib.letterbox_image
-letterbox_image.argtypes = [IMAGE, c_int, c_int]
-letterbox_image.restype = IMAGE
+letterbox_image = _Function("letterbox_image", [IMAGE, c_int, c_int], IMAGE)
 
-load_meta = lib.get_metadata
-lib.get_metadata.argtypes = [c_char_p]
-lib.get_metadata.restype = METADATA
+load_meta = _Function("get_metadata", [c_char_p], METADATA)
 
-load_image = lib.load_image_color
-load_image.argtypes = [c_char_p, c_int, c_int]
-load_image.restype = IMAGE
+load_image = _Function("load_image_color", [c_char_p, c_int, c_int], IMAGE)
 
-rgbgr_image = lib.rgbgr_image
-rgbgr_image.argtypes = [IMAGE]
+rgbgr_image = _Function("rgbgr_image", [IMAGE])
 
-predict_image = lib.network_predict_image
-predict_image.argtypes = [c_void_p, IMAGE]
-predict_image.restype = POINTER(c_float)
+predict_image = _Function("network_predict_image", [c_void_p, IMAGE], POINTER(c_float))
 
-predict_image_letterbox = lib.network_predict_image_letterbox
-predict_image_letterbox.argtypes = [c_void_p, IMAGE]
-predict_image_letterbox.restype = POINTER(c_float)
+predict_image_letterbox = _Function("network_predict_image_letterbox", [c_void_p, IMAGE], POINTER(c_float))
 
-network_predict_batch = lib.network_predict_batch
-network_predict_batch.argtypes = [c_void_p, IMAGE, c_int, c_int, c_int,
-                                   c_float, c_float, POINTER(c_int), c_int, c_int]
-network_predict_batch.restype = POINTER(DETNUMPAIR)
+network_predict_batch = _Function("network_predict_batch",
+                                  [c_void_p, IMAGE, c_int, c_int, c_int,
+                                   c_float, c_float, POINTER(c_int), c_int, c_int],
+                                  POINTER(DETNUMPAIR))
 
 if __name__ == "__main__":
     net = load_network("/home/xzleo/farmbot/darknet/cfg/yolov3-veges-test.cfg", "/home/xzleo/farmbot/darknet/data/veges.data", "/home/xzleo/farmbot/darknet/backup/yolov3-veges_best.weights")
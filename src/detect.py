@@ -7,20 +7,27 @@ from argparse import ArgumentParser, Namespace
 import os
 import glob
 import random
+from multiprocessing import get_context
 # from typing_extensions import final
 import darknet  # darknet.py
+from cache import DetectionCache, content_digest, file_digest, fingerprint, network_fingerprint
 import time
 import cv2
 import numpy as np
+from ctypes import c_char_p, c_float, POINTER
 
 
-def check_arguments_errors(args):
+def check_arguments_errors(args, network_files=True):
+    """
+    network_files: check the weights, config and data files exist, not needed when a
+                   detect_server has the network
+    """
     assert 0 < args.thresh < 1, "Threshold should be a float between zero and one (non-inclusive)"
-    if not os.path.exists(args.config_file):
+    if network_files and not os.path.exists(args.config_file):
         raise(ValueError("Invalid config path {}".format(os.path.abspath(args.config_file))))
-    if not os.path.exists(args.weights):
+    if network_files and not os.path.exists(args.weights):
         raise(ValueError("Invalid weight path {}".format(os.path.abspath(args.weights))))
-    if not os.path.exists(args.data_file):
+    if network_files and not os.path.exists(args.data_file):
         raise(ValueError("Invalid data file path {}".format(os.path.abspath(args.data_file))))
     if args.input and not os.path.exists(args.input):
         raise(ValueError("Invalid image path {}".format(os.path.abspath(args.input))))
@@ -48,25 +55,139 @@ def load_images(images_path):
             glob.glob(os.path.join(images_path, "*.jpeg"))
 
 
-def image_detection(image_path, network, class_names, class_colors, thresh):
-    # Darknet doesn't accept numpy images.
-    # Create one with image we reuse for each detect
-    # add image.shape as the output 
-    width = darknet.network_width(network)
-    height = darknet.network_height(network)
-    darknet_image = darknet.make_image(width, height, 3)
+def decode_image(data):
+    """
+    Decode an encoded photo (e.g. the JPEG bytes from the camera) into a BGR array,
+    the same array cv2.imread would give for the saved file
+    """
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Unable to decode image of {} bytes".format(len(data)))
+    return image
+
 
+def image_detection(image_path, network, class_names, class_colors, thresh):
     image = cv2.imread(image_path)
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    image_resized = cv2.resize(image_rgb, (width, height),
-                               interpolation=cv2.INTER_LINEAR)
+    return frame_detection(image, network, class_names, class_colors, thresh)
+
+
+class Detector:
+    """
+    A loaded network together with one network-sized darknet IMAGE and the NumPy buffers
+    the frames are resized into. They are allocated once and reused for every frame,
+    so the returned resized image is only valid until the next call of detect()
+    """
+    def __init__(self, network, class_names, class_colors):
+        self.network = network
+        self.class_names = class_names
+        self.class_colors = class_colors
+        self.width = darknet.network_width(network)
+        self.height = darknet.network_height(network)
+        # Darknet doesn't accept numpy images.
+        # Create one with image we reuse for each detect
+        self.darknet_image = darknet.make_image(self.width, self.height, 3)
+        self._resized = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self._rgb = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self._drawn = np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+    def prepare(self, image):
+        """
+        Resize a BGR frame to the network size and copy it into the darknet IMAGE.
+        Resizing first and swapping the channels after gives the same pixels
+        as the other way round, on a much smaller image
+        """
+        cv2.resize(image, (self.width, self.height), dst=self._resized,
+                   interpolation=cv2.INTER_LINEAR)
+        cv2.cvtColor(self._resized, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        darknet.copy_image_from_bytes(self.darknet_image, self._rgb.ctypes.data_as(c_char_p))
+        return self._rgb
+
+    def detect(self, image, thresh):
+        # add image.shape as the output 
+        image_resized = self.prepare(image)
+        detections = darknet.detect_image(self.network, self.class_names, self.darknet_image, thresh=thresh)
+        resized_image = darknet.draw_boxes(detections, image_resized, self.class_colors, self.class_names)
+        return image.shape, cv2.cvtColor(resized_image, cv2.COLOR_BGR2RGB, dst=self._drawn), detections
+
+    def close(self):
+        """Free the IMAGE; the network is freed by whoever loaded it, see unload_detector"""
+        if self.darknet_image is not None:
+            darknet.free_image(self.darknet_image)
+            self.darknet_image = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class BatchDetector:
+    """
+    Runs up to batch_size frames through the network in one network_predict_batch call.
+    The frames are resized and packed, as planar RGB floats, into one preallocated
+    batch IMAGE. The network must have been loaded with the same batch_size
+    """
+    def __init__(self, network, class_names, batch_size):
+        self.network = network
+        self.class_names = class_names
+        self.batch_size = batch_size
+        self.width = darknet.network_width(network)
+        self.height = darknet.network_height(network)
+        self.resized = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self._rgb = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self._batch = np.empty((batch_size, 3, self.height, self.width), dtype=np.float32)
+        # w, h, c are those of one image, darknet walks the data batch_size times
+        self.darknet_image = darknet.IMAGE(self.width, self.height, 3,
+                                           self._batch.ctypes.data_as(POINTER(c_float)))
+
+    def prepare(self, images):
+        for idx, image in enumerate(images):
+            cv2.resize(image, (self.width, self.height), dst=self.resized,
+                       interpolation=cv2.INTER_LINEAR)
+            cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGB, dst=self._rgb)
+            np.divide(self._rgb.transpose(2, 0, 1), 255.0, out=self._batch[idx])
+        # a short last batch is padded with copies, the network always runs batch_size
+        self._batch[len(images):] = self._batch[len(images) - 1]
+
+    def detect(self, images, thresh, hier_thresh=.5, nms=.45):
+        """
+        Returns (original size, detections) for each of the up to batch_size BGR images
+        """
+        assert 0 < len(images) <= self.batch_size, "1 to {} images per batch".format(self.batch_size)
+        self.prepare(images)
+        batch_predictions = darknet.detect_batch(
+            self.network, self.class_names, self.darknet_image, self.batch_size,
+            self.width, self.height, thresh, hier_thresh, nms)
+        return [(image.shape, detections) for image, detections in zip(images, batch_predictions)]
+
+
+"""One Detector per network from load_detector, until unload_detector, see detector_for"""
+_DETECTORS = {}
+
+
+def detector_for(network, class_names, class_colors):
+    """
+    The Detector of a network, created on first use
+    """
+    if network not in _DETECTORS:
+        _DETECTORS[network] = Detector(network, class_names, class_colors)
+    return _DETECTORS[network]
+
+
+def unload_detector(network):
+    """
+    Free a network from load_detector together with its Detector, if one was made.
+    A network loaded later may get the same address, it must not find the old Detector
+    """
+    detector = _DETECTORS.pop(network, None)
+    if detector is not None:
+        detector.close()
+    darknet.free_network_ptr(network)
 
-    darknet.copy_image_from_bytes(darknet_image, image_resized.tobytes())
-    detections = darknet.detect_image(network, class_names, darknet_image, thresh=thresh)
-    darknet.free_image(darknet_image)
-    resized_image = darknet.draw_boxes(detections, image_resized, class_colors)
 
-    return image.shape, cv2.cvtColor(resized_image, cv2.COLOR_BGR2RGB), detections
+def frame_detection(image, network, class_names, class_colors, thresh):
+    return detector_for(network, class_names, class_colors).detect(image, thresh)
 
 
 def convert2relative(image, bbox):
@@ -78,35 +199,219 @@ def convert2relative(image, bbox):
     return x/width, y/height, w/width, h/height
 
 
-def save_annotations(original_size, name, image, detections, class_names):
+def to_annotations(original_size, image, detections):
     """
-    Files saved with image_name.txt and relative coordinates
-    oringinal_size is Ziliang's improvement
+    Detection records of the resized image scaled to pixels of the original image,
+    the same numbers save_annotations writes
+    """
+    original_height, original_width, _ = original_size
+    height, width, _ = image.shape
+    return [detection.scaled(original_width/width, original_height/height) for detection in detections]
+
+
+def write_annotations(name, annotations):
+    """
+    Files saved with image_name.txt, one <class, x, y, w, h, confidence> line per record
     """
-    height, width, _ = original_size
     img_name = os.path.basename(name)
     file_name = os.path.splitext(img_name)[0] + ".txt"
     final_file_name = os.path.dirname(name) + '/annotations/' + file_name
     with open(final_file_name, "w") as f:
-        for label, confidence, bbox in detections:
-            x, y, w, h = convert2relative(image, bbox)
-            label = class_names.index(label)
-            f.write("{} {:.4f} {:.4f} {:.4f} {:.4f} {:.4f}\n".format(label, x*width, y*height, w*width, h*height, float(confidence)))
+        for annotation in annotations:
+            f.write("{} {:.4f} {:.4f} {:.4f} {:.4f} {:.4f}\n".format(*annotation))
+
+
+def save_annotations(original_size, name, image, detections):
+    """
+    Files saved with image_name.txt and relative coordinates
+    oringinal_size is Ziliang's improvement
+    """
+    write_annotations(name, to_annotations(original_size, image, detections))
 
 
-def detect(args: Namespace)-> None:
+def load_detector(args: Namespace):
+    """
+    Check the arguments and load the network once, returns network, class_names, class_colors.
+    Free the network with unload_detector
+    """
     check_arguments_errors(args)
 
     random.seed(3)  # deterministic bbox colors
-    network, class_names, class_colors = darknet.load_network(
+    return darknet.load_network(
         args.config_file,
         args.data_file,
         args.weights,
         batch_size=args.batch_size
     )
 
-    images = load_images(args.input)
 
+def open_cache(args: Namespace, network=None):
+    """
+    The DetectionCache at args.cache for the network and threshold in args, None without args.cache
+    network: network_fingerprint of the network if it is known, e.g. from a detect_server,
+             otherwise it is taken from the files in args
+    """
+    if not getattr(args, "cache", None):
+        return None
+    if network is None:
+        network = network_fingerprint(args.weights, args.config_file, args.data_file)
+    return DetectionCache(args.cache, fingerprint(network, args.thresh), args.cache_size)
+
+
+def detect_file(image_name, network, class_names, class_colors, args: Namespace, cache=None):
+    """
+    Detect one image file with a loaded network, see detect_frame
+    With a cache, a photo it has seen before is not run through the network again,
+    its labels are written from the cached detections
+    """
+    if cache is None:
+        return detect_frame(cv2.imread(image_name), network, class_names, class_colors, args, image_name)
+    with open(image_name, "rb") as f:
+        data = f.read()
+    digest = content_digest(data)
+    annotations = cache.get(digest)
+    if annotations is None:
+        annotations = detect_frame(decode_image(data), network, class_names, class_colors, args, image_name)
+        cache.put(digest, annotations)
+    elif args.save_labels:
+        write_annotations(image_name, annotations)
+    return annotations
+
+
+def detect_frame(image, network, class_names, class_colors, args: Namespace, image_name=None):
+    """
+    Detect one decoded BGR image with a loaded network, returns Detection records in pixels
+    of the image. Labels are saved next to image_name when it is given and args.save_labels
+    """
+    prev_time = time.time()
+    original_size, resized_image, detections = frame_detection(
+        image, network, class_names, class_colors, args.thresh
+        )
+    annotations = to_annotations(original_size, resized_image, detections)
+    if args.save_labels and image_name is not None:
+        write_annotations(image_name, annotations)
+    darknet.print_detections(detections, class_names, args.ext_output)
+    fps = int(1/(time.time() - prev_time))
+    print("FPS: {}".format(fps))
+    return annotations
+
+
+def cached_detections(image_names, args: Namespace, cache, detect_names):
+    """
+    Detection records of image files, from the cache for the photos it has seen (their
+    labels are written again) and from detect_names(names) for the others, which are
+    added to the cache. Returns one list per image, in the order of image_names
+    """
+    digests = [file_digest(name) for name in image_names]
+    cached = [cache.get(digest) for digest in digests]
+    for name, annotations in zip(image_names, cached):
+        if annotations is not None and args.save_labels:
+            write_annotations(name, annotations)
+    missing = [idx for idx, annotations in enumerate(cached) if annotations is None]
+    if missing:
+        detected = detect_names([image_names[idx] for idx in missing])
+        for idx, annotations in zip(missing, detected):
+            cache.put(digests[idx], annotations)
+            cached[idx] = annotations
+    return cached
+
+
+def detect_batches(image_names, network, class_names, args: Namespace, cache=None):
+    """
+    Detect image files args.batch_size at a time, returns one list of Detection records
+    per image, see to_annotations
+    With a cache, only the photos it has not seen are batched through the network
+    """
+    if cache is not None:
+        return cached_detections(image_names, args, cache,
+                                 lambda names: detect_batches(names, network, class_names, args))
+
+    batch_detector = BatchDetector(network, class_names, args.batch_size)
+    results = []
+    for start in range(0, len(image_names), args.batch_size):
+        names = image_names[start:start + args.batch_size]
+        prev_time = time.time()
+        images = [cv2.imread(name) for name in names]
+        for name, (original_size, detections) in zip(names, batch_detector.detect(images, args.thresh)):
+            annotations = to_annotations(original_size, batch_detector.resized, detections)
+            if args.save_labels:
+                write_annotations(name, annotations)
+            darknet.print_detections(detections, class_names, args.ext_output)
+            results.append(annotations)
+        fps = int(len(names)/(time.time() - prev_time))
+        print("FPS: {}".format(fps))
+    return results
+
+
+"""The network of a worker process of detect_parallel, see _init_worker"""
+_WORKER = None
+
+
+def _init_worker(args: Namespace):
+    global _WORKER
+    network, class_names, class_colors = load_detector(args)
+    _WORKER = network, class_names, class_colors, args
+
+
+def _detect_in_worker(image_name):
+    network, class_names, class_colors, args = _WORKER
+    return detect_file(image_name, network, class_names, class_colors, args)
+
+
+def detect_parallel(image_names, args: Namespace, cache=None):
+    """
+    Detect image files in args.workers processes, for CPU-only machines where one darknet
+    process leaves cores idle. Every worker loads the network once and takes the next
+    image name when it is done with the last. Returns one list of Detection records per
+    image, in the order of image_names like detect_batches, whatever order they finish in
+    """
+    if cache is not None:
+        return cached_detections(image_names, args, cache,
+                                 lambda names: detect_parallel(names, args))
+    check_arguments_errors(args)
+    worker_args = Namespace(**vars(args))
+    worker_args.batch_size = 1
+    # the cores are shared out between the workers instead of every worker's OpenMP
+    # starting a thread per core; spawned workers load darknet with this environment
+    threads = os.environ.get("OMP_NUM_THREADS")
+    if threads is None:
+        os.environ["OMP_NUM_THREADS"] = str(max(1, (os.cpu_count() or 1) // args.workers))
+    try:
+        pool = get_context("spawn").Pool(args.workers, _init_worker, (worker_args,))
+    finally:
+        if threads is None:
+            del os.environ["OMP_NUM_THREADS"]
+    with pool:
+        return list(pool.imap(_detect_in_worker, image_names))
+
+
+def detect_remote(image_names, args: Namespace, client, cache=None):
+    """
+    Detect image files with a detect_server, which already has the network loaded,
+    through a connected detect_server.DetectionClient. Returns one list of Detection
+    records per image like detect_batches
+    """
+    if cache is not None:
+        return cached_detections(image_names, args, cache,
+                                 lambda names: detect_remote(names, args, client))
+    results = []
+    for image_name in image_names:
+        prev_time = time.time()
+        annotations = client.detect_file(image_name, args.thresh)
+        if args.save_labels:
+            write_annotations(image_name, annotations)
+        darknet.print_detections(annotations, client.class_names, args.ext_output)
+        print("FPS: {}".format(int(1/(time.time() - prev_time))))
+        results.append(annotations)
+    return results
+
+
+def detect_files(images, network, class_names, class_colors, args: Namespace, cache=None):
+    """
+    Detect the image files one at a time, asking for paths if args.input is empty;
+    those entered are appended to images. Returns one list of Detection records per image
+    """
+    results = []
     index = 0
     while True:
         # loop asking for new image paths if no list is given
@@ -116,16 +421,52 @@ def detect(args: Namespace)-> None:
             image_name = images[index]
         else:
             image_name = input("Enter Image Path: ")
-        prev_time = time.time()
-        original_size, resized_image, detections = image_detection(
-            image_name, network, class_names, class_colors, args.thresh
-            )
-        if args.save_labels:
-            save_annotations(original_size, image_name, resized_image, detections, class_names)
-        darknet.print_detections(detections, args.ext_output)
-        fps = int(1/(time.time() - prev_time))
-        print("FPS: {}".format(fps))
+            images.append(image_name)
+        results.append(detect_file(image_name, network, class_names, class_colors, args, cache))
         index += 1
+    return results
+
+
+def detect(args: Namespace, session=None)-> None:
+    """
+    Detect the images of args.input with whichever detector the arguments ask for.
+    session: session.ScanSession the photos were taken in, their detections are
+             stored in it, tied to the waypoint of each photo by its file name
+    """
+    remote = bool(args.input and getattr(args, "server", None))
+    # the detect_server has the network, its files need not be here
+    check_arguments_errors(args, network_files=not remote)
+    images = load_images(args.input)
+    client = cache = None
+    try:
+        if remote:
+            from detect_server import DetectionClient
+
+            client = DetectionClient(args.server)
+            client.check(args.config_file, args.data_file, args.weights)
+        cache = open_cache(args, client.info["fingerprint"] if remote else None)
+        if remote:
+            results = detect_remote(images, args, client, cache)
+        elif args.input and getattr(args, "workers", 1) > 1:
+            results = detect_parallel(images, args, cache)
+        else:
+            network, class_names, class_colors = load_detector(args)
+            try:
+                if args.input and args.batch_size > 1:
+                    results = detect_batches(images, network, class_names, args, cache)
+                else:
+                    results = detect_files(images, network, class_names, class_colors, args, cache)
+            finally:
+                unload_detector(network)
+    finally:
+        if cache is not None:
+            print(cache.report())
+            cache.close()
+        if client is not None:
+            client.close()
+    if session is not None:
+        print("Detections of {} photos stored in scan session {}".format(
+            session.add_image_detections(zip(images, results)), session.session))
 
 
 if __name__ == "__main__":
@@ -149,6 +490,16 @@ if __name__ == "__main__":
                         help="path to data file")
     parser.add_argument("--thresh", type=float, default=.25,
                         help="remove detections with lower confidence")
+    parser.add_argument("--server", type=str, default=None,
+                        help="Unix socket of a running detect_server.py to send the images to"
+                        " instead of loading the network")
+    parser.add_argument("--workers", default=1, type=int,
+                        help="processes detecting images at the same time, each with its own network")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="SQLite file to keep detections in, photos seen before with the same"
+                        " weights, config and threshold are not detected again")
+    parser.add_argument("--cache_size", type=int, default=10000,
+                        help="photos kept in the detection cache, the least recently used go first")
     parser.add_argument('-v', '--verbose', action='store_true', help='Verbose mode')
     arguments = parser.parse_args()
 
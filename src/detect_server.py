@@ -0,0 +1,269 @@
+'''
+A resident detection service. The server loads libdarknet and the network once and
+answers detection requests on a local Unix socket, so a scan-and-pick cycle no longer
+pays for loading the library and the weights before its first photo.
+DetectionClient is the other end, used by detect.py --server; it does not load darknet.
+
+Every message is a 4 byte big-endian length and a JSON header, then a 4 byte length
+and a payload, the encoded photo or nothing.
+    python detect_server.py --socket /tmp/farmbot-detect.sock
+'''
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from logging import DEBUG, INFO, basicConfig, getLogger
+from pathlib import Path
+from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+from typing import List, Optional, Tuple
+
+from cache import network_fingerprint
+from records import Detection
+
+
+_LOG = getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/farmbot-detect.sock'
+_LENGTH = struct.Struct('!I')
+_MAX_HEADER = 1 << 20
+
+
+def send_message(stream, header: dict, payload: bytes = b'') -> None:
+    body = json.dumps(header).encode()
+    stream.write(_LENGTH.pack(len(body)) + body + _LENGTH.pack(len(payload)))
+    if payload:
+        stream.write(payload)
+    stream.flush()
+
+
+def _read_exactly(stream, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) < size:
+        raise ConnectionError('Connection closed in the middle of a message')
+    return data
+
+
+def receive_message(stream) -> Tuple[Optional[dict], bytes]:
+    '''
+    The next (header, payload) on the stream, (None, b'') when it was closed between messages
+    '''
+    prefix = stream.read(_LENGTH.size)
+    if not prefix:
+        return None, b''
+    if len(prefix) < _LENGTH.size:
+        raise ConnectionError('Connection closed in the middle of a message')
+    size, = _LENGTH.unpack(prefix)
+    if size > _MAX_HEADER:
+        raise ValueError('Message header of {} bytes is too large'.format(size))
+    header = json.loads(_read_exactly(stream, size).decode())
+    size, = _LENGTH.unpack(_read_exactly(stream, _LENGTH.size))
+    return header, _read_exactly(stream, size)
+
+
+class _Handler(StreamRequestHandler):
+    def handle(self):
+        # one connection can send any number of requests
+        try:
+            while True:
+                header, payload = receive_message(self.rfile)
+                if header is None:
+                    return
+                try:
+                    reply = self.server.serve(header, payload)
+                except Exception as e:
+                    _LOG.error('Request {} failed: {}'.format(header, e))
+                    reply = {'error': '{}: {}'.format(type(e).__name__, e)}
+                send_message(self.wfile, reply)
+        except ConnectionError as e:
+            _LOG.debug('Client gone: {}'.format(e))
+
+
+class DetectionServer(ThreadingMixIn, UnixStreamServer):
+    '''
+    Serves detections of one loaded network. Connections are handled in their own
+    threads; the network is used by one request at a time
+    '''
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, config_file: str, data_file: str, weights: str):
+        # only the server loads darknet, the client side imports this module without it
+        import darknet
+        from detect import Detector
+
+        _remove_stale_socket(socket_path)
+        start = time.time()
+        network, class_names, class_colors = darknet.load_network(config_file, data_file, weights)
+        _LOG.info('Network loaded in {:.1f} s'.format(time.time() - start))
+        self.detector = Detector(network, class_names, class_colors)
+        self.files = {'config_file': os.path.realpath(config_file),
+                      'data_file': os.path.realpath(data_file),
+                      'weights': os.path.realpath(weights)}
+        self.fingerprint = network_fingerprint(weights, config_file, data_file)
+        self.served = 0
+        self._lock = threading.Lock()
+        super().__init__(socket_path, _Handler)
+
+    def serve(self, header: dict, payload: bytes) -> dict:
+        op = header.get('op', 'detect')
+        if op == 'info':
+            return dict(self.files, class_names=self.detector.class_names, pid=os.getpid(),
+                        served=self.served, fingerprint=self.fingerprint)
+        if op == 'check':
+            return {'same': self.runs(header['config_file'], header['data_file'], header['weights'])}
+        if op != 'detect':
+            raise ValueError('Unknown operation {}'.format(op))
+        return {'detections': [list(detection) for detection in
+                               self.detect(payload, header.get('path'), header['thresh'])]}
+
+    def runs(self, config_file: str, data_file: str, weights: str) -> Optional[bool]:
+        '''
+        Whether the network is that of these files: the same files, or files with the same
+        content, see cache.network_fingerprint. None if they cannot be read from here
+        '''
+        files = {'config_file': config_file, 'data_file': data_file, 'weights': weights}
+        if all(os.path.realpath(path) == self.files[key] for key, path in files.items()):
+            return True
+        try:
+            return network_fingerprint(weights, config_file, data_file) == self.fingerprint
+        except OSError:
+            return None
+
+    def detect(self, data: bytes, path: Optional[str], thresh: float) -> List[Detection]:
+        '''
+        Detection records in pixels of the photo, given encoded or as a path the server can read
+        '''
+        import cv2
+        import darknet
+        from detect import decode_image, to_annotations
+
+        if data:
+            image = decode_image(data)
+        else:
+            image = cv2.imread(path)
+            if image is None:
+                raise ValueError('Unable to read image {}'.format(path))
+        with self._lock:
+            resized = self.detector.prepare(image)
+            detections = darknet.detect_image(self.detector.network, self.detector.class_names,
+                                              self.detector.darknet_image, thresh=thresh)
+            self.served += 1
+            return to_annotations(image.shape, resized, detections)
+
+    def server_close(self):
+        import darknet
+
+        super().server_close()
+        # the IMAGE and the network go together
+        self.detector.close()
+        darknet.free_network_ptr(self.detector.network)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def _remove_stale_socket(socket_path: str) -> None:
+    '''Remove the socket file a server left behind, refuse to take over a running one'''
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(socket_path)
+    else:
+        raise RuntimeError('A detection server is already running on {}'.format(socket_path))
+    finally:
+        probe.close()
+
+
+class DetectionClient:
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: Optional[float] = None):
+        '''
+        Connects to a running DetectionServer and asks for its network
+        timeout: seconds to wait for a reply, None waits as long as it takes
+        '''
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(socket_path)
+        self._reader = self._socket.makefile('rb')
+        self._writer = self._socket.makefile('wb')
+        self.info = self._call({'op': 'info'})
+        self.class_names = self.info['class_names']
+
+    def _call(self, header: dict, payload: bytes = b'') -> dict:
+        send_message(self._writer, header, payload)
+        reply, _ = receive_message(self._reader)
+        if reply is None:
+            raise ConnectionError('The detection server closed the connection')
+        if 'error' in reply:
+            raise RuntimeError('Detection server: {}'.format(reply['error']))
+        return reply
+
+    def check(self, config_file: str, data_file: str, weights: str) -> None:
+        '''
+        Raise ValueError if the server runs another network than these files. The paths are
+        resolved here, against this working directory, and compared by the server; files
+        it cannot find are not compared, the server's network is used then
+        '''
+        files = {'config_file': os.path.realpath(config_file), 'data_file': os.path.realpath(data_file),
+                 'weights': os.path.realpath(weights)}
+        same = self._call(dict(files, op='check'))['same']
+        if same is None:
+            _LOG.warning('Unable to compare {} with the network of the detection server, using its {}'.format(
+                files, {key: self.info[key] for key in files}))
+        elif not same:
+            raise ValueError('The detection server runs {}, not {}'.format(
+                {key: self.info[key] for key in files}, files))
+
+    def detect(self, data: bytes, thresh: float) -> List[Detection]:
+        '''Detection records of an encoded photo'''
+        return self._records(self._call({'op': 'detect', 'thresh': thresh}, data))
+
+    def detect_file(self, path: str, thresh: float) -> List[Detection]:
+        '''Detection records of a photo the server reads from disk'''
+        return self._records(self._call({'op': 'detect', 'thresh': thresh, 'path': os.path.abspath(path)}))
+
+    @staticmethod
+    def _records(reply: dict) -> List[Detection]:
+        return [Detection(int(row[0]), *row[1:]) for row in reply['detections']]
+
+    def close(self) -> None:
+        for stream in (self._reader, self._writer, self._socket):
+            stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Keep the YOLO network loaded and serve detections on a Unix socket')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='path of the Unix socket')
+    parser.add_argument("--weights", default="../weights/yolov3-vattenhallen_best.weights",
+                        help="yolo weights path")
+    parser.add_argument("--config_file", default="../cfg/yolov3-vattenhallen-test.cfg",
+                        help="path to config file")
+    parser.add_argument("--data_file", default="../data/vattenhallen.data",
+                        help="path to data file")
+    parser.add_argument('-l', '--log', type=Path, default='../log/detect_server.log',
+                        help='Path to the log file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose mode')
+    arguments = parser.parse_args()
+
+    basicConfig(filename=arguments.log, level=DEBUG if arguments.verbose else INFO)
+    server = DetectionServer(arguments.socket, arguments.config_file, arguments.data_file, arguments.weights)
+    _LOG.info('Serving detections on {}'.format(arguments.socket))
+    # stopped as a service, clean up the socket like on ctrl-c
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,144 @@
+"""
+A stand-in for libdarknet, for machines without the library and for testing.
+It has the library functions darknet.py binds and detects whatever boxes a callback
+returns for the frame, so the whole detection path runs without a network:
+
+    darknet.configure(backend=FakeDarknet(class_names=["tomato", "potato"]))
+"""
+from ctypes import POINTER, addressof, c_char_p, c_float, c_uint8, c_void_p, cast, sizeof
+
+import numpy as np
+
+from darknet import BOX, DETECTION, DETNUMPAIR, IMAGE, METADATA
+
+
+def _box_iou(a, b):
+    overlap_w = min(a.x + a.w/2, b.x + b.w/2) - max(a.x - a.w/2, b.x - b.w/2)
+    overlap_h = min(a.y + a.h/2, b.y + b.h/2) - max(a.y - a.h/2, b.y - b.h/2)
+    if overlap_w < 0 or overlap_h < 0:
+        return 0
+    intersection = overlap_w * overlap_h
+    return intersection / (a.w*a.h + b.w*b.h - intersection)
+
+
+class FakeDarknet:
+    def __init__(self, width=416, height=416, class_names=("object",), detections=None):
+        """
+        width, height: the network input size
+        class_names: what get_metadata reports
+        detections: called with each frame (height x width x 3 float RGB in 0..1), returns
+                    (class_id, x, y, w, h, probability) boxes in network pixels;
+                    by default nothing is detected
+        """
+        self.width = width
+        self.height = height
+        self.class_names = list(class_names)
+        self.detections = detections or (lambda frame: [])
+        self.predictions = 0
+        self._networks = {}
+        # ctypes buffers handed out, kept alive until darknet.py frees them
+        self._alive = {}
+        self._names = (c_char_p * len(self.class_names))(*[name.encode("ascii") for name in self.class_names])
+
+    # network
+    def load_network_custom(self, config_file, weights, clear, batch_size):
+        handle = len(self._networks) + 1
+        self._networks[handle] = {"batch_size": batch_size, "frames": []}
+        return handle
+
+    def free_network_ptr(self, network):
+        self._networks.pop(network, None)
+
+    def get_metadata(self, data_file):
+        return METADATA(len(self.class_names), self._names)
+
+    def network_width(self, network):
+        return self.width
+
+    def network_height(self, network):
+        return self.height
+
+    # images
+    def make_image(self, width, height, channels):
+        data = (c_float * (width * height * channels))()
+        image = IMAGE(width, height, channels, cast(data, POINTER(c_float)))
+        self._alive[addressof(data)] = data
+        return image
+
+    def free_image(self, image):
+        self._alive.pop(cast(image.data, c_void_p).value, None)
+
+    def copy_image_from_bytes(self, image, data):
+        # interleaved 8 bit RGB in, planar floats out, like darknet
+        size = image.w * image.h * image.c
+        pixels = np.frombuffer((c_uint8 * size).from_address(cast(data, c_void_p).value), dtype=np.uint8)
+        planes = np.ctypeslib.as_array(image.data, shape=(size,))
+        planes[:] = (pixels.reshape((image.h, image.w, image.c)).transpose(2, 0, 1) / 255.0).ravel()
+
+    @staticmethod
+    def _frame(image, index=0):
+        size = image.w * image.h * image.c
+        planes = np.ctypeslib.as_array(image.data, shape=((index + 1) * size,))[index * size:]
+        return planes.reshape((image.c, image.h, image.w)).transpose(1, 2, 0)
+
+    # inference
+    def network_predict_image(self, network, image):
+        self.predictions += 1
+        self._networks[network]["frames"] = [self._frame(image).copy()]
+        return POINTER(c_float)()
+
+    def _boxes(self, frame, width, height, thresh, pnum):
+        boxes = [box for box in self.detections(frame) if box[5] >= thresh]
+        classes = len(self.class_names)
+        detections = (DETECTION * max(len(boxes), 1))()
+        probs = (c_float * (classes * max(len(boxes), 1)))()
+        scale_x, scale_y = width / self.width, height / self.height
+        for detection, (class_id, x, y, w, h, probability), row in zip(detections, boxes, range(len(boxes))):
+            detection.bbox = BOX(x * scale_x, y * scale_y, w * scale_x, h * scale_y)
+            detection.classes = classes
+            detection.best_class_idx = class_id
+            detection.prob = cast(addressof(probs) + row * classes * sizeof(c_float), POINTER(c_float))
+            detection.prob[class_id] = probability
+            detection.objectness = probability
+        self._alive[addressof(detections)] = (detections, probs)
+        if pnum:
+            pnum[0] = len(boxes)
+        return detections, len(boxes)
+
+    def get_network_boxes(self, network, width, height, thresh, hier_thresh, map, relative, pnum, letter):
+        detections, _ = self._boxes(self._networks[network]["frames"][0], width, height, thresh, pnum)
+        return cast(detections, POINTER(DETECTION))
+
+    def do_nms_sort(self, detections, num, classes, nms):
+        # box.c do_nms_sort, one box at a time
+        rows = [detections[i] for i in range(num) if detections[i].objectness != 0]
+        for k in range(classes):
+            rows.sort(key=lambda detection: -detection.prob[k])
+            for i, a in enumerate(rows):
+                if a.prob[k] == 0:
+                    continue
+                for b in rows[i + 1:]:
+                    if _box_iou(a.bbox, b.bbox) > nms:
+                        b.prob[k] = 0
+
+    def do_nms_obj(self, detections, num, classes, nms):
+        pass
+
+    def free_detections(self, detections, num):
+        self._alive.pop(cast(detections, c_void_p).value, None)
+
+    def network_predict_batch(self, network, image, batch_size, width, height,
+                              thresh, hier_thresh, map, relative, letter):
+        self.predictions += batch_size
+        pairs = (DETNUMPAIR * batch_size)()
+        for index, pair in enumerate(pairs):
+            detections, num = self._boxes(self._frame(image, index), width, height, thresh, None)
+            pair.num = num
+            pair.dets = cast(detections, POINTER(DETECTION))
+        self._alive[addressof(pairs)] = pairs
+        return cast(pairs, POINTER(DETNUMPAIR))
+
+    def free_batch_detections(self, pairs, batch_size):
+        for index in range(batch_size):
+            self.free_detections(pairs[index].dets, pairs[index].num)
+        self._alive.pop(cast(pairs, c_void_p).value, None)
@@ -1,11 +1,163 @@
 #!/usr/bin/env python3
+'''
+The gripper, an Arduino on a serial port that opens on "o" and closes on "c".
+One Gripper keeps the port open for the whole run and knows when a command is done:
+either the firmware answers with an acknowledgement once the servo has stopped, or,
+without one, the gripper is taken to be busy for actuation_time seconds after a command.
+A command waits for the one before it, so a caller may send open(wait=False) before a
+gantry move and only pay for what the move did not hide.
+Any serial device works as the port, e.g. the slave end of os.openpty() for testing.
+'''
+import time
+from logging import getLogger
+from typing import Optional
+
 import serial
+
+
+_LOG = getLogger(__name__)
+
+DEFAULT_PORT = '/dev/ttyUSB0'
+OPEN, CLOSE = b'o', b'c'
+
+
+class ActuationMetrics:
+    '''Counters for one command: latency is from sending it until the gripper is done'''
+    def __init__(self):
+        self.sent = 0
+        self.skipped = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.waited_seconds = 0.0
+
+    def observe(self, seconds: float, waited: float) -> None:
+        self.sent += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.waited_seconds += waited
+
+    def __repr__(self):
+        mean = self.total_seconds / self.sent if self.sent else 0.0
+        return 'sent={} skipped={} mean={:.3f}s max={:.3f}s waited={:.3f}s'.format(
+            self.sent, self.skipped, mean, self.max_seconds, self.waited_seconds)
+
+
+class Gripper:
+    def __init__(self, port: str = DEFAULT_PORT, baudrate: int = 9600, ack: Optional[bytes] = None,
+                 actuation_time: float = 1.0, timeout: float = 5.0, startup: float = 2.0):
+        '''
+        port: serial device of the gripper
+        ack: what the firmware sends when a command is done, None to use actuation_time
+        actuation_time: seconds an open or close takes, without ack
+        timeout: seconds to wait for ack before giving up
+        startup: seconds the Arduino needs after the port is opened, it resets on connection
+        '''
+        self.ack = ack
+        self.actuation_time = actuation_time
+        self.timeout = timeout
+        # None until the first command, the gripper may have been left either way
+        self.state = None
+        self.metrics = {OPEN: ActuationMetrics(), CLOSE: ActuationMetrics()}
+        self._serial = serial.Serial(port, baudrate, timeout=timeout)
+        self._ready_at = time.monotonic() + startup
+        self._pending = None
+        _LOG.info('Gripper on {}, {}'.format(port, 'acknowledged' if ack else
+                                              'timed at {:.2f} s'.format(actuation_time)))
+
+    def open(self, wait: bool = True, force: bool = False) -> None:
+        self._command(OPEN, wait, force)
+
+    def close(self, wait: bool = True, force: bool = False) -> None:
+        self._command(CLOSE, wait, force)
+
+    def _command(self, command: bytes, wait: bool, force: bool) -> None:
+        '''
+        Send command after the previous one is done, unless the gripper is already there.
+        wait: return only when the gripper is done
+        force: send it even if the gripper should be there already
+        '''
+        self.wait()
+        if self.state == command and not force:
+            self.metrics[command].skipped += 1
+            return
+        if self.ack:
+            # whatever arrived since, e.g. the greeting after a reset, is not our answer
+            self._serial.reset_input_buffer()
+        self._serial.write(command)
+        self._serial.flush()
+        sent = time.monotonic()
+        self._pending = (command, sent)
+        self._ready_at = sent + self.actuation_time
+        self.state = command
+        if wait:
+            self.wait()
+
+    def wait(self) -> None:
+        '''Block until the last command is done, raise TimeoutError if it is not acknowledged'''
+        start = time.monotonic()
+        if self._pending is None:
+            # only the start-up delay
+            time.sleep(max(0.0, self._ready_at - start))
+            return
+        command, sent = self._pending
+        if self.ack:
+            answer = self._serial.read_until(self.ack)
+            if not answer.endswith(self.ack):
+                self.state = None
+                self._pending = None
+                raise TimeoutError('Gripper did not acknowledge {!r} within {} s'.format(command, self.timeout))
+        else:
+            time.sleep(max(0.0, self._ready_at - start))
+        done = time.monotonic()
+        self._ready_at = done
+        self._pending = None
+        self.metrics[command].observe(done - sent, done - start)
+
+    def report(self) -> str:
+        return 'Gripper: open [{}], close [{}]'.format(self.metrics[OPEN], self.metrics[CLOSE])
+
+    def shutdown(self) -> None:
+        if self._serial.is_open:
+            try:
+                if self._pending is not None:
+                    self.wait()
+            finally:
+                self._serial.close()
+                _LOG.info(self.report())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+
+"""Gripper shared by every pick of a run, see get_gripper"""
+_GRIPPER = None
+
+
+def get_gripper(port: str = DEFAULT_PORT, **options) -> Gripper:
+    '''
+    Return the gripper shared by the whole run, opening the port on first use;
+    port and options (see Gripper) only apply then. Call close_gripper() at the end
+    '''
+    global _GRIPPER
+    if _GRIPPER is None:
+        _GRIPPER = Gripper(port, **options)
+    return _GRIPPER
+
+
+def close_gripper() -> None:
+    '''Close the port of the shared gripper, if it was ever opened, and log its metrics'''
+    global _GRIPPER
+    if _GRIPPER is not None:
+        _GRIPPER.shutdown()
+        _GRIPPER = None
+
+
 def gripper_open():
-    ser = serial.Serial('/dev/ttyUSB0')
-    ser.write(str.encode("o"))
-    ser.close
+    get_gripper().open()
+
 
 def gripper_close():
-    ser = serial.Serial('/dev/ttyUSB0')
-    ser.write(str.encode("c"))
-    ser.close
\ No newline at end of file
+    get_gripper().close()
@@ -0,0 +1,144 @@
+'''
+A local stand-in for the MQTT broker and the FarmBot behind it.
+LocalBroker has the same interface as paho.mqtt.client.Client as far as
+client.FarmbotClient uses it, and answers every rpc_request published on
+bot/<device>/from_clients with a reply on bot/<device>/from_device, so the
+client can be run and timed without network or hardware.
+'''
+import heapq
+import json
+import threading
+import time
+from itertools import count
+from logging import getLogger
+from typing import Callable, Optional
+
+
+_LOG = getLogger(__name__)
+
+
+class LocalMessage:
+    '''Same fields as paho.mqtt.client.MQTTMessage that the callbacks read'''
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+
+def always_ok(request: dict) -> Optional[str]:
+    '''
+    Default responder, acknowledges everything
+    A responder gets the decoded request and returns the reply kind,
+    or None to drop the request (the client will time out)
+    '''
+    return 'rpc_ok'
+
+
+class LocalBroker:
+    def __init__(self, latency: float = 0.0, round_trip: float = 0.0, connect_latency: float = 0.0,
+                 responder: Callable[[dict], Optional[str]] = always_ok):
+        '''
+        latency: seconds the bot spends on each request before replying, i.e. how long
+                 the "move" takes; queued requests are worked through in order
+        round_trip: network time there and back between client and bot
+        connect_latency: seconds between connect() and the on_connect callback
+        responder: decides the reply kind for each request, see always_ok
+        '''
+        self.latency = latency
+        self.round_trip = round_trip
+        self.connect_latency = connect_latency
+        self.responder = responder
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self.subscriptions = []
+        self.published = []
+        # the bot works through its requests one after another
+        self._busy_until = 0.0
+        # single "network" thread, like paho's loop_start, running scheduled callbacks in order
+        self._events = []
+        self._sequence = count()
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def username_pw_set(self, username, password=None):
+        self.username = username
+
+    def connect(self, host, port=1883, keepalive=60):
+        _LOG.debug('Local broker standing in for {}:{}'.format(host, port))
+        self._schedule(self.connect_latency, self._connected)
+
+    def reconnect(self):
+        self._schedule(self.connect_latency, self._connected)
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def drop_connection(self):
+        '''Simulate the link going down; like paho, reconnect right after'''
+        self._schedule(0, lambda: self._disconnected(1))
+        self.reconnect()
+
+    def loop_start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name='local-broker', daemon=True)
+        self._thread.start()
+
+    def loop_stop(self):
+        with self._wakeup:
+            self._running = False
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def disconnect(self):
+        self._schedule(0, self._disconnected)
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append(topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload))
+        if not topic.endswith('/from_clients'):
+            return
+        request = json.loads(payload)
+        kind = self.responder(request)
+        if kind is None:
+            return
+        reply = {'kind': kind, 'args': {'label': request['args']['label']}}
+        reply_topic = topic[:-len('/from_clients')] + '/from_device'
+        message = LocalMessage(reply_topic, json.dumps(reply).encode())
+        now = time.monotonic()
+        self._busy_until = max(now + self.round_trip/2, self._busy_until) + self.latency
+        self._schedule(self._busy_until + self.round_trip/2 - now, lambda: self._deliver(message))
+
+    def _connected(self):
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+
+    def _disconnected(self, rc=0):
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, None, rc)
+
+    def _deliver(self, message: LocalMessage):
+        if self.on_message is not None and \
+                any(message.topic == topic for topic in self.subscriptions):
+            self.on_message(self, None, message)
+
+    def _schedule(self, delay: float, callback):
+        with self._wakeup:
+            heapq.heappush(self._events, (time.monotonic() + delay, next(self._sequence), callback))
+            self._wakeup.notify()
+
+    def _loop(self):
+        while True:
+            with self._wakeup:
+                while self._running and \
+                        (not self._events or self._events[0][0] > time.monotonic()):
+                    timeout = self._events[0][0] - time.monotonic() if self._events else None
+                    self._wakeup.wait(timeout)
+                if not self._running:
+                    return
+                _, _, callback = heapq.heappop(self._events)
+            callback()
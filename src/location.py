@@ -8,12 +8,14 @@ coordinate transform. See details in README.md
 from argparse import ArgumentParser, Namespace
 from logging import basicConfig, DEBUG, INFO, getLogger
 from pathlib import Path
-from numpy import array, ndarray, dot, squeeze
+from numpy import array, asarray, ndarray, dot, empty, squeeze, column_stack, ones
 from numpy.linalg import inv
 from os import listdir
 from os.path import join, isfile
-from scipy.io import loadmat
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
+
+from calibration import load_calibration
+from records import Detection
 
 
 """Logger for log file"""
@@ -76,12 +78,12 @@ def load_cam_matrix(cam_path: Path) -> Optional[ndarray]:
         return None
 
     try:
-        data = loadmat(cam_path)
+        # parsed once, then read from the calibration cache
+        intrinsic_matrix = load_calibration(cam_path).cam_matrix
     except FileNotFoundError:
         _LOG.error(' No such file')
         return None
-        
-    intrinsic_matrix = data['camera_no_distortion'][0, 0][11] 
+
     _LOG.info('Load intrinsic_matrix of the camera \n{}'.format(intrinsic_matrix))
     return intrinsic_matrix
 
@@ -124,6 +126,21 @@ def read_locations(locations_path: Path) -> Optional[ndarray]:
     return array(list_location)
 
 
+"""Inverse of the transposed K matrix per calibration, see inverse_cam_matrix"""
+_INVERSE_CACHE = {}
+
+
+def inverse_cam_matrix(cam_matrix: ndarray) -> ndarray:
+    '''
+    inv(K'), computed once per calibration and cached by the matrix content.
+    MATLAB stores K transposed, hence the transpose
+    '''
+    key = cam_matrix.tobytes()
+    if key not in _INVERSE_CACHE:
+        _INVERSE_CACHE[key] = inv(cam_matrix.transpose())
+    return _INVERSE_CACHE[key]
+
+
 def cam_coordinate(pixel_x: int, pixel_y: int, cam_matrix) -> Tuple[float, float]:
     '''
     Project one object's pixel coordinate into  the camera coordinate system
@@ -132,7 +149,7 @@ def cam_coordinate(pixel_x: int, pixel_y: int, cam_matrix) -> Tuple[float, float
            inner_matrix: matrix K that contains focal length and other inner parameters
     Output: object's centroid location in camera coordinate
     '''
-    normalized_coordinate = dot(inv(cam_matrix.transpose()), array([pixel_x, pixel_y, 1], dtype=float).reshape((3, 1)))
+    normalized_coordinate = dot(inverse_cam_matrix(cam_matrix), array([pixel_x, pixel_y, 1], dtype=float).reshape((3, 1)))
     camera_coordinate = squeeze(normalized_coordinate)
     ratio = float(SWEEP_Z / camera_coordinate[2])
     local_position = (ratio*camera_coordinate[0], ratio*camera_coordinate[1])
@@ -159,18 +176,101 @@ def global_coordinate(cam_coordinate: Tuple[float, float],
     return (global_x, global_y)
 
 
-def cal_location(args: Namespace) -> ndarray:
+def cam_coordinates(pixels: ndarray, cam_matrix: ndarray) -> ndarray:
+    '''
+    cam_coordinate for many objects at once
+
+    Input: pixels: N x 2 array of bounding box centres <x, y> in pixels
+    Output: N x 2 array of their locations in camera coordinate
+    '''
+    pixels = asarray(pixels, dtype=float).reshape((-1, 2))
+    homogeneous = column_stack((pixels, ones(len(pixels))))
+    normalized = homogeneous @ inverse_cam_matrix(cam_matrix).transpose()
+    return normalized[:, :2] * (SWEEP_Z / normalized[:, 2:3])
+
+
+def global_coordinates(cam_coordinates: ndarray, cam_locations: ndarray,
+                       cam_offset: Tuple[int, int], gripper_offset: Tuple[int, int]) -> ndarray:
+    '''
+    global_coordinate for many objects at once
+
+    Input: cam_coordinates: N x 2 array, objects' locations in camera coordinate
+           cam_locations: N x 3 (or N x 2) array, camera's location for each object,
+                          or a single <x, y, z> shared by all of them
+    Output: N x 2 array of global locations
+    '''
+    cam_locations = asarray(cam_locations, dtype=float)
+    global_xy = empty((len(cam_coordinates), 2))
+    global_xy[:, 0] = -cam_coordinates[:, 1] + cam_locations[..., 0] + cam_offset[0] + gripper_offset[0]
+    global_xy[:, 1] = cam_coordinates[:, 0] + cam_locations[..., 1] + cam_offset[1] + gripper_offset[1]
+    return global_xy
+
+
+def pixels_to_global(pixels: ndarray, cam_locations: ndarray, cam_matrix: ndarray,
+                     cam_offset: Tuple[int, int], gripper_offset: Tuple[int, int]) -> ndarray:
+    '''
+    Pixel coordinates of N objects straight to global coordinates in one vectorized pass
+
+    Input: pixels: N x 2 array of bounding box centres
+           cam_locations: camera's location for each object (N x 3) or for all of them (3,)
+    Output: N x 2 array of global locations
+    '''
+    return global_coordinates(cam_coordinates(pixels, cam_matrix), cam_locations,
+                              cam_offset, gripper_offset)
+
+
+def parse_annotation(annotation: str) -> Detection:
+    '''
+    One line <class, x, y, w, h, confidence> of an annotation file as a record
+    '''
+    category, x, y, w, h, confidence = annotation.split()
+    return Detection(int(category), float(x), float(y), float(w), float(h), float(confidence))
+
+
+def locate(annotations: List[Detection], cam_location: CameraPosition, cam_matrix,
+           cam_offset: Tuple[int, int], gripper_offset: Tuple[int, int]) -> List[list]:
+    '''
+    Global coordinates of the detections in one photo
+
+    Input: annotations: Detection records in pixels of the photo
+           cam_location: camera's location reading from the encoder <x, y, z> for this photo
+    Output: one [class, x, y, confidence] per detection
+    '''
+    if not annotations:
+        return []
+    pixels = [(detection.x, detection.y) for detection in annotations]
+    global_xy = pixels_to_global(pixels, cam_location, cam_matrix, cam_offset, gripper_offset)
+    list_global_coordinate = [[detection.class_id, global_x, global_y, detection.confidence]
+                              for detection, (global_x, global_y) in zip(annotations, global_xy.tolist())]
+    _LOG.debug(list_global_coordinate)
+    return list_global_coordinate
+
+
+def cal_location(args: Namespace, with_photo: bool = False, session=None) -> List[list]:
     '''
     main function for this script
+    Returns [class, x, y, confidence] per detection, with_photo adds the number of the
+    photo (in the order they were taken) as a fifth column; class and photo are ints
+    session: session.ScanSession the scan was recorded and detected in, see detect.detect;
+             its waypoints and detections are located in one query instead of reading
+             args.locations and the annotation files
     '''
-    cam_offset, gripper_offset = read_offsets(args.offset)
-    K_matrix = load_cam_matrix(args.camera_matrix)
+    calibration = load_calibration(args.camera_matrix, args.offset)
+    cam_offset, gripper_offset = calibration.cam_offset, calibration.gripper_offset
+    K_matrix = calibration.cam_matrix
+    if session is not None:
+        located = session.locate(K_matrix, cam_offset, gripper_offset)
+        _LOG.info('Global coordinate calculation is done.')
+        rows = [[int(row[0])] + row[1:4] + [int(row[4])] for row in located.tolist()]
+        return rows if with_photo else [row[:4] for row in rows]
     list_location = read_locations(args.locations) 
     # iterate over each annotation file
     _LOG.info('Global coordinate calculation begins.')
     list_annotations = listdir(args.annotations)
     # sort by chronological order  / specific for the filename on Ziliang's PC, change if other names
     list_annotations.sort() 
+    detections = []
+    photo_indices = []
     # read annotations
     for index_photo, annotation_file in enumerate(list_annotations):
         filepath = Path(args.annotations, annotation_file)
@@ -192,26 +292,21 @@ def cal_location(args: Namespace) -> ndarray:
             return None
         _LOG.debug('Load annotation {}'.format(annotations))
 
-        list_global_coordinate = []
-        for annotation in annotations:
-            detection = annotation.split()
-            # read the center_x center_y and class
-            center_x = detection[1]
-            center_y = detection[2]
-            category = detection[0]
-            confidence = detection[5]
-            # pixel coordinate to camera coordinate
-            local_coordinate = cam_coordinate(center_x, center_y, K_matrix)
-            print(local_coordinate)
-
-            # camera coordinate to global coordinate
-            global_x, global_y = global_coordinate(local_coordinate, 
-                                list_location[index_photo], cam_offset, gripper_offset)
-            list_global_coordinate.append([category, global_x, global_y, confidence])     
-            _LOG.debug(list_global_coordinate[-1])   
-    
+        rows = [parse_annotation(annotation) for annotation in annotations if annotation.strip()]
+        detections.extend(rows)
+        photo_indices.extend([index_photo] * len(rows))
+
+    # all the boxes of the scan in one pass
+    pixels = [(detection.x, detection.y) for detection in detections]
+    global_xy = pixels_to_global(pixels, list_location[photo_indices], K_matrix, cam_offset, gripper_offset)
+    list_global_coordinate = [[detection.class_id, global_x, global_y, detection.confidence]
+                              for detection, (global_x, global_y) in zip(detections, global_xy.tolist())]
+    if with_photo:
+        for coordinate, index_photo in zip(list_global_coordinate, photo_indices):
+            coordinate.append(index_photo)
     _LOG.info('Global coordinate calculation is done.')
-    return array(list_global_coordinate)
+    # a list keeps class and photo ints, and an empty scan still fits the DataFrame columns
+    return list_global_coordinate
 
 
 if __name__ == '__main__':
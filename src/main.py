@@ -8,10 +8,15 @@ from logging import StringTemplateStyle
 from os import listdir, remove
 from os.path import join
 from pathlib import Path
-from typing import Tuple
-from numpy import sqrt
-from pandas import DataFrame
-from gripper import gripper_close, gripper_open
+from queue import Queue
+from threading import Thread
+from typing import TYPE_CHECKING, Callable, List, Tuple
+from gripper import close_gripper, get_gripper
+from calibration import load_calibration
+# pandas, clustering, the detect_server client, the planner and the scan session are
+# imported where they are used, runs that stop before them start faster
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
 from move import *
 from detect import *
@@ -25,27 +30,19 @@ ORIGIN_X = 0
 ORIGIN_Y = 0
 ORIGIN_Z = 0
 
-def remove_overlap(table_coordinate:DataFrame, tolerance=50.00)->DataFrame:
+def remove_overlap(table_coordinate:'DataFrame', tolerance=50.00, fuse=False)->'DataFrame':
     '''
-    compare every two coordinates, if their Euclidean distance is smaller than tolerance
-    , delete the one with lower probability
+    Detections of a class within tolerance of the most confident one near them are the
+    same target, keep that one of each group
 
     Choose a reasonable tolerance!!
     :param table_coordinate: pandas dataframe that each row corresponds to a target [class, x, y, confidence]
     :param tolerance: a distance threshold
+    :param fuse: move each kept target to the confidence weighted mean of its group
     '''
-    num_coordinates, num_col = table_coordinate.shape
-    for i in range(num_coordinates-1):
-        x, y, confidence = table_coordinate.loc[i, ['x','y', 'confidence']]
-        for j in range(i+1, num_coordinates):
-                x_j, y_j, confidence_j = table_coordinate.loc[j, ['x','y', 'confidence']]
-                distance = sqrt((float(x)-float(x_j))*(float(x)-float(x_j)) + (float(y)-float(y_j))*(float(y)-float(y_j)))  
-                if distance <= tolerance:
-                    if confidence < confidence_j:
-                        table_coordinate.drop(i)
-                    else:
-                        table_coordinate.drop(j)
-    return table_coordinate              
+    from cluster import merge_duplicates
+
+    return merge_duplicates(table_coordinate, tolerance, fuse=fuse)
 
 
 
@@ -60,6 +57,121 @@ def remove_temp(path: Path)-> None:
     return
 
 
+def _stage(work: Callable, source: Queue, sink: Queue, errors: List[Exception]) -> Thread:
+    '''
+    Thread that applies work to every item of source and puts the result into sink,
+    until it gets None, which is passed on. Exceptions end up in errors
+    '''
+    def run():
+        while True:
+            item = source.get()
+            if item is None:
+                break
+            try:
+                sink.put(work(*item))
+            except Exception as e:
+                _LOG.error('Pipeline stage failed on {}: {}'.format(item, e))
+                errors.append(e)
+        sink.put(None)
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def plan_scan(args: Namespace):
+    '''
+    Waypoints of the scan: with args.overlap, just enough photos to cover args.roi with
+    that overlap, from the camera footprint at the sweep height; otherwise None, the
+    default zig-zag of move.scan
+    '''
+    if args.overlap is None:
+        return None
+    from client import MAX_X, MAX_Y
+    from planner import camera_footprint, scan_waypoints
+
+    calibration = load_calibration(args.camera_matrix, args.offset)
+    footprint = camera_footprint(calibration.cam_matrix, args.image_size or calibration.image_size,
+                                 calibration.cam_offset, calibration.gripper_offset)
+    # client.move would clip them silently, the photos would not be where they were planned
+    waypoints = scan_waypoints(footprint, args.overlap, args.roi, reach=(0, MAX_X, 0, MAX_Y))
+    _LOG.info("Scan plan: {} photos of {:.0f} x {:.0f} mm with {:.0%} overlap".format(
+        len(waypoints), footprint[1] - footprint[0], footprint[3] - footprint[2], args.overlap))
+    return waypoints
+
+
+def stream(args: Namespace, session=None) -> Tuple[List[list], List[Tuple[int, int]]]:
+    '''
+    Scan, detect and locate at the same time: every photo goes to the detector as soon as
+    it is downloaded and its detections straight on to the coordinate transform. Photos
+    are handed over in memory; with args.archive they and their labels are saved as well. The stages are
+    connected by queues of at most args.queue_size items, a slow detector holds up the scan
+    instead of piling up photos in memory. With args.server the photos are sent to that
+    detect_server instead of loading the network here. With a session.ScanSession every
+    waypoint and its located detections are recorded in it as well.
+    Returns [class, x, y, confidence, photo] per detection like cal_location(with_photo=True),
+    and the waypoints of the scan like move.scan
+    '''
+    calibration = load_calibration(args.camera_matrix, args.offset)
+    cam_offset, gripper_offset = calibration.cam_offset, calibration.gripper_offset
+    K_matrix = calibration.cam_matrix
+    if args.server:
+        from detect_server import DetectionClient
+
+        client = DetectionClient(args.server)
+        client.check(args.config_file, args.data_file, args.weights)
+        network = None
+
+        def detect_photo(index, position, data, image_file):
+            annotations = client.detect(data, args.thresh)
+            if args.save_labels and image_file is not None:
+                write_annotations(image_file, annotations)
+            return index, position, annotations
+    else:
+        client = None
+        network, class_names, class_colors = load_detector(args)
+
+        def detect_photo(index, position, data, image_file):
+            # decoded once here, the detector never reads the photo back from disk
+            annotations = detect_frame(decode_image(data), network, class_names, class_colors,
+                                       args, image_file)
+            return index, position, annotations
+
+    def locate_photo(index, position, annotations):
+        located = locate(annotations, position, K_matrix, cam_offset, gripper_offset)
+        if session is not None:
+            session.add_detections(index, annotations, [row[1:3] for row in located])
+        return index, located
+
+    captured, detected, located = Queue(args.queue_size), Queue(args.queue_size), Queue()
+    errors = []
+    stages = [_stage(detect_photo, captured, detected, errors),
+              _stage(locate_photo, detected, located, errors)]
+    try:
+        visited = scan(args.photo, args.locations, flag=False,
+                       archive=args.archive, waypoints=plan_scan(args), session=session,
+                       on_capture=lambda *photo: captured.put(photo))
+    finally:
+        captured.put(None)
+        for thread in stages:
+            thread.join()
+        if client is not None:
+            client.close()
+        if network is not None:
+            unload_detector(network)
+    if errors:
+        raise errors[0]
+
+    # keep the order of the scan, like cal_location
+    results = []
+    while True:
+        item = located.get()
+        if item is None:
+            break
+        results.append(item)
+    return [coordinate + [index] for index, coordinates in sorted(results, key=lambda item: item[0])
+            for coordinate in coordinates], visited
+
+
 def main(args: Namespace):
     # clean temporary files
     remove_temp(args.input)
@@ -68,42 +180,87 @@ def main(args: Namespace):
     # start from the origin
     simple_move(ORIGIN_X, ORIGIN_Y, ORIGIN_Z)
     _LOG.info("Go back to the origin")
-    # scan
-    scan(args.photo, args.locations, flag=False)
-    _LOG.info("Scan the planting bed")
-    # detect
-    detect(args)
-    _LOG.info("Detection is done")
-    # calculate locations
-    list_global_coordinate = cal_location(args)
-    _LOG.info("Global coordinate calculation is done.")
+    # one record of the scan instead of location.txt and sorted annotation files
+    session = None
+    if not args.no_session:
+        from session import ScanSession
+
+        session = ScanSession(str(args.session))
+    try:
+        if args.stream:
+            # scan, detect and calculate locations in one pass
+            list_global_coordinate, visited = stream(args, session)
+            _LOG.info("Scan, detection and global coordinate calculation are done.")
+        else:
+            # scan
+            visited = scan(args.photo, args.locations, flag=False, waypoints=plan_scan(args), session=session)
+            _LOG.info("Scan the planting bed")
+            # detect
+            detect_args = args
+            if session is not None and not args.archive:
+                # the detections go into the session, there are no annotation files to read back
+                detect_args = Namespace(**vars(args))
+                detect_args.save_labels = False
+            detect(detect_args, session)
+            _LOG.info("Detection is done")
+            # calculate locations
+            list_global_coordinate = cal_location(args, with_photo=True, session=session)
+            _LOG.info("Global coordinate calculation is done.")
+    finally:
+        if session is not None:
+            session.close()
+    from pandas import DataFrame
+
     # choose class
-    table_global_coordinate = DataFrame(list_global_coordinate, columns=['class', 'x', 'y', 'confidence'])
+    table_global_coordinate = DataFrame(list_global_coordinate, columns=['class', 'x', 'y', 'confidence', 'photo'])
     # remove overlap
     print(table_global_coordinate)
-    table_global_coordinate = remove_overlap(table_global_coordinate)
+    if args.track:
+        # one target per fruit, followed through the overlapping photos
+        from cluster import fuse_views
+
+        table_global_coordinate = fuse_views(table_global_coordinate, args.tolerance)
+    else:
+        table_global_coordinate = remove_overlap(table_global_coordinate, args.tolerance, args.fuse)
+    _LOG.info("{} detections, {} targets".format(len(list_global_coordinate), len(table_global_coordinate)))
     goal_class = table_global_coordinate[table_global_coordinate['class']==args.category]
     _LOG.info("Choose {}".format(args.category))
     # if there is no desiered class of plants
     if goal_class.empty:
         _LOG.info("There is no {}".format(args.category))
+        return
+    # visit the targets in the order that takes the gantry the least time, from where the scan ended
+    from planner import plan_route, route_report
+
+    start = visited[-1] if visited else (ORIGIN_X, ORIGIN_Y)
+    targets = goal_class[['x', 'y']].to_numpy(dtype=float)
+    order = plan_route(targets, start=start)
+    planned, naive = route_report(targets, order, start=start)
+    _LOG.info("Pick route of {} targets: {:.1f} s of travel, {:.1f} s in detection order".format(
+        len(targets), planned, naive))
     # move and grip
-    num_goals, num_col = goal_class.shape
-    for i in range(num_goals):
-        x, y = goal_class.loc[i, ['x','y']]
-        simple_move(x, y, GRIP_Z, False)
-        open()
-        gripper_open() # to make sure the gripper is open before gripping
-        gripper_close()
-        # go back to the orgin
-        simple_move(x, y, GRIP_Z, False)
-        gripper_open()
+    gripper = get_gripper(args.gripper_port, ack=args.gripper_ack.encode() if args.gripper_ack else None,
+                          actuation_time=args.gripper_time)
+    drop_x, drop_y = args.drop
+    # open while the gantry travels to the first target; close() waits for it to finish
+    gripper.open(wait=False)
+    for x, y in targets[order].tolist():
+        # travel at the safe height, then go down to the target
+        simple_move(x, y, SCAN_Z)
+        simple_move(x, y, GRIP_Z)
+        gripper.close()
+        # lift it, carry it to the drop-off point and let it go there
+        simple_move(x, y, SCAN_Z)
+        simple_move(drop_x, drop_y, SCAN_Z)
+        gripper.open(wait=False)
     return
 
 
     
 
 if __name__ == '__main__':
+    from planner import BED_X, BED_Y
+
     parser = ArgumentParser(description="YOLOv3 detection on Farmbot")
     # parsers for move
     parser.add_argument(
@@ -133,6 +290,16 @@ if __name__ == '__main__':
                         help="path to data file")
     parser.add_argument("--thresh", type=float, default=.25,
                         help="remove detections with lower confidence")
+    parser.add_argument("--server", type=str, default=None,
+                        help="Unix socket of a running detect_server.py to send the images to"
+                        " instead of loading the network")
+    parser.add_argument("--workers", default=1, type=int,
+                        help="processes detecting images at the same time, each with its own network")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="SQLite file to keep detections in, photos seen before with the same"
+                        " weights, config and threshold are not detected again")
+    parser.add_argument("--cache_size", type=int, default=10000,
+                        help="photos kept in the detection cache, the least recently used go first")
     # arguemtns for grip
     parser.add_argument(
         '-ca',
@@ -177,6 +344,102 @@ if __name__ == '__main__':
         default='../log/main.log',
         help='Path to the log file'
     )    
+    parser.add_argument(
+        '--session',
+        type=Path,
+        default='../img/sessions/scans.sqlite',
+        help='SQLite file to record the scans in; photos are paired with their detections'
+        ' by waypoint instead of by sorted file names'
+    )
+    parser.add_argument(
+        '--no_session',
+        action='store_true',
+        help='do not record the scan, pair location.txt and the sorted annotation files'
+        ' like detect.py and location.py do on their own'
+    )
+    parser.add_argument(
+        '--overlap',
+        type=float,
+        default=None,
+        help='plan the scan from the camera footprint, neighbouring photos overlapping by this'
+        ' fraction, e.g. 0.2; by default the fixed zig-zag of move.scan'
+    )
+    parser.add_argument(
+        '--roi',
+        type=float,
+        nargs=4,
+        default=(0, BED_X, 0, BED_Y),
+        metavar=('MIN_X', 'MAX_X', 'MIN_Y', 'MAX_Y'),
+        help='region of the bed to scan with --overlap, in mm'
+    )
+    parser.add_argument(
+        '--image_size',
+        type=int,
+        nargs=2,
+        default=None,
+        metavar=('WIDTH', 'HEIGHT'),
+        help='size of the photos in pixels, by default the size the camera was calibrated at'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=50.0,
+        help='detections closer than this (mm) are taken as the same target'
+    )
+    parser.add_argument(
+        '--fuse',
+        action='store_true',
+        help='place each merged target at the confidence weighted mean of its detections'
+    )
+    parser.add_argument(
+        '--track',
+        action='store_true',
+        help='fuse the detections of a fruit photo by photo, keeps fruits in the same photo apart'
+    )
+    parser.add_argument(
+        '-s',
+        '--stream',
+        action='store_true',
+        help='detect and locate each photo while the scan is still running'
+    )
+    parser.add_argument(
+        '--archive',
+        action='store_true',
+        help='also save the annotation files next to the scan session, in stream mode'
+        ' the photos as well'
+    )
+    parser.add_argument(
+        '--queue_size',
+        type=int,
+        default=4,
+        help='photos waiting between two pipeline stages in stream mode'
+    )
+    parser.add_argument(
+        '--gripper_port',
+        type=str,
+        default='/dev/ttyUSB0',
+        help='serial port of the gripper'
+    )
+    parser.add_argument(
+        '--gripper_ack',
+        type=str,
+        default=None,
+        help='what the gripper firmware sends when it is done, e.g. k; by default it is timed'
+    )
+    parser.add_argument(
+        '--gripper_time',
+        type=float,
+        default=1.0,
+        help='seconds the gripper takes to open or close, without --gripper_ack'
+    )
+    parser.add_argument(
+        '--drop',
+        type=float,
+        nargs=2,
+        default=(ORIGIN_X, ORIGIN_Y),
+        metavar=('X', 'Y'),
+        help='where the picked targets are dropped, in mm, at the safe height'
+    )
     parser.add_argument('-v', '--verbose', action='store_true', help='Verbose mode.')
     arguments = parser.parse_args()
 
@@ -184,4 +447,9 @@ if __name__ == '__main__':
         basicConfig(filename=arguments.log, level=DEBUG)
     else:
         basicConfig(filename=arguments.log, level=INFO)
-    main(arguments)
\ No newline at end of file
+    try:
+        main(arguments)
+    finally:
+        # one MQTT session and one gripper port serve the whole run
+        close_client()
+        close_gripper()
\ No newline at end of file
@@ -8,10 +8,12 @@ Note: it is for remote server, can ben replaced by a local script
 from argparse import ArgumentParser
 from logging import getLogger
 from os import path, makedirs, system
+from queue import Queue
+from threading import Thread
 from time  import sleep, strftime, time
 #from serial import Serial, PARITY_NONE, STOPBITS_ONE, EIGHTBITS 
 from requests.api import delete
-from typing import List
+from typing import List, Optional
 from pathlib import Path
 from logging import basicConfig, DEBUG, INFO, error, getLogger
 from urllib import request
@@ -25,9 +27,35 @@ from client import FarmbotClient
 
 
 _SWEEEP_HEIGHT = 0
+_SNAPSHOT_URL = 'http://localhost:8080/?action=snapshot'
 
 Logger = getLogger(__name__)
 
+"""MQTT session shared by every move of a run, see get_client"""
+_CLIENT = None
+
+
+def get_client() -> FarmbotClient:
+    '''
+    Return the client shared by the whole run, connecting on first use.
+    paho keeps the session alive and reconnects by itself, so callers never shut it down;
+    call close_client() once at the end of the run instead.
+    '''
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = FarmbotClient(creds.device_id, creds.token)
+    return _CLIENT
+
+
+def close_client() -> None:
+    '''
+    Disconnect the shared client, if it was ever started, and log its connection metrics
+    '''
+    global _CLIENT
+    if _CLIENT is not None:
+        _CLIENT.shutdown()
+        _CLIENT = None
+
 class Opts:
     def __init__(self, min_x, max_x, min_y, max_y, delta, offset, flag):
         self.min_x = min_x
@@ -39,8 +67,73 @@ class Opts:
         self.flag = flag
     
 
+class PhotoWriter:
+    '''
+    Background worker that downloads and saves snapshots, so the file I/O of one
+    waypoint overlaps with the move to the next one. Hand it responses from grab_photo()
+    '''
+    def __init__(self, img_path: Path, max_pending: int = 4, on_saved=None, archive=True):
+        '''
+        on_saved: called from the worker with (context, photo bytes, full path) after each
+                  download; the path is None when archive is off
+        archive: write the photos to img_path, otherwise they only go to on_saved
+        '''
+        self.img_dir = path.join(path.dirname(__file__), img_path)
+        self.on_saved = on_saved
+        self.archive = archive
+        self._queue = Queue(max_pending)
+        self._errors = []
+        self._thread = Thread(target=self._run, name='photo-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, photo, filename: str, context=None) -> None:
+        '''
+        context: anything that ties the photo to its waypoint, handed back to on_saved
+        '''
+        self._queue.put((photo, filename, context))
+
+    def close(self) -> None:
+        '''
+        Wait until every photo is on disk, re-raise the first error of the worker
+        '''
+        self._queue.put(None)
+        self._thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            photo, filename, context = item
+            try:
+                with photo:
+                    data = photo.read()
+                image_file = None
+                if self.archive:
+                    save_photo(self.img_dir, filename, data)
+                    image_file = path.join(self.img_dir, filename)
+                    Logger.debug('Saved {}'.format(filename))
+                if self.on_saved is not None:
+                    self.on_saved(context, data, image_file)
+            except Exception as e:
+                Logger.error('Unable to save {}: {}'.format(filename, e))
+                self._errors.append(e)
+
+
+def waypoint_filename(index: int, x: int, y: int) -> str:
+    '''
+    Name of the photo taken at the index-th waypoint. Sorting the names gives the
+    order of location.txt, even when several photos are taken within one second
+    '''
+    return '{:04d}_x{}_y{}_{}.jpg'.format(index, x, y, datetime.now().strftime("%Y-%m-%dT%H:%M:%S"))
+
+
 def scan(img_path: Path, location_path: Path, # smaller delta
-         min_x=0, max_x=1300, min_y=0, max_y=1000, delta=1000, offset=0, flag=True) -> List: #里面的数字需要重新测量
+         min_x=0, max_x=1300, min_y=0, max_y=1000, delta=1000, offset=0, flag=True,
+         pipelined=True, on_capture=None, archive=True, waypoints=None,
+         session=None) -> List: #里面的数字需要重新测量
     '''
     scan the bed at a certain height, first move along x axis, then y, like a zig zag;
     Taking pictures and record the location of the camera that corresponds to the picture
@@ -52,7 +145,17 @@ def scan(img_path: Path, location_path: Path, # smaller delta
            delta: the interval for scaning
            offset:
            flag: for degging, if true, don't actually drive FarmBot
-    Output: none
+           pipelined: download and save each photo in the background while
+                      moving on to the next waypoint
+           on_capture: called with (index, (x, y, z), photo bytes, image file) as soon as
+                       each photo is downloaded, e.g. to detect while the scan goes on;
+                       the image file is None when archive is off
+           archive: save the photos to img_path
+           waypoints: <x, y> positions to take the photos at, in this order, instead of
+                      the zig-zag over the bounds, e.g. from planner.scan_waypoints
+           session: session.ScanSession to record every waypoint, its capture time and
+                    photo in, besides location.txt
+    Output: the <x, y> waypoints visited, in order; the gantry stays at the last one
     '''
     opts = Opts(min_x, max_x, min_y, max_y, delta, offset, flag)
 
@@ -65,34 +168,78 @@ def scan(img_path: Path, location_path: Path, # smaller delta
         sweep_y_negative = not sweep_y_negative
         for y in y_range:
             pts.append((x+opts.offset, y+opts.offset))
+    if waypoints is not None:
+        pts = [tuple(waypoint) for waypoint in waypoints]
 
     Logger.info('Moving pattern generated')
+    if not pts:
+        Logger.warning('No waypoints to scan')
+        return pts
 
     if opts.flag:
         Logger.info('Run without sweep')
         exit()
 
-    client = FarmbotClient(creds.device_id, creds.token)
-    client.move(0, 0, _SWEEEP_HEIGHT) # ensure moving from original 
-    for x, y in pts:
-        client.move(x, y, _SWEEEP_HEIGHT) # move camera
-        take_photo(img_path)
-    client.shutdown()
+    def captured(waypoint, data, image_file):
+        if on_capture is not None:
+            index, position = waypoint
+            on_capture(index, position, data, image_file)
+
+    writer = PhotoWriter(img_path, on_saved=captured, archive=archive) if pipelined else None
+    client = get_client()
+    # ensure moving from original, the first waypoint is queued right behind it
+    client.move_batch([(0, 0, _SWEEEP_HEIGHT), pts[0] + (_SWEEEP_HEIGHT,)])
+    for index, (x, y) in enumerate(pts):
+        if index > 0:
+            client.move(x, y, _SWEEEP_HEIGHT) # move camera
+        filename = waypoint_filename(index, x, y)
+        waypoint = (index, (x, y, _SWEEEP_HEIGHT))
+        photo = grab_photo()
+        if session is not None:
+            # the snapshot is taken by the time grab_photo returns
+            session.add_waypoint(index, waypoint[1], filename if archive else None, time())
+        if writer is None:
+            with photo:
+                data = photo.read()
+            image_file = None
+            if archive:
+                image_file = path.join(path.dirname(__file__), img_path, filename)
+                save_photo(path.dirname(image_file), filename, data)
+            captured(waypoint, data, image_file)
+        else:
+            # the frame is fixed once the response arrives, the body can follow while moving
+            writer.put(photo, filename, waypoint)
+    if writer is not None:
+        writer.close()
     # write to img/location
     with open(path.join(location_path, "location.txt"), 'w') as f:
         for postion in pts:
             f.write('{} {} {}\n'.format(postion[0], postion[1], _SWEEEP_HEIGHT))
-    return None 
+    return pts
+
+
+def grab_photo():
+    '''
+    Ask the camera server for a snapshot. mjpg-streamer copies the current frame before
+    it answers, so once this returns the picture is taken; the returned response
+    still has to be read, see PhotoWriter
+    '''
+    return request.urlopen(_SNAPSHOT_URL)
+
+
+def save_photo(img_dir: str, filename: str, data: bytes) -> None:
+    with open(path.join(img_dir, filename), mode="wb") as save_file:
+        save_file.write(data)
 
 
-def take_photo(img_path: Path):
+def take_photo(img_path: Path, filename: Optional[str] = None):
     HERE = path.dirname(__file__)
     IMG_DIR = path.join(HERE, img_path)
 
-    with request.urlopen('http://localhost:8080/?action=snapshot') as photo:
-        filename = datetime.now().strftime("%Y-%m-%dT%H:%M:%S") + ".jpg"
-        with open(path.join(IMG_DIR, filename), mode="wb") as save_file:
-            save_file.write(photo.read())
+    with grab_photo() as photo:
+        if filename is None:
+            filename = datetime.now().strftime("%Y-%m-%dT%H:%M:%S") + ".jpg"
+        save_photo(IMG_DIR, filename, photo.read())
 
 
 def simple_move(x: int, y: int, z: int) -> None: 
@@ -101,9 +248,7 @@ def simple_move(x: int, y: int, z: int) -> None:
     Input: x, y,z: destination point
            photo: take a pic or not
     '''
-    client = FarmbotClient(creds.device_id, creds.token)
-    client.move(x, y, z)  
-    client.shutdown()
+    get_client().move(x, y, z)
     return None
 
 
@@ -153,5 +298,6 @@ if __name__ == '__main__':
         scan(arguments.photo, arguments.locations, flag=False)
     else:
         Logger.error('Wrong mode number {arguments.mode}')
+    close_client()
 
 
@@ -0,0 +1,209 @@
+'''
+Route planning for the gantry.
+FarmBot drives x, y and z with their own motors, all at the same time, so a move takes
+as long as its slowest axis: travel time is a per-axis (Chebyshev-like) metric, not the
+Euclidean distance. plan_route orders the pick targets by nearest neighbour under that
+metric and improves the order with 2-opt.
+scan_waypoints places the photos of a scan from the ground area one photo covers.
+'''
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from location import pixels_to_global
+
+# FarmBot Genesis defaults, 400 steps/s and 300 steps/s^2 at 5 steps/mm on x and y,
+# 25 steps/mm on z. Change them to what is set in the web app
+X_SPEED, X_ACCELERATION = 80.0, 60.0
+Y_SPEED, Y_ACCELERATION = 80.0, 60.0
+Z_SPEED, Z_ACCELERATION = 16.0, 12.0
+# the planting bed, mm
+BED_X, BED_Y = 2400.0, 1200.0
+
+
+class AxisModel:
+    def __init__(self, speed: float, acceleration: Optional[float] = None):
+        '''
+        speed: top speed in mm/s
+        acceleration: in mm/s^2, None for a move at top speed from start to end
+        '''
+        self.speed = speed
+        self.acceleration = acceleration
+
+    def time(self, distance: np.ndarray) -> np.ndarray:
+        '''Seconds to move the distances (mm), accelerating and braking in a trapezoid'''
+        distance = np.abs(np.asarray(distance, dtype=float))
+        if not self.acceleration:
+            return distance / self.speed
+        ramp = self.speed * self.speed / self.acceleration
+        # short moves never reach top speed
+        return np.where(distance < ramp,
+                        2 * np.sqrt(distance / self.acceleration),
+                        distance / self.speed + self.speed / self.acceleration)
+
+
+class TravelModel:
+    def __init__(self, x: AxisModel = None, y: AxisModel = None, z: AxisModel = None):
+        self.axes = (x or AxisModel(X_SPEED, X_ACCELERATION),
+                     y or AxisModel(Y_SPEED, Y_ACCELERATION),
+                     z or AxisModel(Z_SPEED, Z_ACCELERATION))
+
+    def move_time(self, difference: np.ndarray) -> np.ndarray:
+        '''
+        Seconds of moves by the differences <dx, dy> or <dx, dy, dz> (mm) in the last axis,
+        the slowest axis decides
+        '''
+        difference = np.asarray(difference, dtype=float)
+        times = np.zeros(difference.shape[:-1])
+        for axis, model in enumerate(self.axes[:difference.shape[-1]]):
+            np.maximum(times, model.time(difference[..., axis]), out=times)
+        return times
+
+    def times(self, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        '''
+        Seconds of every move from an origin to a destination, len(origins) x len(destinations)
+        '''
+        origins = np.atleast_2d(np.asarray(origins, dtype=float))
+        destinations = np.atleast_2d(np.asarray(destinations, dtype=float))
+        return self.move_time(origins[:, None, :] - destinations[None, :, :])
+
+
+def route_time(points: np.ndarray, order: Sequence[int], start: Optional[Sequence[float]] = None,
+               model: Optional[TravelModel] = None) -> float:
+    '''
+    Seconds to visit points in order, from start if it is given
+    '''
+    model = model or TravelModel()
+    path = np.asarray(points, dtype=float).reshape((len(points), -1))[list(order)]
+    if start is not None:
+        path = np.vstack((np.asarray(start, dtype=float)[:path.shape[1]], path))
+    return float(model.move_time(np.diff(path, axis=0)).sum())
+
+
+def _nearest_neighbour(times: np.ndarray) -> np.ndarray:
+    '''Greedy path over the time matrix, from node 0'''
+    num = len(times)
+    visited = np.zeros(num, dtype=bool)
+    path = np.empty(num, dtype=np.intp)
+    path[0] = 0
+    visited[0] = True
+    for step in range(1, num):
+        row = np.where(visited, np.inf, times[path[step - 1]])
+        path[step] = np.argmin(row)
+        visited[path[step]] = True
+    return path
+
+
+def _two_opt(path: np.ndarray, times: np.ndarray) -> np.ndarray:
+    '''
+    Reverse path[i:j+1] while that makes the path faster, the best such move first.
+    path[0] is the fixed start, the end is open. times must be symmetric
+    '''
+    num = len(path)
+    while num > 3:
+        route = times[path[:, None], path[None, :]]
+        i = np.arange(1, num - 1)[:, None]
+        j = np.arange(1, num)[None, :]
+        following = np.minimum(j + 1, num - 1)
+        end = j == num - 1
+        # path[i-1] -> path[i] and path[j] -> path[j+1] become path[i-1] -> path[j] and path[i] -> path[j+1]
+        gain = route[i - 1, i] + np.where(end, 0, route[j, following]) \
+            - route[i - 1, j] - np.where(end, 0, route[i, following])
+        gain = np.where(j > i, gain, 0)
+        row, column = np.unravel_index(np.argmax(gain), gain.shape)
+        if gain[row, column] <= 1e-9:
+            break
+        first, last = row + 1, column + 1
+        path[first:last + 1] = path[first:last + 1][::-1].copy()
+    return path
+
+
+def plan_route(points: np.ndarray, start: Optional[Sequence[float]] = None,
+               model: Optional[TravelModel] = None) -> np.ndarray:
+    '''
+    Order of the points that makes visiting all of them fast, from start if it is given,
+    otherwise from whichever end suits best. Returns indices into points
+    '''
+    if len(points) == 0:
+        return np.empty(0, dtype=np.intp)
+    points = np.asarray(points, dtype=float).reshape((len(points), -1))
+    model = model or TravelModel()
+    times = np.zeros((len(points) + 1, len(points) + 1))
+    times[1:, 1:] = model.times(points, points)
+    if start is not None:
+        times[0, 1:] = times[1:, 0] = model.times(np.asarray(start, dtype=float)[:points.shape[1]], points)[0]
+    # node 0 is the start; without one it costs nothing to reach any point from it
+    return _two_opt(_nearest_neighbour(times), times)[1:] - 1
+
+
+def route_report(points: np.ndarray, order: Sequence[int], start: Optional[Sequence[float]] = None,
+                 model: Optional[TravelModel] = None) -> Tuple[float, float]:
+    '''
+    Travel seconds of the points in the given order and in their original order
+    '''
+    return (route_time(points, order, start, model),
+            route_time(points, range(len(points)), start, model))
+
+
+def camera_footprint(cam_matrix: np.ndarray, image_size: Optional[Tuple[float, float]] = None,
+                     cam_offset: Tuple[float, float] = (0, 0),
+                     gripper_offset: Tuple[float, float] = (0, 0)) -> Tuple[float, float, float, float]:
+    '''
+    Ground area of a photo taken from location.SWEEP_Z, in global coordinates relative to
+    the position of the bot: (min_x, max_x, min_y, max_y), see location.pixels_to_global
+    image_size: (width, height) of the photos in pixels, by default twice the principal point
+    '''
+    cam_matrix = np.asarray(cam_matrix, dtype=float)
+    if image_size is None:
+        # MATLAB stores K transposed, the principal point is in the last row
+        image_size = (2 * cam_matrix[2, 0], 2 * cam_matrix[2, 1])
+    width, height = image_size
+    corners = pixels_to_global([(0, 0), (width, 0), (0, height), (width, height)], (0, 0, 0),
+                               cam_matrix, cam_offset, gripper_offset)
+    return corners[:, 0].min(), corners[:, 0].max(), corners[:, 1].min(), corners[:, 1].max()
+
+
+def _axis_positions(low: float, high: float, footprint_low: float, footprint_high: float,
+                    overlap: float) -> np.ndarray:
+    '''
+    Fewest bot positions along one axis whose footprints cover [low, high], neighbours
+    overlapping by at least overlap of the footprint, spread evenly
+    '''
+    extent = footprint_high - footprint_low
+    step = extent * (1 - overlap)
+    if high - low <= extent:
+        return np.array([(low + high - footprint_low - footprint_high) / 2])
+    count = int(np.ceil((high - low - extent) / step - 1e-9)) + 1
+    return np.linspace(low, high - extent, count) - footprint_low
+
+
+def _serpentine(outer: np.ndarray, inner: np.ndarray) -> np.ndarray:
+    '''Rows along the inner axis, every other one backwards: (outer, inner) pairs'''
+    return np.array([(position, across)
+                     for row, position in enumerate(outer)
+                     for across in (inner[::-1] if row % 2 else inner)]).reshape((-1, 2))
+
+
+def scan_waypoints(footprint: Tuple[float, float, float, float], overlap: float = 0.2,
+                   roi: Tuple[float, float, float, float] = (0, BED_X, 0, BED_Y),
+                   model: Optional[TravelModel] = None,
+                   reach: Tuple[float, float, float, float] = (0, BED_X, 0, BED_Y)) -> List[Tuple[int, int]]:
+    '''
+    Fewest bot positions <x, y> whose photos together cover the region of interest
+    (min_x, max_x, min_y, max_y), neighbouring photos overlapping by at least overlap
+    (a fraction of the footprint, see camera_footprint). They come in serpentine order,
+    rows along y like move.scan or along x, whichever is faster to drive.
+    Positions stay within reach (min_x, max_x, min_y, max_y), where the bot can drive:
+    an edge row the footprint offset would put outside is moved inward, so a strip at
+    the edge of the bed that the camera cannot see from there stays uncovered
+    '''
+    assert 0 <= overlap < 1, 'overlap should be a fraction in [0, 1)'
+    xs = _axis_positions(roi[0], roi[1], footprint[0], footprint[1], overlap)
+    ys = _axis_positions(roi[2], roi[3], footprint[2], footprint[3], overlap)
+    # rows moved onto the same edge are taken once
+    xs = np.unique(np.clip(xs, reach[0], reach[1]))
+    ys = np.unique(np.clip(ys, reach[2], reach[3]))
+    candidates = [_serpentine(xs, ys), _serpentine(ys, xs)[:, ::-1]]
+    model = model or TravelModel()
+    path = min(candidates, key=lambda path: route_time(path, range(len(path)), model=model))
+    return [tuple(point) for point in np.round(path).astype(int).tolist()]
@@ -0,0 +1,49 @@
+'''
+Record types passed between detection and location, so detections travel as numbers
+from darknet all the way to the global coordinates instead of as formatted strings
+'''
+from typing import Iterator, Tuple
+
+
+class Detection:
+    '''
+    One detected object in pixels of the image it was found in
+    class_id: index into the class names of the network
+    x, y: centre of the bounding box, w, h: its size
+    confidence: in percent, like the annotation files
+    '''
+    __slots__ = ('class_id', 'x', 'y', 'w', 'h', 'confidence')
+
+    def __init__(self, class_id: int, x: float, y: float, w: float, h: float, confidence: float):
+        self.class_id = class_id
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.confidence = confidence
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        return self.x, self.y, self.w, self.h
+
+    def scaled(self, scale_x: float, scale_y: float) -> 'Detection':
+        '''
+        The same detection in an image resized by scale_x, scale_y
+        '''
+        return Detection(self.class_id, self.x*scale_x, self.y*scale_y,
+                         self.w*scale_x, self.h*scale_y, self.confidence)
+
+    def __iter__(self) -> Iterator:
+        # <class, x, y, w, h, confidence>, the columns of an annotation file
+        return iter((self.class_id, self.x, self.y, self.w, self.h, self.confidence))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Detection) and tuple(self) == tuple(other)
+
+    def __hash__(self) -> int:
+        # equal detections hash alike, so they can be deduplicated in sets and dict keys
+        return hash(tuple(self))
+
+    def __repr__(self) -> str:
+        return 'Detection(class_id={}, x={:.1f}, y={:.1f}, w={:.1f}, h={:.1f}, confidence={:.2f})'.format(
+            *self)
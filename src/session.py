@@ -0,0 +1,202 @@
+'''
+Scan sessions in one SQLite file: where every photo was taken, when, under which
+file name, and what was detected in it. The location stage reads a whole scan in one
+query, photos are tied to their waypoint by number instead of by sorting file names,
+and the detections of past scans can be queried by region of the bed and class.
+A detection is stored in pixels, and in global coordinates once it has been located.
+'''
+import sqlite3
+import threading
+import time
+from logging import getLogger
+from os.path import basename
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from records import Detection
+
+
+_LOG = getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS waypoints (
+    session INTEGER NOT NULL,
+    photo INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    z REAL NOT NULL,
+    captured REAL NOT NULL,
+    image TEXT,
+    PRIMARY KEY (session, photo)
+);
+CREATE TABLE IF NOT EXISTS detections (
+    session INTEGER NOT NULL,
+    photo INTEGER NOT NULL,
+    class INTEGER NOT NULL,
+    pixel_x REAL NOT NULL,
+    pixel_y REAL NOT NULL,
+    w REAL NOT NULL,
+    h REAL NOT NULL,
+    confidence REAL NOT NULL,
+    x REAL,
+    y REAL
+);
+CREATE INDEX IF NOT EXISTS detections_photo ON detections (session, photo);
+CREATE INDEX IF NOT EXISTS detections_region ON detections (session, x, y);
+CREATE INDEX IF NOT EXISTS detections_class ON detections (session, class, x, y);
+'''
+
+"""Region of the bed, (min_x, max_x, min_y, max_y) in mm"""
+Region = Tuple[float, float, float, float]
+
+
+class ScanSession:
+    def __init__(self, path: str, session: Optional[int] = None):
+        '''
+        path: SQLite file, created if it does not exist
+        session: id of a recorded scan to read or continue, by default a new one
+        Safe to use from the threads of one scan, e.g. the photo writer and the locate stage
+        '''
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        if session is None:
+            with self._db:
+                session = self._db.execute('INSERT INTO sessions (started) VALUES (?)', (time.time(),)).lastrowid
+            _LOG.info('Scan session {} in {}'.format(session, path))
+        elif self._db.execute('SELECT 1 FROM sessions WHERE id = ?', (session,)).fetchone() is None:
+            raise ValueError('There is no scan session {} in {}'.format(session, path))
+        self.session = session
+
+    @staticmethod
+    def latest(path: str) -> 'ScanSession':
+        '''The last scan recorded in path'''
+        with sqlite3.connect(str(path)) as db:
+            row = db.execute('SELECT MAX(id) FROM sessions').fetchone()
+        if row is None or row[0] is None:
+            raise ValueError('No scan session in {}'.format(path))
+        return ScanSession(path, row[0])
+
+    def add_waypoint(self, photo: int, position: Sequence[float], image: Optional[str] = None,
+                     captured: Optional[float] = None) -> None:
+        '''
+        photo: number of the photo in the scan
+        position: <x, y, z> of the camera
+        image: file name of the photo, None if it was not saved
+        captured: when it was taken, seconds since the epoch, by default now
+        '''
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO waypoints VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (self.session, photo, *[float(value) for value in position[:3]],
+                              time.time() if captured is None else captured, image))
+
+    def add_detections(self, photo: int, detections: List[Detection],
+                       global_xy: Optional[Sequence[Sequence[float]]] = None) -> None:
+        '''
+        Replace the detections of a photo
+        global_xy: their <x, y> on the bed if they are located already
+        '''
+        self._store([(photo, detections, global_xy)])
+
+    def _store(self, photos: List[Tuple[int, List[Detection], Optional[Sequence[Sequence[float]]]]]) -> None:
+        '''(photo, detections, global_xy) for any number of photos, in one transaction'''
+        rows = []
+        for photo, detections, global_xy in photos:
+            if global_xy is None:
+                global_xy = [(None, None)] * len(detections)
+            rows.extend((self.session, photo, int(detection.class_id), detection.x, detection.y, detection.w,
+                         detection.h, detection.confidence, *xy) for detection, xy in zip(detections, global_xy))
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM detections WHERE session = ? AND photo = ?',
+                                 [(self.session, photo) for photo, _, _ in photos])
+            self._db.executemany('INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def add_image_detections(self, results: Iterable[Tuple[str, List[Detection]]]) -> int:
+        '''
+        Detections of photos given by their file, e.g. by detect.detect, in one transaction.
+        A photo is found by its file name among the waypoints of the scan.
+        Returns the number of photos stored; files that are not in the scan are skipped
+        '''
+        photos = dict(self._db.execute('SELECT image, photo FROM waypoints WHERE session = ? AND image IS NOT NULL',
+                                       (self.session,)).fetchall())
+        stored = []
+        for image_file, detections in results:
+            photo = photos.get(basename(image_file))
+            if photo is None:
+                _LOG.warning('{} was not taken in scan session {}'.format(image_file, self.session))
+                continue
+            stored.append((photo, detections, None))
+        self._store(stored)
+        return len(stored)
+
+    def waypoints(self) -> np.ndarray:
+        '''<photo, x, y, z> of every photo of the scan, in the order they were taken'''
+        rows = self._db.execute('SELECT photo, x, y, z FROM waypoints WHERE session = ? ORDER BY photo',
+                                (self.session,)).fetchall()
+        return np.array(rows, dtype=float).reshape((-1, 4))
+
+    def locate(self, cam_matrix: np.ndarray, cam_offset: Tuple[int, int],
+               gripper_offset: Tuple[int, int]) -> np.ndarray:
+        '''
+        Global coordinates of all the detections of the scan in one pass, stored with them.
+        Returns [class, x, y, confidence, photo] per detection like
+        location.cal_location(with_photo=True)
+        '''
+        from location import pixels_to_global
+
+        rows = self._db.execute(
+            'SELECT d.rowid, d.class, d.pixel_x, d.pixel_y, d.confidence, d.photo, w.x, w.y, w.z '
+            'FROM detections d JOIN waypoints w ON w.session = d.session AND w.photo = d.photo '
+            'WHERE d.session = ? ORDER BY d.photo, d.rowid', (self.session,)).fetchall()
+        if not rows:
+            return np.empty((0, 5))
+        table = np.array(rows, dtype=float)
+        global_xy = pixels_to_global(table[:, 2:4], table[:, 6:9], cam_matrix, cam_offset, gripper_offset)
+        with self._lock, self._db:
+            self._db.executemany('UPDATE detections SET x = ?, y = ? WHERE rowid = ?',
+                                 zip(global_xy[:, 0].tolist(), global_xy[:, 1].tolist(),
+                                     table[:, 0].astype(int).tolist()))
+        return np.column_stack((table[:, 1], global_xy, table[:, 4], table[:, 5]))
+
+    def query(self, region: Optional[Region] = None, class_id: Optional[int] = None) -> np.ndarray:
+        '''
+        Located detections of the scan in a region of the bed and/or of a class,
+        [class, x, y, confidence, photo] per detection
+        '''
+        sql = 'SELECT class, x, y, confidence, photo FROM detections WHERE session = ? AND x IS NOT NULL'
+        parameters = [self.session]
+        if class_id is not None:
+            sql += ' AND class = ?'
+            parameters.append(int(class_id))
+        if region is not None:
+            sql += ' AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?'
+            parameters.extend(float(bound) for bound in region)
+        return np.array(self._db.execute(sql, parameters).fetchall(), dtype=float).reshape((-1, 5))
+
+    def report(self) -> str:
+        photos, = self._db.execute('SELECT COUNT(*) FROM waypoints WHERE session = ?', (self.session,)).fetchone()
+        detections, located = self._db.execute(
+            'SELECT COUNT(*), COUNT(x) FROM detections WHERE session = ?', (self.session,)).fetchone()
+        return 'Scan session {}: {} photos, {} detections, {} located'.format(
+            self.session, photos, detections, located)
+
+    def close(self) -> None:
+        if self._db is not None:
+            _LOG.info(self.report())
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,13 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# the modules import each other by name, as when run from src/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+
+@pytest.fixture(autouse=True)
+def _in_tmp_path(tmp_path, monkeypatch):
+    # FarmbotClient writes farmbot_client.log to the working directory
+    monkeypatch.chdir(tmp_path)
@@ -0,0 +1,56 @@
+import time
+
+from cache import DetectionCache
+from records import Detection
+
+
+def detections(class_id):
+    return [Detection(class_id, 10.0, 20.0, 30.0, 40.0, 90.0)]
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    with DetectionCache('cache.sqlite', 'settings', max_entries=2) as cache:
+        for digest in ('a', 'b', 'c'):
+            cache.put(digest, detections(0))
+            time.sleep(0.01)
+        assert cache.get('a') is None
+        assert cache.get('b') == detections(0)
+        assert cache.get('c') == detections(0)
+        assert cache.evictions == 1
+
+
+def test_hit_is_kept_over_an_older_untouched_entry():
+    with DetectionCache('cache.sqlite', 'settings', max_entries=2) as cache:
+        cache.put('a', detections(0))
+        time.sleep(0.01)
+        cache.put('b', detections(1))
+        time.sleep(0.01)
+        assert cache.get('a') == detections(0)
+        time.sleep(0.01)
+        cache.put('c', detections(2))
+        assert cache.get('b') is None
+        assert cache.get('a') == detections(0)
+        assert cache.get('c') == detections(2)
+
+
+def test_entries_survive_reopening_with_the_same_settings_only():
+    with DetectionCache('cache.sqlite', 'settings') as cache:
+        cache.put('a', detections(0))
+    with DetectionCache('cache.sqlite', 'settings') as cache:
+        assert cache.get('a') == detections(0)
+    with DetectionCache('cache.sqlite', 'other settings') as cache:
+        assert cache.get('a') is None
+
+
+def test_entries_are_counted_without_recounting_the_table():
+    with DetectionCache('cache.sqlite', 'settings', max_entries=3) as cache:
+        cache.put('a', detections(0))
+        cache.put('a', detections(1))
+        assert cache.report().endswith(' 1 entries')
+        assert cache.get('a') == detections(1)
+        for digest in 'bcde':
+            cache.put(digest, detections(0))
+        assert cache.report().endswith(' 3 entries')
+        assert cache.evictions == 2
+    with DetectionCache('cache.sqlite', 'other settings') as cache:
+        assert cache.report().endswith(' 3 entries')
@@ -0,0 +1,120 @@
+import pytest
+
+from client import FarmbotClient, RetryPolicy, move_request, take_photo_request
+from local_broker import LocalBroker
+
+
+def make_client(broker, **policy):
+    return FarmbotClient('device', 'token', mqtt_client=broker,
+                         retry_policy=RetryPolicy(backoff=0.01, jitter=0, **policy))
+
+
+def test_batch_measures_each_request_from_its_predecessor():
+    client = make_client(LocalBroker(latency=0.05))
+    try:
+        assert client.move_batch([(x, 0, 0) for x in range(0, 500, 100)]) == [True] * 5
+        stats = client.rpc_stats['move_absolute']
+        assert stats.ok == 5
+        # the bot takes 0.05 s per move, not 0.05 s times the position in the batch
+        assert stats.total_seconds / stats.ok < 0.09
+    finally:
+        client.shutdown()
+
+
+def test_batch_refuses_requests_that_must_not_run_twice():
+    client = make_client(LocalBroker())
+    try:
+        with pytest.raises(ValueError):
+            client.batch_request([move_request(0, 0, 0), take_photo_request()])
+    finally:
+        client.shutdown()
+
+
+def test_batch_resends_from_the_failed_request():
+    replies = iter(['rpc_ok', 'rpc_error', 'rpc_ok', 'rpc_ok', 'rpc_ok'])
+    broker = LocalBroker(responder=lambda request: next(replies))
+    client = make_client(broker)
+    try:
+        assert client.move_batch([(0, 0, 0), (100, 0, 0), (200, 0, 0)]) == [True] * 3
+        assert len(broker.published) == 5
+        assert client.rpc_stats['move_absolute'].errors == 1
+    finally:
+        client.shutdown()
+
+
+
+def test_blocking_request_retries_after_rpc_error():
+    replies = iter(['rpc_error', 'rpc_ok'])
+    client = make_client(LocalBroker(responder=lambda request: next(replies)))
+    try:
+        client.move(100, 200, 0)
+        stats = client.rpc_stats['move_absolute']
+        assert (stats.requests, stats.errors, stats.retries, stats.ok, stats.failed) == (1, 1, 1, 1, 0)
+    finally:
+        client.shutdown()
+
+
+def test_blocking_request_stops_at_the_deadline():
+    # every attempt times out, the deadline ends it before the attempts run out
+    broker = LocalBroker(responder=lambda request: None)
+    client = make_client(broker, attempts=10, timeouts={'move_absolute': 0.1}, deadline=0.25)
+    try:
+        client.move(100, 200, 0)
+        stats = client.rpc_stats['move_absolute']
+        assert 2 <= stats.timeouts <= 3
+        assert (stats.failed, stats.ok) == (1, 0)
+        assert len(broker.published) == stats.timeouts
+    finally:
+        client.shutdown()
+
+
+def run_async(broker, coroutine, **policy):
+    import asyncio
+    from client import AsyncFarmbotClient
+
+    async def main():
+        async with AsyncFarmbotClient('device', 'token', mqtt_client=broker,
+                                      retry_policy=RetryPolicy(backoff=0.01, jitter=0, **policy)) as bot:
+            return await coroutine(bot), bot.rpc_stats['move_absolute']
+    return asyncio.run(main())
+
+
+def test_async_retries_after_rpc_error():
+    replies = iter(['rpc_error', 'rpc_error', 'rpc_ok'])
+    broker = LocalBroker(responder=lambda request: next(replies))
+    status, stats = run_async(broker, lambda bot: bot.move(100, 200, 0))
+    assert status is True
+    assert (stats.errors, stats.retries, stats.ok) == (2, 2, 1)
+
+
+def test_async_retries_after_timeout():
+    # the first request is dropped, the bot never answers it
+    replies = iter([None, 'rpc_ok'])
+    broker = LocalBroker(responder=lambda request: next(replies))
+    status, stats = run_async(broker, lambda bot: bot.move(100, 200, 0), timeouts={'move_absolute': 0.1})
+    assert status is True
+    assert (stats.timeouts, stats.retries, stats.ok) == (1, 1, 1)
+
+
+def test_async_gives_up_after_the_last_attempt():
+    broker = LocalBroker(responder=lambda request: 'rpc_error')
+    status, stats = run_async(broker, lambda bot: bot.move(100, 200, 0), attempts=2)
+    assert status is False
+    assert (stats.errors, stats.failed) == (2, 1)
+    assert len(broker.published) == 2
+
+
+def test_async_request_never_waits_for_the_connection_on_the_event_loop():
+    import threading
+
+    loop_thread = threading.current_thread()
+    waited_on = []
+
+    async def move(bot):
+        blocking_wait = bot._client.wait_for_connection
+        bot._client.wait_for_connection = lambda: waited_on.append(threading.current_thread()) or blocking_wait()
+        return await bot.move(100, 200, 0)
+
+    status, _ = run_async(LocalBroker(), move)
+    assert status is True
+    assert loop_thread not in waited_on
@@ -0,0 +1,26 @@
+from pandas import DataFrame
+
+from cluster import fuse_views, merge_duplicates
+
+
+def test_row_of_fruits_just_under_the_tolerance_does_not_chain():
+    # 45 mm apart with a 50 mm tolerance: neighbours merge with the seed, the row does not
+    table = DataFrame({'class': [0] * 5, 'x': [0, 45, 90, 135, 180], 'y': [0] * 5,
+                       'confidence': [90, 80, 95, 70, 85]})
+    merged = merge_duplicates(table, tolerance=50)
+    assert sorted(merged['x'].tolist()) == [0, 90, 180]
+
+
+def test_detections_of_different_classes_are_kept_apart():
+    table = DataFrame({'class': [0, 1], 'x': [0, 10], 'y': [0, 0], 'confidence': [90, 80]})
+    assert len(merge_duplicates(table, tolerance=50)) == 2
+
+
+def test_fuse_views_takes_at_most_one_detection_per_photo():
+    # two fruits 20 mm apart, both seen in photos 0 and 1
+    table = DataFrame({'class': [0] * 4, 'x': [0, 20, 2, 21], 'y': [0] * 4,
+                       'confidence': [90, 80, 85, 75], 'photo': [0, 0, 1, 1]})
+    fused = fuse_views(table, tolerance=50)
+    assert len(fused) == 2
+    assert fused['views'].tolist() == [2, 2]
+    assert sorted(round(x) for x in fused['x']) == [1, 20]
@@ -0,0 +1,30 @@
+import random
+from ctypes import POINTER, c_float, cast
+
+from darknet import BOX, DETECTION, nms_indices
+from fake_darknet import FakeDarknet
+
+
+def test_nms_indices_keeps_the_boxes_do_nms_sort_keeps():
+    rng = random.Random(0)
+    num, classes = 60, 3
+    detections = (DETECTION * num)()
+    probs = [(c_float * classes)() for _ in range(num)]
+    boxes, scores, groups = [], [], []
+    for detection, prob in zip(detections, probs):
+        box = (rng.uniform(0, 200), rng.uniform(0, 200), rng.uniform(20, 80), rng.uniform(20, 80))
+        class_id, score = rng.randrange(classes), rng.random()
+        detection.bbox = BOX(*box)
+        detection.classes = classes
+        detection.prob = cast(prob, POINTER(c_float))
+        detection.objectness = score
+        prob[class_id] = score
+        boxes.append(box)
+        scores.append(score)
+        groups.append(class_id)
+
+    FakeDarknet().do_nms_sort(cast(detections, POINTER(DETECTION)), num, classes, .45)
+    kept_by_darknet = {i for i in range(num) if probs[i][groups[i]] > 0}
+    kept = set(nms_indices(boxes, scores, groups, .45).tolist())
+    assert 0 < len(kept) < num
+    assert kept == kept_by_darknet
@@ -0,0 +1,36 @@
+import pytest
+
+import darknet
+from detect import detector_for, unload_detector
+from fake_darknet import FakeDarknet
+
+
+@pytest.fixture
+def backend():
+    fake = FakeDarknet()
+    darknet.configure(backend=fake)
+    yield fake
+    darknet.configure()
+
+
+def test_unload_detector_frees_the_image_with_the_network(backend):
+    network, class_names, class_colors = darknet.load_network('yolo.cfg', 'yolo.data', 'yolo.weights')
+    detector = detector_for(network, class_names, class_colors)
+    assert detector_for(network, class_names, class_colors) is detector
+    unload_detector(network)
+    assert detector.darknet_image is None
+    assert not backend._alive
+    assert not backend._networks
+
+
+def test_network_loaded_at_a_freed_address_gets_a_new_detector(backend):
+    network, class_names, class_colors = darknet.load_network('yolo.cfg', 'yolo.data', 'yolo.weights')
+    old = detector_for(network, class_names, class_colors)
+    unload_detector(network)
+    # the fake hands out the same handle again, like malloc may reuse the address
+    again, class_names, class_colors = darknet.load_network('yolo.cfg', 'yolo.data', 'yolo.weights')
+    assert again == network
+    new = detector_for(again, class_names, class_colors)
+    assert new is not old
+    assert new.darknet_image is not None
+    unload_detector(again)
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import threading
+from argparse import Namespace
+
+import cv2
+import numpy as np
+import pytest
+
+import darknet
+from detect import detect
+from detect_server import DetectionClient, DetectionServer
+from fake_darknet import FakeDarknet
+
+
+@pytest.fixture
+def network(tmp_path):
+    '''The network files in tmp_path/network, served by a DetectionServer on FakeDarknet'''
+    darknet.configure(backend=FakeDarknet(detections=lambda frame: [(0, 100, 100, 40, 40, 0.9)]))
+    files = tmp_path / 'network'
+    files.mkdir()
+    for name in ('yolo.cfg', 'yolo.data', 'yolo.weights'):
+        (files / name).write_text(name)
+    # a Unix socket path must be short, tmp_path may not be
+    directory = tempfile.mkdtemp()
+    socket_path = os.path.join(directory, 'detect.sock')
+    server = DetectionServer(socket_path, str(files / 'yolo.cfg'), str(files / 'yolo.data'),
+                             str(files / 'yolo.weights'))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield files, socket_path
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(directory)
+    darknet.configure()
+
+
+def test_check_accepts_relative_paths_from_another_directory(network, tmp_path, monkeypatch):
+    files, socket_path = network
+    (tmp_path / 'elsewhere').mkdir()
+    monkeypatch.chdir(tmp_path / 'elsewhere')
+    with DetectionClient(socket_path) as client:
+        client.check('../network/yolo.cfg', '../network/yolo.data', '../network/yolo.weights')
+
+
+def test_check_accepts_a_copy_of_the_same_network(network, tmp_path):
+    files, socket_path = network
+    shutil.copytree(str(files), str(tmp_path / 'copy'))
+    with DetectionClient(socket_path) as client:
+        client.check(*[str(tmp_path / 'copy' / name) for name in ('yolo.cfg', 'yolo.data', 'yolo.weights')])
+
+
+def test_check_refuses_another_network(network, tmp_path):
+    files, socket_path = network
+    shutil.copytree(str(files), str(tmp_path / 'other'))
+    (tmp_path / 'other' / 'yolo.cfg').write_text('another config')
+    with DetectionClient(socket_path) as client:
+        with pytest.raises(ValueError):
+            client.check(*[str(tmp_path / 'other' / name) for name in ('yolo.cfg', 'yolo.data', 'yolo.weights')])
+
+
+def test_detect_with_a_server_needs_no_network_files_here(network, tmp_path, capsys):
+    _, socket_path = network
+    images = tmp_path / 'img'
+    images.mkdir()
+    cv2.imwrite(str(images / 'photo.jpg'), np.zeros((200, 200, 3), dtype=np.uint8))
+    args = Namespace(input=str(images), server=socket_path, thresh=.25, weights='missing.weights',
+                     config_file='missing.cfg', data_file='missing.data', save_labels=False,
+                     ext_output=False, cache=str(tmp_path / 'cache.sqlite'), cache_size=10)
+    # the second run is answered from the cache, keyed by the server's network
+    for _ in range(2):
+        detect(args)
+    assert 'Detection cache: 1 hits, 0 misses' in capsys.readouterr().out
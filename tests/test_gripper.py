@@ -0,0 +1,114 @@
+import os
+import select
+import threading
+import time
+
+import pytest
+
+from gripper import CLOSE, OPEN, Gripper
+
+
+def pseudo_terminal():
+    '''(master fd, slave fd, path of the slave end); the test plays the Arduino on the master end'''
+    master, slave = os.openpty()
+    path = os.ttyname(slave)
+    return master, slave, path
+
+
+def received(master, timeout=0.5):
+    '''Bytes the gripper sent to the Arduino within timeout'''
+    data = b''
+    while select.select([master], [], [], timeout)[0]:
+        data += os.read(master, 64)
+        timeout = 0.05
+    return data
+
+
+def test_acknowledged_command_waits_for_the_answer():
+    master, slave, path = pseudo_terminal()
+
+    def arduino():
+        # answer the command once the servo would have stopped
+        select.select([master], [], [], 2)
+        os.read(master, 1)
+        time.sleep(0.1)
+        os.write(master, b'k')
+
+    answering = threading.Thread(target=arduino)
+    answering.start()
+    gripper = Gripper(path, ack=b'k', timeout=2, startup=0)
+    try:
+        start = time.monotonic()
+        gripper.close()
+        assert time.monotonic() - start >= 0.1
+        assert gripper.state == CLOSE
+        assert gripper.metrics[CLOSE].sent == 1
+    finally:
+        answering.join()
+        gripper.shutdown()
+        os.close(master)
+        os.close(slave)
+
+
+def test_missing_acknowledgement_raises_timeout():
+    master, slave, path = pseudo_terminal()
+    gripper = Gripper(path, ack=b'k', timeout=0.2, startup=0)
+    try:
+        with pytest.raises(TimeoutError):
+            gripper.close()
+        assert received(master) == CLOSE
+        # nobody knows where the gripper ended up
+        assert gripper.state is None
+    finally:
+        gripper.shutdown()
+        os.close(master)
+        os.close(slave)
+
+
+def test_timed_command_returns_at_once_and_wait_blocks_until_done():
+    master, slave, path = pseudo_terminal()
+    gripper = Gripper(path, actuation_time=0.3, startup=0)
+    try:
+        start = time.monotonic()
+        gripper.open(wait=False)
+        assert time.monotonic() - start < 0.2
+        gripper.wait()
+        assert time.monotonic() - start >= 0.3
+        assert received(master) == OPEN
+    finally:
+        gripper.shutdown()
+        os.close(master)
+        os.close(slave)
+
+
+def test_command_for_the_current_state_is_skipped():
+    master, slave, path = pseudo_terminal()
+    gripper = Gripper(path, actuation_time=0, startup=0)
+    try:
+        gripper.open()
+        gripper.open()
+        assert received(master) == OPEN
+        assert gripper.metrics[OPEN].sent == 1
+        assert gripper.metrics[OPEN].skipped == 1
+        gripper.open(force=True)
+        assert received(master) == OPEN
+    finally:
+        gripper.shutdown()
+        os.close(master)
+        os.close(slave)
+
+
+def test_shutdown_waits_for_the_last_command_and_logs_the_metrics(caplog):
+    master, slave, path = pseudo_terminal()
+    gripper = Gripper(path, actuation_time=0.2, startup=0)
+    try:
+        gripper.close(wait=False)
+        with caplog.at_level('INFO', logger='gripper'):
+            gripper.shutdown()
+        metrics = gripper.metrics[CLOSE]
+        assert metrics.sent == 1
+        assert metrics.total_seconds >= 0.2
+        assert 'close [sent=1 skipped=0' in caplog.text
+    finally:
+        os.close(master)
+        os.close(slave)
@@ -0,0 +1,25 @@
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+
+
+def imported_after(statement):
+    '''Top-level packages in sys.modules after running statement in a fresh interpreter from src/'''
+    code = '{}\nimport sys\nprint(" ".join(sorted({{name.split(".")[0] for name in sys.modules}})))'.format(statement)
+    output = subprocess.run([sys.executable, '-c', code], cwd=str(SRC), check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return set(output.split())
+
+
+def test_main_does_not_import_scipy():
+    assert 'scipy' not in imported_after('import main')
+
+
+def test_clustering_imports_scipy_on_first_use():
+    assert 'scipy' in imported_after('import numpy, cluster; cluster.cluster_labels(numpy.zeros((2, 2)), 1.0)')
+
+
+def test_main_leaves_the_optional_subsystems_to_their_first_use():
+    assert not imported_after('import main') & {'pandas', 'cluster', 'detect_server', 'planner', 'session'}
@@ -0,0 +1,40 @@
+import numpy as np
+
+from planner import plan_route, route_time, scan_waypoints
+
+
+def test_plan_route_is_a_permutation_no_slower_than_detection_order():
+    rng = np.random.default_rng(0)
+    targets = rng.uniform((0, 0), (2400, 1200), size=(40, 2))
+    start = (0, 0)
+    order = plan_route(targets, start=start)
+    assert sorted(order.tolist()) == list(range(len(targets)))
+    assert route_time(targets, order, start) <= route_time(targets, range(len(targets)), start)
+
+
+def test_plan_route_of_no_targets_is_empty():
+    assert len(plan_route(np.empty((0, 2)), start=(0, 0))) == 0
+
+
+def test_scan_waypoints_cover_the_region():
+    footprint = (-150, 150, -100, 100)
+    roi = (100, 1500, 50, 900)
+    waypoints = np.array(scan_waypoints(footprint, 0.2, roi), dtype=float)
+    x, y = np.meshgrid(np.linspace(roi[0], roi[1], 57), np.linspace(roi[2], roi[3], 43))
+    points = np.column_stack((x.ravel(), y.ravel()))
+    relative = points[:, None, :] - waypoints[None, :, :]
+    covered = ((relative[..., 0] >= footprint[0] - 1) & (relative[..., 0] <= footprint[1] + 1) &
+               (relative[..., 1] >= footprint[2] - 1) & (relative[..., 1] <= footprint[3] + 1)).any(axis=1)
+    assert covered.all()
+    # 5 photos 240 mm apart cover 1260 of the 1400 mm along x, 5 cover 840 of the 850 mm along y
+    assert len(waypoints) == 6 * 6
+
+
+def test_scan_waypoints_stay_within_reach():
+    # the camera looks ahead of the bot in x and behind it in y, the edge rows of the
+    # bed would be taken from outside it
+    footprint = (100, 400, -300, -100)
+    waypoints = np.array(scan_waypoints(footprint, 0.2, (0, 2400, 0, 1200), reach=(0, 2400, 0, 1200)))
+    assert waypoints[:, 0].min() == 0 and waypoints[:, 0].max() <= 2400
+    assert waypoints[:, 1].min() >= 0 and waypoints[:, 1].max() == 1200
+    assert len(set(map(tuple, waypoints.tolist()))) == len(waypoints)
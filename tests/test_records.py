@@ -0,0 +1,9 @@
+from records import Detection
+
+
+def test_equal_detections_hash_alike():
+    first = Detection(1, 10.0, 20.0, 30.0, 40.0, 90.0)
+    same = Detection(1, 10.0, 20.0, 30.0, 40.0, 90.0)
+    other = first.scaled(2, 2)
+    assert first == same and hash(first) == hash(same)
+    assert len({first, same, other}) == 2
@@ -0,0 +1,45 @@
+from argparse import Namespace
+from pathlib import Path
+
+import numpy as np
+
+from location import cal_location
+from records import Detection
+from session import ScanSession
+
+STATIC = Path(__file__).resolve().parent.parent / 'static'
+
+
+def test_session_locates_like_location_txt_and_annotation_files(tmp_path):
+    files = Namespace(camera_matrix=STATIC / 'camera_no_distortion.mat', offset=STATIC / 'distance.txt',
+                      annotations=tmp_path / 'annotations', locations=tmp_path / 'locations')
+    files.annotations.mkdir()
+    files.locations.mkdir()
+    rng = np.random.default_rng(0)
+    detected = []
+    with ScanSession(str(tmp_path / 'scans.sqlite')) as session:
+        with open(files.locations / 'location.txt', 'w') as locations:
+            for photo in range(6):
+                position = (int(rng.integers(0, 2000)), int(rng.integers(0, 1000)), 0)
+                image = '{:04d}.jpg'.format(photo)
+                session.add_waypoint(photo, position, image)
+                locations.write('{} {} {}\n'.format(*position))
+                detections = [Detection(int(rng.integers(0, 2)), *rng.uniform(0, 700, 4).round(4), 80.0)
+                              for _ in range(3)]
+                detected.append(('../img/' + image, detections))
+                with open(files.annotations / '{:04d}.txt'.format(photo), 'w') as annotations:
+                    for detection in detections:
+                        annotations.write('{} {:.4f} {:.4f} {:.4f} {:.4f} {:.4f}\n'.format(*detection))
+        assert session.add_image_detections(detected) == 6
+
+        from_files = cal_location(files, with_photo=True)
+        from_session = cal_location(files, with_photo=True, session=session)
+        assert len(from_session) == len(from_files) == 18
+        assert np.allclose(np.array(from_session, dtype=float), np.array(from_files, dtype=float))
+
+        region = (0, 1500, 0, 800)
+        expected = [row for row in from_files
+                    if row[0] == 1 and region[0] <= row[1] <= region[1] and region[2] <= row[2] <= region[3]]
+        queried = session.query(region, class_id=1)
+        assert 0 < len(queried) == len(expected)
+        assert np.allclose(sorted(queried.tolist()), sorted(expected))